@@ -49,6 +49,7 @@ def create_app(config_name=None):
     from app.models.logs import LogExecution
     from app.models.user import User, DeletionRequest
     from app.models.notification import Notification
+    from app.models.blobs import BlobSource, ReferenceBlob
 
     # User loader for Flask-Login
     @login_manager.user_loader
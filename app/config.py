@@ -7,6 +7,12 @@ class Config:
     
     # Folder configuration
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads/source')
+    # État des uploads par morceaux en cours (reprise après interruption)
+    CHUNKED_UPLOAD_FOLDER = os.environ.get('CHUNKED_UPLOAD_FOLDER', 'uploads/chunked')
+    # Stockage des fichiers sources par empreinte de contenu (un seul exemplaire par contenu)
+    BLOB_FOLDER = os.environ.get('BLOB_FOLDER', 'uploads/blobs')
+    # Empreintes de clés de chaque comparaison (suivi des écarts nouveaux / résolus entre exécutions)
+    SNAPSHOT_FOLDER = os.environ.get('SNAPSHOT_FOLDER', 'uploads/snapshots')
     
     # Active ou non l'auto migration (utile pour ne pas migrer en prod automatiquement)
     AUTO_MIGRATION = os.environ.get('AUTO_MIGRATION', 'false').lower() == 'true'
@@ -15,6 +21,42 @@ class Config:
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
     ENABLE_GPT_PROCESSING = os.environ.get('ENABLE_GPT_PROCESSING', 'false').lower() == 'true'
     
+    # Stockage des colonnes texte des DataFrames : 'object' (par défaut) ou 'pyarrow' (string[pyarrow], nécessite pyarrow)
+    STRING_STORAGE = os.environ.get('STRING_STORAGE', 'object').lower()
+    
+    # Lecture CSV par blocs : 'pandas' (séquentiel) ou 'parallel' (plages d'octets analysées sur plusieurs processus)
+    CSV_READER_BACKEND = os.environ.get('CSV_READER_BACKEND', 'pandas').lower()
+    CSV_PARALLEL_WORKERS = int(os.environ.get('CSV_PARALLEL_WORKERS', 0)) or None  # None = nombre de CPU
+    CSV_PARALLEL_RANGE_MB = int(os.environ.get('CSV_PARALLEL_RANGE_MB', 32))
+    
+    # Comparaison des gros fichiers par index de clés persistants (réutilisés si un fichier est inchangé)
+    KEY_INDEX_COMPARISON = os.environ.get('KEY_INDEX_COMPARISON', 'true').lower() == 'true'
+    
+    # Planificateur de stratégie : débit disque estimé (Mo/s) et historique prévu/réel servant à la calibration
+    DISK_THROUGHPUT_MB_S = float(os.environ.get('DISK_THROUGHPUT_MB_S', 200))
+    PLANNER_CALIBRATION_FILE = os.environ.get('PLANNER_CALIBRATION_FILE', 'uploads/planner/calibration.jsonl')
+    
+    # Graine des échantillons de résultats (mêmes lignes d'exemple d'une exécution à l'autre)
+    SAMPLE_SEED = int(os.environ.get('SAMPLE_SEED', 42))
+    
+    # Normalisation des colonnes de clé (JSON) : {"*": {...}, "colonne": {...}} avec les règles
+    # trim, nfc, casefold, zeros, numeric, date (format strptime) et null (voir app/utils/normalisation_cles.py)
+    KEY_NORMALIZATION = os.environ.get('KEY_NORMALIZATION', '')
+    
+    # Rapprochement flou des clés non appariées : score minimal (Dice sur bigrammes) et nombre maximal de clés
+    FUZZY_MATCH_THRESHOLD = float(os.environ.get('FUZZY_MATCH_THRESHOLD', 0.8))
+    FUZZY_MATCH_MAX_KEYS = int(os.environ.get('FUZZY_MATCH_MAX_KEYS', 200000))
+    
+    # Comparaison multiple (une référence contre plusieurs fichiers) : fichiers indexés en parallèle
+    NWAY_MAX_WORKERS = int(os.environ.get('NWAY_MAX_WORKERS', 4))
+    
+    # Rapprochement par agrégats : écart toléré sur un total, absolu et relatif (0.001 = 0,1 %)
+    AGGREGATE_TOLERANCE_ABS = float(os.environ.get('AGGREGATE_TOLERANCE_ABS', 0.01))
+    AGGREGATE_TOLERANCE_REL = float(os.environ.get('AGGREGATE_TOLERANCE_REL', 0.0))
+    
+    # Ventilation des écarts par colonne de dimension : valeurs suivies par dimension (les plus en écart)
+    BREAKDOWN_TOP_K = int(os.environ.get('BREAKDOWN_TOP_K', 20))
+    
     # Database configuration avec retry et timeout
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_pre_ping': True,
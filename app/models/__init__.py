@@ -1,10 +1,11 @@
 # All models imports - these will be imported after db initialization
 from .projet import Projet
-from .configurations import ConfigurationCleComposee
+from .configurations import ConfigurationCleComposee, RegleComparaison
 from .statistiques import StatistiqueEcart
 from .fichier_genere import FichierGenere
 from .logs import LogExecution
 from .migration_history import MigrationHistory
+from .blobs import BlobSource, ReferenceBlob
 from app import db
 
-__all__ = ['Projet', 'ConfigurationCleComposee', 'StatistiqueEcart', 'FichierGenere', 'LogExecution', 'MigrationHistory', 'db']
+__all__ = ['Projet', 'ConfigurationCleComposee', 'RegleComparaison', 'StatistiqueEcart', 'FichierGenere', 'LogExecution', 'MigrationHistory', 'BlobSource', 'ReferenceBlob', 'db']
@@ -0,0 +1,29 @@
+from datetime import datetime
+from app import db
+
+class BlobSource(db.Model):
+    """Fichier source stocké une seule fois, identifié par l'empreinte SHA-256 de son contenu"""
+    __tablename__ = 'blobs_sources'
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    taille = db.Column(db.BigInteger, nullable=False)
+    chemin = db.Column(db.String(512), nullable=False)
+    nom_origine = db.Column(db.String(255))
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+
+    references = db.relationship("ReferenceBlob", backref="blob", lazy=True)
+
+    def __repr__(self):
+        return f'<BlobSource {self.sha256[:12]}>'
+
+class ReferenceBlob(db.Model):
+    """Lien d'un projet vers un blob : le blob est supprimé quand il n'a plus de référence"""
+    __tablename__ = 'references_blobs'
+    id = db.Column(db.Integer, primary_key=True)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blobs_sources.id'), nullable=False, index=True)
+    projet_id = db.Column(db.Integer, db.ForeignKey('projets.id'), nullable=False, index=True)
+    chemin_lien = db.Column(db.String(512), nullable=False)
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ReferenceBlob Project:{self.projet_id} Blob:{self.blob_id}>'
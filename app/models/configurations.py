@@ -9,3 +9,22 @@ class ConfigurationCleComposee(db.Model):
 
     def __repr__(self):
         return f'<ConfigurationCleComposee {self.fichier}>'
+
+
+class RegleComparaison(db.Model):
+    __tablename__ = 'regles_comparaison'
+    id = db.Column(db.Integer, primary_key=True)
+    projet_id = db.Column(db.Integer, db.ForeignKey('projets.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Colonne du fichier 1 (les colonnes du fichier 2 alignées prennent son nom)
+    colonne = db.Column(db.String(255), nullable=False)
+    type = db.Column(db.Enum('numerique', 'date', 'texte', 'ignorer'), nullable=False)
+    tolerance_abs = db.Column(db.Float, nullable=True)
+    # Tolérance relative (fraction de la plus grande des deux valeurs, 0.01 = 1 %)
+    tolerance_rel = db.Column(db.Float, nullable=True)
+    # Granularité des dates : 'jour', 'heure', 'minute' ou 'seconde'
+    granularite = db.Column(db.String(20), nullable=True)
+    ignorer_casse = db.Column(db.Boolean, default=False)
+    ignorer_espaces = db.Column(db.Boolean, default=False)
+
+    def __repr__(self):
+        return f'<RegleComparaison {self.colonne}:{self.type}>'
@@ -21,6 +21,8 @@ class Projet(db.Model):
     stats = db.relationship("StatistiqueEcart", backref="projet", lazy=True, cascade="all, delete-orphan")
     fichiers = db.relationship("FichierGenere", backref="projet", lazy=True, cascade="all, delete-orphan")
     logs = db.relationship("LogExecution", backref="projet", lazy=True)
+    blob_references = db.relationship("ReferenceBlob", backref="projet", lazy=True, cascade="all, delete-orphan")
+    regles = db.relationship("RegleComparaison", backref="projet", lazy=True, cascade="all, delete-orphan")
 
     def __repr__(self):
         return f'<Projet {self.nom_projet}>'
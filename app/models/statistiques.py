@@ -9,6 +9,10 @@ class StatistiqueEcart(db.Model):
     nb_ecarts_uniquement_fichier2 = db.Column(db.Integer)
     nb_ecarts_communs = db.Column(db.Integer)
     date_execution = db.Column(db.DateTime, default=datetime.utcnow)
+    # Snapshot des empreintes de clés par catégorie (.npz), pour le suivi des évolutions entre exécutions
+    chemin_empreintes = db.Column(db.String(512), nullable=True)
+    # Ventilation des écarts par valeur des colonnes de dimension (JSON, valeurs les plus en écart)
+    ventilation = db.Column(db.Text, nullable=True)
 
     def __repr__(self):
         return f'<StatistiqueEcart Project:{self.projet_id}>'
@@ -1,6 +1,8 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
+from flask_login import current_user
 from io import StringIO
 import pandas as pd
+import json
 import os
 from app import db
 from app.models import Projet, ConfigurationCleComposee, StatistiqueEcart
@@ -9,7 +11,16 @@ from app.models.fichier_genere import FichierGenere
 from app.services.comparateur import ComparateurFichiers
 from app.services.comparateur_optimise import ComparateurFichiersOptimise, compare_large_files
 from app.services.comparateur_mysql_integre import ComparateurFichiersAvecMySQL, comparer_fichiers_avec_mysql
-from app.services.generateur_excel import GenerateurExcel
+from app.services.empreintes_cles import save_snapshot
+from app.services.generateur_excel import GenerateurExcel, generer_rapport_multiple, generer_rapport_agregats
+from app.services.comparateur_multiple import comparer_reference_multiple
+from app.services.rapprochement_agregats import rapprocher_agregats
+from app.services.filtres_lignes import construire_predicats
+from app.services.regles_comparaison import normaliser_regle, enregistrer_regles
+from app.services.alignement_colonnes import correspondance_colonnes
+from app.services.stockage_contenu import save_upload_with_hash, store_file, link_to_project
+from app.utils.compression import split_file_name
+from app.utils.string_storage import to_string_storage
 from app.services.generateur_pdf import GenerateurPdf
 from datetime import datetime, timedelta
 import glob
@@ -37,6 +48,72 @@ def cleanup_old_temp_files(temp_dir, max_age_hours=24):
     except Exception as e:
         print(f"Error during temp file cleanup: {e}")
 
+def _lire_json_session(path):
+    """
+    Small-path frame saved by the upload: values read back as the text that was saved (no dtype or date
+    inference, '00123' stays '00123'), like the readers of the large path
+    """
+    return to_string_storage(pd.read_json(path, dtype=False, convert_dates=False))
+
+def _predicats_formulaire():
+    """Row predicates of both files from the comparison form (period and segment values are shared)"""
+    debut = request.form.get('date_debut', '').strip()
+    fin = request.form.get('date_fin', '').strip()
+    valeurs = request.form.get('segment_values', '').split(',')
+    predicats1, predicats2 = (construire_predicats(request.form.get(f'date_column{numero}'), debut, fin,
+                                                   request.form.get(f'segment_column{numero}'), valeurs)
+                              for numero in (1, 2))
+    # A filter on one file only would report every excluded row of the other file as a difference
+    if ['valeurs' in p for p in predicats1] != ['valeurs' in p for p in predicats2]:
+        raise ValueError("Veuillez choisir les colonnes de filtre dans les deux fichiers.")
+    return predicats1, predicats2
+
+def _colonnes_formulaire():
+    """Exported columns of both files from the comparison form (None = every column)"""
+    return tuple([c.strip() for c in request.form.getlist(f'export_columns{numero}') if c.strip()] or None
+                 for numero in (1, 2))
+
+def _correspondance_formulaire():
+    """
+    Column alignment confirmed in the comparison form ({colonne2: colonne1}): proposed pairs left empty are rejected
+    """
+    paires = [{'colonne1': colonne1.strip(), 'colonne2': colonne2.strip()}
+              for colonne1, colonne2 in zip(request.form.getlist('alignement_colonne1'),
+                                            request.form.getlist('alignement_colonne2'))
+              if colonne1.strip() and colonne2.strip()]
+    colonnes2 = [paire['colonne2'] for paire in paires]
+    if len(set(colonnes2)) != len(colonnes2):
+        raise ValueError("Une colonne du fichier 2 ne peut être alignée que sur une seule colonne du fichier 1.")
+    return correspondance_colonnes(paires)
+
+def _dimensions_formulaire():
+    """Dimension columns (file 1) the discrepancies are broken down by, from the comparison form"""
+    return [c.strip() for c in request.form.getlist('breakdown_columns') if c.strip()]
+
+def _regles_formulaire():
+    """Comparison rules of the value diff from the comparison form, by file 1 column"""
+    def _nombre(valeur):
+        valeur = valeur.strip().replace(' ', '').replace(',', '.')
+        try:
+            return float(valeur) if valeur else None
+        except ValueError:
+            raise ValueError(f"Tolérance invalide : {valeur}")
+
+    regles = {}
+    lignes = zip(*(request.form.getlist(f'regle_{champ}')
+                   for champ in ('colonne', 'type', 'tolerance_abs', 'tolerance_rel', 'granularite', 'texte')))
+    for colonne, genre, tolerance_abs, tolerance_rel, granularite, texte in lignes:
+        tolerance_rel = _nombre(tolerance_rel)
+        regle = normaliser_regle({'type': genre, 'tolerance_abs': _nombre(tolerance_abs),
+                                  # Relative tolerance entered as a percentage
+                                  'tolerance_rel': tolerance_rel / 100 if tolerance_rel else None,
+                                  'granularite': granularite, 'ignorer_casse': 'casse' in texte.split(','),
+                                  'ignorer_espaces': 'espaces' in texte.split(',')})
+        if regle:
+            regles[colonne.strip()] = regle
+    return regles
+
+
 @comparaison_bp.route('/compare', methods=['POST'])
 def compare():
     keys1 = [k.strip() for k in request.form.getlist('key1')]
@@ -61,6 +138,42 @@ def compare():
         flash("Aucun projet sélectionné. Veuillez sélectionner un projet avant de comparer.", "error")
         return redirect(url_for('projets.index'))
 
+    # Optional fuzzy matching of the keys left unmatched in both files
+    fuzzy_matching = request.form.get('fuzzy_matching') == 'on'
+
+    # Optional row predicates (period, segment) pushed down into the readers
+    try:
+        predicats1, predicats2 = _predicats_formulaire()
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for('projets.index'))
+
+    # Optional column projection: only the keys, the filter columns and these columns are read
+    colonnes1, colonnes2 = _colonnes_formulaire()
+
+    # Optional value comparison of the matched rows (identical / modified)
+    comparer_valeurs = request.form.get('compare_values') == 'on'
+
+    # Per-column comparison rules (tolerances, date granularity, text, ignored columns), saved with the project
+    try:
+        regles = _regles_formulaire()
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for('projets.index'))
+    if projet_id and 'regle_colonne' in request.form:
+        enregistrer_regles(projet_id, regles)
+        db.session.commit()
+
+    # Optional breakdown of the discrepancies by dimension columns (category, entity, region...)
+    dimensions = _dimensions_formulaire()
+
+    # Column alignment confirmed by the user (file 2 columns renamed after file 1)
+    try:
+        column_mapping = _correspondance_formulaire()
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for('projets.index'))
+
     # Check if we're dealing with large files
     is_large_files = session.get('is_large_files', False)
     
@@ -84,7 +197,16 @@ def compare():
                 projet_id=projet_id if not is_fast_test else None,
                 chunk_size=5000,
                 sample_size=50000,  # Increased from 1000 to 50000 for full results
-                use_mysql_temp=False  # Use SQLite for temp processing, MySQL for persistence
+                use_mysql_temp=False,  # Use SQLite for temp processing, MySQL for persistence
+                fuzzy_matching=fuzzy_matching,
+                column_mapping=column_mapping,
+                predicats1=predicats1,
+                predicats2=predicats2,
+                colonnes1=colonnes1,
+                colonnes2=colonnes2,
+                comparer_valeurs=comparer_valeurs,
+                regles=regles,
+                dimensions=dimensions
             )
             
         except Exception as e:
@@ -94,8 +216,8 @@ def compare():
     else:
         # Use regular comparison for smaller files
         try:
-            df = pd.read_json(session['df_path'])
-            df2 = pd.read_json(session['df2_path'])
+            df = _lire_json_session(session['df_path'])
+            df2 = _lire_json_session(session['df2_path'])
         except Exception as e:
             flash(f"Erreur lors du chargement des fichiers JSON : {e}", "error")
             return redirect(url_for('projets.index'))
@@ -105,8 +227,12 @@ def compare():
         df2.columns = df2.columns.str.strip()
 
         # Use the comparator service
-        comparateur = ComparateurFichiers(df, df2, keys1, keys2)
-        results = comparateur.comparer()
+        comparateur = ComparateurFichiers(df, df2, keys1, keys2, column_mapping=column_mapping,
+                                          predicats1=predicats1, predicats2=predicats2,
+                                          colonnes1=colonnes1, colonnes2=colonnes2, dimensions=dimensions)
+        results = comparateur.comparer(fuzzy_matching=fuzzy_matching,
+                                       fuzzy_threshold=current_app.config.get('FUZZY_MATCH_THRESHOLD', 0.8),
+                                       comparer_valeurs=comparer_valeurs, regles=regles)
         
         # Save configurations and statistics to MySQL manually for regular comparison (only if not fast test)
         if not is_fast_test and projet_id:
@@ -138,10 +264,14 @@ def compare():
                     nb_ecarts_uniquement_fichier1=results['n1'],
                     nb_ecarts_uniquement_fichier2=results['n2'],
                     nb_ecarts_communs=results['n_common'],
-                    date_execution=datetime.now()
+                    date_execution=datetime.now(),
+                    ventilation=json.dumps(results['ventilation']) if results.get('ventilation') else None
                 )
                 db.session.add(stat)
                 db.session.commit()
+                
+                # Key hashes of this run, for churn reports between runs
+                save_snapshot(stat, results.get('empreintes'))
             else:
                 print(f"DEBUG: Skipping duplicate statistics for project {projet_id} - recent entry found in regular comparison")
 
@@ -175,7 +305,8 @@ def compare():
                     results['ecarts_fichier1'], 
                     results['ecarts_fichier2'], 
                     results['communs'],
-                    treatment_folder  # Save to treatment folder instead of project folder
+                    treatment_folder,  # Save to treatment folder instead of project folder
+                    lignes_modifiees=results.get('lignes_modifiees')
                 )
                 
                 # Save Excel file to treatment folder
@@ -375,6 +506,13 @@ def compare():
     ecarts1_total = len(results['ecarts_fichier1'])
     ecarts2_total = len(results['ecarts_fichier2'])
     communs_total = len(results['communs'])
+    rapprochements = results.get('rapprochements_flous')
+    rapprochements_display = (rapprochements.head(max_display_rows).to_dict(orient='records')
+                              if rapprochements is not None else None)
+    lignes_modifiees = results.get('lignes_modifiees')
+    modifiees_display = (lignes_modifiees.drop(columns=['_compare_key'], errors='ignore')
+                         .head(max_display_rows).to_dict(orient='records')
+                         if lignes_modifiees is not None else None)
     
     # Create filtered results without the DataFrame objects to avoid conflicts
     # Only include simple types that are JSON serializable
@@ -388,7 +526,10 @@ def compare():
         'nb_df2': results.get('nb_df2', 0),
         'pct1': results.get('pct1', 0),
         'pct2': results.get('pct2', 0),
-        'pct_both': results.get('pct_both', 0)
+        'pct_both': results.get('pct_both', 0),
+        'n_fuzzy': results.get('n_fuzzy'),
+        # Identical / modified matched rows and mismatches per column (value comparison)
+        'diff_valeurs': results.get('diff_valeurs')
     }
     
     # Store DataFrames in temporary files for download routes (avoid session size issues)
@@ -411,7 +552,9 @@ def compare():
         'file1_name': session.get('file1_name', 'Fichier 1'),
         'file2_name': session.get('file2_name', 'Fichier 2'),
         'total1': results.get('nb_df', 0),
-        'total2': results.get('nb_df2', 0)
+        'total2': results.get('nb_df2', 0),
+        'rapprochements_flous': results.get('rapprochements_flous'),
+        'lignes_modifiees': lignes_modifiees
     }
     
     # Write pickle file to persistent temp directory
@@ -444,6 +587,10 @@ def compare():
                            ecarts2_total=ecarts2_total,
                            communs_total=communs_total,
                            max_display_rows=max_display_rows,
+                           rapprochements=rapprochements_display,
+                           lignes_modifiees=modifiees_display,
+                           # Breakdown by dimension kept out of the session (size)
+                           ventilation=results.get('ventilation'),
                            file1_name=file1_name,
                            file2_name=file2_name,
                            **filtered_results)
@@ -457,6 +604,39 @@ def fast_compare():
         flash("Veuillez sélectionner au moins une clé dans chaque fichier.", "error")
         return redirect(url_for('projets.index'))
 
+    # Optional fuzzy matching of the keys left unmatched in both files
+    fuzzy_matching = request.form.get('fuzzy_matching') == 'on'
+
+    # Optional row predicates (period, segment) pushed down into the readers
+    try:
+        predicats1, predicats2 = _predicats_formulaire()
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for('projets.index'))
+
+    # Optional column projection: only the keys, the filter columns and these columns are read
+    colonnes1, colonnes2 = _colonnes_formulaire()
+
+    # Optional value comparison of the matched rows (identical / modified)
+    comparer_valeurs = request.form.get('compare_values') == 'on'
+
+    # Per-column comparison rules (tolerances, date granularity, text, ignored columns)
+    try:
+        regles = _regles_formulaire()
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for('projets.index'))
+
+    # Optional breakdown of the discrepancies by dimension columns (category, entity, region...)
+    dimensions = _dimensions_formulaire()
+
+    # Column alignment confirmed by the user (file 2 columns renamed after file 1)
+    try:
+        column_mapping = _correspondance_formulaire()
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for('projets.index'))
+
     # Check if we're dealing with large files
     is_large_files = session.get('is_large_files', False)
     
@@ -470,6 +650,19 @@ def fast_compare():
             return redirect(url_for('projets.index'))
         
         print("Using optimized fast comparison for large files...")
+        
+        # Approximate mode: percentage of the key hash space compared (empty = exact comparison)
+        sampling_fraction = None
+        sampling_percent = request.form.get('sampling_percent', '').strip()
+        if sampling_percent:
+            try:
+                sampling_fraction = float(sampling_percent.replace(',', '.')) / 100
+            except ValueError:
+                sampling_fraction = None
+            if sampling_fraction is None or not 0 < sampling_fraction <= 1:
+                flash("Le pourcentage d'échantillonnage doit être compris entre 0 et 100.", "error")
+                return redirect(url_for('projets.index'))
+        
         try:
             # Use optimized comparator with smaller sample for fast comparison
             results = comparer_fichiers_avec_mysql(
@@ -480,7 +673,17 @@ def fast_compare():
                 projet_id=None,  # No project for fast tests
                 chunk_size=3000,  # Smaller chunks for faster processing
                 sample_size=5000,  # Increased from 500 to 5000 for better fast test results
-                use_mysql_temp=False
+                use_mysql_temp=False,
+                sampling_fraction=sampling_fraction,
+                fuzzy_matching=fuzzy_matching,
+                column_mapping=column_mapping,
+                predicats1=predicats1,
+                predicats2=predicats2,
+                colonnes1=colonnes1,
+                colonnes2=colonnes2,
+                comparer_valeurs=comparer_valeurs,
+                regles=regles,
+                dimensions=dimensions
             )
             
         except Exception as e:
@@ -490,8 +693,8 @@ def fast_compare():
     else:
         # Use regular comparison for smaller files
         try:
-            df = pd.read_json(session['df_path'])
-            df2 = pd.read_json(session['df2_path'])
+            df = _lire_json_session(session['df_path'])
+            df2 = _lire_json_session(session['df2_path'])
         except Exception as e:
             flash(f"Erreur lors de la lecture des fichiers JSON : {e}", "error")
             return redirect(url_for('projets.index'))
@@ -505,8 +708,12 @@ def fast_compare():
             return redirect(url_for('projets.index'))
 
         # Appeler ton comparateur personnalisé
-        comparateur = ComparateurFichiers(df, df2, keys1, keys2)
-        results = comparateur.comparer()
+        comparateur = ComparateurFichiers(df, df2, keys1, keys2, column_mapping=column_mapping,
+                                          predicats1=predicats1, predicats2=predicats2,
+                                          colonnes1=colonnes1, colonnes2=colonnes2, dimensions=dimensions)
+        results = comparateur.comparer(fuzzy_matching=fuzzy_matching,
+                                       fuzzy_threshold=current_app.config.get('FUZZY_MATCH_THRESHOLD', 0.8),
+                                       comparer_valeurs=comparer_valeurs, regles=regles)
 
     # Limit displayed results for performance (show only first 50 rows)
     max_display_rows = 50
@@ -518,6 +725,13 @@ def fast_compare():
     ecarts1_total = len(results['ecarts_fichier1'])
     ecarts2_total = len(results['ecarts_fichier2'])
     communs_total = len(results['communs'])
+    rapprochements = results.get('rapprochements_flous')
+    rapprochements_display = (rapprochements.head(max_display_rows).to_dict(orient='records')
+                              if rapprochements is not None else None)
+    lignes_modifiees = results.get('lignes_modifiees')
+    modifiees_display = (lignes_modifiees.drop(columns=['_compare_key'], errors='ignore')
+                         .head(max_display_rows).to_dict(orient='records')
+                         if lignes_modifiees is not None else None)
     
     # Create filtered results without the DataFrame objects to avoid conflicts
     # Only include simple types that are JSON serializable
@@ -531,7 +745,12 @@ def fast_compare():
         'nb_df2': results.get('nb_df2', 0),
         'pct1': results.get('pct1', 0),
         'pct2': results.get('pct2', 0),
-        'pct_both': results.get('pct_both', 0)
+        'pct_both': results.get('pct_both', 0),
+        # Estimates with confidence intervals in approximate mode
+        'approximation': results.get('approximation'),
+        'n_fuzzy': results.get('n_fuzzy'),
+        # Identical / modified matched rows and mismatches per column (value comparison)
+        'diff_valeurs': results.get('diff_valeurs')
     }
 
     # Store DataFrames in temporary files for download routes (avoid session size issues)
@@ -554,7 +773,9 @@ def fast_compare():
         'file1_name': session.get('file1_name', 'Fichier 1'),
         'file2_name': session.get('file2_name', 'Fichier 2'),
         'total1': results.get('nb_df', 0),
-        'total2': results.get('nb_df2', 0)
+        'total2': results.get('nb_df2', 0),
+        'rapprochements_flous': results.get('rapprochements_flous'),
+        'lignes_modifiees': lignes_modifiees
     }
     
     # Write pickle file to persistent temp directory
@@ -575,6 +796,209 @@ def fast_compare():
                            ecarts2_total=ecarts2_total,
                            communs_total=communs_total,
                            max_display_rows=max_display_rows,
+                           rapprochements=rapprochements_display,
+                           lignes_modifiees=modifiees_display,
+                           # Breakdown by dimension kept out of the session (size)
+                           ventilation=results.get('ventilation'),
                            file1_name=session.get('file1_name', 'Fichier 1'),
                            file2_name=session.get('file2_name', 'Fichier 2'),
                            **filtered_results)
+
+@comparaison_bp.route('/compare_multiple', methods=['GET', 'POST'])
+def compare_multiple():
+    """One reference file against several files: per-file buckets, presence matrix and one consolidated treatment"""
+    if not current_user.is_authenticated:
+        flash('Vous devez être connecté pour créer ou modifier un projet.', 'error')
+        return redirect(url_for('auth.login'))
+
+    projets = Projet.query.all()
+    if request.method == 'GET':
+        return render_template('compare_multiple.html', projets=projets)
+
+    reference = request.files.get('reference')
+    fichiers = [f for f in request.files.getlist('fichiers') if f and f.filename]
+    reference_keys = [k.strip() for k in request.form.get('key_reference', '').split(',') if k.strip()]
+    # Same key column names in every file unless given separately
+    fichiers_keys = [k.strip() for k in request.form.get('key_fichiers', '').split(',') if k.strip()] or reference_keys
+    projet_id = request.form.get('existing_project')
+
+    if not reference or not reference.filename or not fichiers:
+        flash("Veuillez sélectionner le fichier de référence et au moins un fichier à comparer.", "error")
+        return render_template('compare_multiple.html', projets=projets)
+    if not reference_keys:
+        flash("Veuillez indiquer les colonnes de la clé (séparées par des virgules).", "error")
+        return render_template('compare_multiple.html', projets=projets)
+    projet = Projet.query.get(int(projet_id)) if projet_id else None
+    if not projet:
+        flash("Projet sélectionné introuvable", "error")
+        return render_template('compare_multiple.html', projets=projets)
+
+    # Files stored once in the content store and linked into a folder of the project
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    project_folder = projet.emplacement_archive or os.path.join('uploads', 'archive', f"{projet.nom_projet}_{timestamp}")
+    upload_folder = os.path.join(project_folder, f"multiple_{timestamp}")
+    os.makedirs(upload_folder, exist_ok=True)
+    paths = []
+    for position, storage in enumerate([reference] + fichiers):
+        name, ext = split_file_name(storage.filename)
+        path = os.path.join(upload_folder, f"{position}_{name}_{timestamp}_original{ext}")
+        sha256 = save_upload_with_hash(storage, f"{path}.upload")
+        blob = store_file(f"{path}.upload", storage.filename, sha256)
+        link_to_project(blob, projet, path)
+        paths.append(path)
+    if not projet.emplacement_archive:
+        projet.emplacement_source = project_folder
+        projet.emplacement_archive = project_folder
+        db.session.commit()
+
+    try:
+        results = comparer_reference_multiple(
+            paths[0], reference_keys,
+            [{'path': path, 'keys': fichiers_keys, 'nom': f"{position}. {storage.filename}"}
+             for position, (path, storage) in enumerate(zip(paths[1:], fichiers), start=1)],
+            sample_size=1000
+        )
+    except Exception as e:
+        db.session.add(LogExecution(projet_id=projet.id, statut='échec',
+                                    message=f"Échec de la comparaison multiple: {str(e)}"))
+        db.session.commit()
+        flash(f"Erreur lors de la comparaison multiple : {e}", "error")
+        return render_template('compare_multiple.html', projets=projets)
+
+    # One treatment for the whole run, with the consolidated report
+    treatment_folder = os.path.join(project_folder, f"treatment_{timestamp}")
+    os.makedirs(treatment_folder, exist_ok=True)
+    excel_filename = f"rapport_comparaison_multiple_{timestamp}.xlsx"
+    try:
+        generer_rapport_multiple(results, os.path.join(treatment_folder, excel_filename))
+        db.session.add(FichierGenere(
+            projet_id=projet.id,
+            nom_traitement_projet=f"Traitement_multiple_{timestamp}",
+            nom_fichier_excel=f"treatment_{timestamp}/{excel_filename}",
+            chemin_archive=treatment_folder,
+            date_execution=datetime.now()
+        ))
+        flash("Comparaison multiple terminée ! Le rapport consolidé a été sauvegardé dans le dossier d'archive du projet.", "success")
+    except Exception as e:
+        print(f"Erreur lors de la génération du rapport consolidé: {e}")
+        flash("Comparaison multiple terminée, mais le rapport consolidé n'a pas pu être sauvegardé.", "warning")
+    db.session.add(LogExecution(
+        projet_id=projet.id,
+        statut='succès',
+        message=f"Comparaison multiple: {reference.filename} contre {len(fichiers)} fichiers, "
+                f"{results['matrice']['n_partout']} / {results['matrice']['n_cles']} clés présentes partout "
+                f"en {results['duree_s']}s"
+    ))
+    db.session.commit()
+
+    max_display_rows = 50
+    return render_template('compare_multiple.html',
+                           projets=projets,
+                           nom_projet=projet.nom_projet,
+                           reference_name=reference.filename,
+                           reference=results['reference'],
+                           fichiers=[{**{k: v for k, v in fichier.items() if not k.startswith('ecarts_')},
+                                      'ecarts_reference': fichier['ecarts_reference'].head(max_display_rows).to_dict(orient='records'),
+                                      'ecarts_fichier': fichier['ecarts_fichier'].head(max_display_rows).to_dict(orient='records')}
+                                     for fichier in results['fichiers']],
+                           matrice={**results['matrice'],
+                                    'echantillon': results['matrice']['echantillon'].head(max_display_rows).to_dict(orient='records')},
+                           max_display_rows=max_display_rows,
+                           duree_s=results['duree_s'])
+
+
+@comparaison_bp.route('/compare_aggregates', methods=['POST'])
+def compare_aggregates():
+    """Reconcile the two uploaded files on their totals per group (no row-level join)"""
+    groups1 = [k.strip() for k in request.form.getlist('group1')]
+    groups2 = [k.strip() for k in request.form.getlist('group2')]
+    measures1 = [k.strip() for k in request.form.getlist('measures1')]
+    measures2 = [k.strip() for k in request.form.getlist('measures2')]
+
+    if not groups1 or len(groups1) != len(groups2):
+        flash("Veuillez sélectionner le même nombre de colonnes de regroupement dans chaque fichier.", "error")
+        return redirect(url_for('projets.index'))
+    if len(measures1) != len(measures2):
+        flash("Veuillez sélectionner le même nombre de mesures dans chaque fichier.", "error")
+        return redirect(url_for('projets.index'))
+    try:
+        tolerance_abs = float(request.form['tolerance_abs']) if request.form.get('tolerance_abs') else None
+        # Relative tolerance entered as a percentage
+        tolerance_rel = float(request.form['tolerance_rel']) / 100 if request.form.get('tolerance_rel') else None
+    except ValueError:
+        flash("Les tolérances doivent être des nombres.", "error")
+        return redirect(url_for('projets.index'))
+
+    projet_id = session.get("projet_id")
+    if session.get('is_large_files', False):
+        # Large files are streamed in chunks from their stored copies
+        file1, file2 = session.get('file1_path'), session.get('file2_path')
+        if not file1 or not file2:
+            flash("Chemins des fichiers non trouvés pour le rapprochement par agrégats.", "error")
+            return redirect(url_for('projets.index'))
+    else:
+        try:
+            file1 = _lire_json_session(session['df_path'])
+            file2 = _lire_json_session(session['df2_path'])
+        except Exception as e:
+            flash(f"Erreur lors du chargement des fichiers JSON : {e}", "error")
+            return redirect(url_for('projets.index'))
+        file1.columns = file1.columns.str.strip()
+        file2.columns = file2.columns.str.strip()
+
+    try:
+        results = rapprocher_agregats(file1, file2, groups1, groups2, measures1, measures2,
+                                      tolerance_abs=tolerance_abs, tolerance_rel=tolerance_rel)
+    except Exception as e:
+        if projet_id:
+            db.session.add(LogExecution(projet_id=projet_id, statut='échec',
+                                        message=f"Échec du rapprochement par agrégats: {str(e)}"))
+            db.session.commit()
+        flash(f"Erreur lors du rapprochement par agrégats : {e}", "error")
+        return redirect(url_for('projets.index'))
+
+    # Treatment of the project with the Excel report (fast tests are not archived)
+    project_folder = session.get('project_folder')
+    if projet_id and not project_folder:
+        projet = Projet.query.get(projet_id)
+        project_folder = projet.emplacement_archive if projet else None
+    if projet_id and project_folder and os.path.exists(project_folder):
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        treatment_folder = os.path.join(project_folder, f"treatment_{timestamp}")
+        os.makedirs(treatment_folder, exist_ok=True)
+        excel_filename = f"rapport_agregats_{timestamp}.xlsx"
+        try:
+            generer_rapport_agregats(results, os.path.join(treatment_folder, excel_filename))
+            db.session.add(FichierGenere(
+                projet_id=projet_id,
+                nom_traitement_projet=f"Traitement_agregats_{timestamp}",
+                nom_fichier_excel=f"treatment_{timestamp}/{excel_filename}",
+                chemin_archive=treatment_folder,
+                date_execution=datetime.now()
+            ))
+            flash("Rapprochement par agrégats terminé ! Le rapport a été sauvegardé dans le dossier d'archive du projet.", "success")
+        except Exception as e:
+            print(f"Erreur lors de la génération du rapport d'agrégats: {e}")
+            flash("Rapprochement par agrégats terminé, mais le rapport n'a pas pu être sauvegardé.", "warning")
+        db.session.add(LogExecution(
+            projet_id=projet_id,
+            statut='succès',
+            message=f"Rapprochement par agrégats sur {' + '.join(groups1)}: {results['n_groupes']} groupes, "
+                    f"{results['n_ecarts']} en écart, {results['n1']} seulement fichier 1, "
+                    f"{results['n2']} seulement fichier 2 en {results['duree_s']}s"
+        ))
+        db.session.commit()
+
+    max_display_rows = 500
+    agregats = results['agregats']
+    # Groups with differences first
+    ecarts = agregats[agregats['statut'] != 'identique']
+    return render_template('compare_agregats.html',
+                           file1_name=session.get('file1_name', 'Fichier 1'),
+                           file2_name=session.get('file2_name', 'Fichier 2'),
+                           groups1=groups1, groups2=groups2,
+                           measures1=measures1, measures2=measures2,
+                           resultats={k: v for k, v in results.items() if k != 'agregats'},
+                           ecarts=ecarts.head(max_display_rows).to_dict(orient='records'),
+                           colonnes=list(agregats.columns),
+                           max_display_rows=max_display_rows)
@@ -1,23 +1,51 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, send_file, jsonify
 from flask_login import current_user
 from io import StringIO
 import pandas as pd
 import os
+import json
 import uuid
+import fcntl
+from contextlib import contextmanager
 from datetime import datetime
 from app import db
 from app.models import Projet
 from app.models.logs import LogExecution
 from app.models.fichier_genere import FichierGenere
 from app.services.lecteur_fichier import read_uploaded_file
-from app.services.lecteur_fichier_optimise import read_uploaded_file_optimized, LecteurFichierOptimise
+from app.services.lecteur_fichier_optimise import read_uploaded_file_optimized, LecteurFichierOptimise, is_large_file
 from app.services.generateur_excel import GenerateurExcel
 from app.services.generateur_pdf import GenerateurPdf
 from app.services.comparateur import ComparateurFichiers
 from app.services.comparateur_optimise import ComparateurFichiersOptimise, compare_large_files
+from app.utils.compression import split_file_name, get_file_extension, get_compression
+from app.services.profileur_flux import ProfileurFlux, get_profileur, release_profileur
+from app.services.stockage_contenu import save_upload_with_hash, store_file, link_to_project
+from app.services.esquisses import resume_apercu
+from app.services.decouverte_cles import suggerer_cles
+from app.services.regles_comparaison import regles_projet
 
 fichiers_bp = Blueprint('fichiers', __name__)
 
+def estimate_keys_for_preview(lecteur, file1_path, file2_path):
+    """HyperLogLog estimates of key candidates and overlap for the preview (None if profiling fails)"""
+    try:
+        return resume_apercu(lecteur.read_key_sketches(file1_path), lecteur.read_key_sketches(file2_path))
+    except Exception as e:
+        print(f"⚠️ Estimation des clés impossible: {e}")
+        return None
+
+def suggest_keys_for_preview(lecteur, file1_path, file2_path):
+    """
+    Key pairs and column alignment suggested from the file profiles for the comparison form (None if discovery fails).
+    The alignment is only a proposal: the comparison applies the pairs confirmed in the form.
+    """
+    try:
+        return suggerer_cles(lecteur, file1_path, file2_path)
+    except Exception as e:
+        print(f"⚠️ Suggestion des clés impossible: {e}")
+        return None
+
 def render_index_with_errors(file1_error=None, file2_error=None, project_error=None, show_fast_modal=False, show_main_modal=False):
     """Helper function to render index with specific field errors"""
     projets = Projet.query.all()
@@ -34,7 +62,7 @@ def upload_file():
     # Clear only file-related session data to avoid conflicts with previous uploads
     file_session_keys = ['df_path', 'df2_path', 'file1_path', 'file2_path', 'file1_info', 'file2_info', 
                         'is_large_files', 'projet_id', 'file1_name', 'file2_name', 'project_folder',
-                        'download_results_path']
+                        'download_results_path', 'column_mapping']
     for key in file_session_keys:
         session.pop(key, None)
     
@@ -117,16 +145,31 @@ def upload_file():
     os.makedirs(project_folder, exist_ok=True)
     
     # Create new filenames
-    file1_name, file1_ext = os.path.splitext(file.filename)
-    file2_name, file2_ext = os.path.splitext(file2.filename)
+    # Keep compound extensions such as .csv.gz so the format stays detectable
+    file1_name, file1_ext = split_file_name(file.filename)
+    file2_name, file2_ext = split_file_name(file2.filename)
     
     new_file1_name = f"{file1_name}_{datetime_str}_original{file1_ext}"
     new_file2_name = f"{file2_name}_{datetime_str}_original{file2_ext}"
     
     filepath = os.path.join(project_folder, new_file1_name)
     filepath2 = os.path.join(project_folder, new_file2_name)
-    file.save(filepath)
-    file2.save(filepath2)
+    
+    # Store each content once (hashed and profiled while saving) and link it into the project folder
+    for storage, path in ((file, filepath), (file2, filepath2)):
+        # The temporary name keeps the extension, so that the profiler recognizes the format
+        base_name, ext = split_file_name(path)
+        upload_path = f"{base_name}.upload{ext}"
+        profileur = ProfileurFlux(upload_path)
+        sha256 = save_upload_with_hash(storage, upload_path, profileur)
+        try:
+            # Profile, line index and key sketches follow the file into the blob store
+            profileur.finish()
+        except Exception as e:
+            profileur.discard()
+            print(f"⚠️ Profilage de {storage.filename} pendant l'upload impossible: {e}")
+        blob = store_file(upload_path, storage.filename, sha256)
+        link_to_project(blob, projet, path)
 
     # Update project with file and folder information
     if not projet_existant_id:
@@ -199,27 +242,16 @@ def upload_file():
             
         else:
             # For smaller files, read normally with encoding detection
-            def safe_read_csv_local(filepath, filename):
-                """Safely read CSV with multiple encoding attempts and error handling"""
-                from app.utils.encoding_utils import safe_read_csv
+            def safe_read_file_local(filepath, filename):
+                """Safely read CSV/Excel/JSON (compressed or not) with encoding detection and error handling"""
+                from app.utils.encoding_utils import safe_read_file
                 try:
-                    return safe_read_csv(filepath)
+                    return safe_read_file(filepath)
                 except Exception as e:
                     raise ValueError(f"Erreur lors de la lecture du fichier {filename}: {str(e)}")
             
-            if file.filename.endswith('.csv'):
-                df = safe_read_csv_local(filepath, file.filename)
-            elif file.filename.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(filepath)
-            else:
-                df = pd.read_json(filepath)
-                
-            if file2.filename.endswith('.csv'):
-                df2 = safe_read_csv_local(filepath2, file2.filename)
-            elif file2.filename.endswith(('.xls', '.xlsx')):
-                df2 = pd.read_excel(filepath2)
-            else:
-                df2 = pd.read_json(filepath2)
+            df = safe_read_file_local(filepath, file.filename)
+            df2 = safe_read_file_local(filepath2, file2.filename)
                 
             session['is_large_files'] = False
             
@@ -238,6 +270,10 @@ def upload_file():
             session['df_path'] = df_path
             session['df2_path'] = df2_path
         
+        # Key cardinality and overlap estimates (sketches are cached next to the files for the planner)
+        key_estimates = estimate_keys_for_preview(lecteur, filepath, filepath2)
+        key_suggestions = suggest_keys_for_preview(lecteur, filepath, filepath2)
+        
         print("Colonnes fichier 1 après lecture :", df.columns.tolist()[:10])  # Only show first 10
         print("Colonnes fichier 2 après lecture :", df2.columns.tolist()[:10])  # Only show first 10
         
@@ -306,14 +342,328 @@ def upload_file():
                            form_action=url_for('comparaison.compare'),
                            is_large_files=session.get('is_large_files', False),
                            file1_info=session.get('file1_info'),
-                           file2_info=session.get('file2_info'))
+                           file2_info=session.get('file2_info'),
+                           key_estimates=key_estimates,
+                           key_suggestions=key_suggestions,
+                           regles=regles_projet(session.get('projet_id')))
+
+# Chunked, resumable uploads: parts are appended to the project folder and profiled as they arrive
+CHUNKED_READ_SIZE = 1024 * 1024
+
+def _chunked_upload_meta_path(upload_id):
+    return os.path.join(current_app.config['CHUNKED_UPLOAD_FOLDER'], f"{upload_id}.json")
+
+def _load_chunked_upload(upload_id):
+    """Load the state of a chunked upload owned by the current user (None if unknown)"""
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        return None
+    meta_path = _chunked_upload_meta_path(upload_id)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('user_id') != current_user.id:
+        return None
+    return meta
+
+def _save_chunked_upload(meta):
+    os.makedirs(current_app.config['CHUNKED_UPLOAD_FOLDER'], exist_ok=True)
+    with open(_chunked_upload_meta_path(meta['upload_id']), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+def _received_bytes(meta):
+    return os.path.getsize(meta['part_path']) if os.path.exists(meta['part_path']) else 0
+
+@contextmanager
+def _locked_part_file(meta):
+    """
+    Part file opened for append under an exclusive lock: one request at a time checks the offset,
+    appends and feeds the profiler of an upload (threads and workers alike)
+    """
+    with open(meta['part_path'], 'ab') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        # Completed while waiting for the lock: the open file is now the final file, never append to it
+        try:
+            renamed = os.stat(meta['part_path']).st_ino != os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            renamed = True
+        completed = os.path.exists(meta['final_path'])
+        if completed and not renamed:
+            # Empty part file created by this request after the completion
+            os.remove(meta['part_path'])
+        yield None if renamed or completed else f
+
+@fichiers_bp.route('/upload/chunked/init', methods=['POST'])
+def chunked_upload_init():
+    """Start a resumable upload for file 1 or 2 of a project"""
+    if not current_user.is_authenticated:
+        return jsonify({'error': 'Vous devez être connecté pour créer ou modifier un projet.'}), 401
+    
+    data = request.get_json(silent=True) or request.form
+    filename = os.path.basename(data.get('filename') or '')
+    slot = int(data.get('slot') or 1)
+    total_size = int(data.get('total_size') or 0)
+    nom_projet = data.get('name')
+    projet_existant_id = data.get('existing_project')
+    
+    if not filename or slot not in (1, 2) or total_size <= 0:
+        return jsonify({'error': 'Paramètres invalides (filename, slot 1 ou 2, total_size)'}), 400
+    try:
+        if get_compression(filename) != 'zip':
+            ext = get_file_extension(filename)
+            if ext not in ('csv', 'xls', 'xlsx', 'json'):
+                raise ValueError(f"Type de fichier non supporté: {ext}")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if slot == 1:
+        # A new pair of files starts: clear the file-related session data
+        for key in ['df_path', 'df2_path', 'file1_path', 'file2_path', 'file1_info', 'file2_info',
+                    'is_large_files', 'projet_id', 'file1_name', 'file2_name', 'project_folder',
+                    'download_results_path', 'column_mapping']:
+            session.pop(key, None)
+    
+    if projet_existant_id:
+        projet = Projet.query.get(int(projet_existant_id))
+        if not projet:
+            return jsonify({'error': 'Projet sélectionné introuvable'}), 404
+    else:
+        if not nom_projet:
+            return jsonify({'error': 'Veuillez saisir un nom de projet ou en sélectionner un existant.'}), 400
+        projet = Projet(
+            nom_projet=nom_projet,
+            date_creation=datetime.now(),
+            fichier_1="",
+            fichier_2="",
+            emplacement_source="",
+            emplacement_archive="",
+            user_id=current_user.id
+        )
+        db.session.add(projet)
+        db.session.commit()
+        
+        log = LogExecution(
+            projet_id=projet.id,
+            statut='succès',
+            message=f"Nouveau projet créé: {nom_projet} par utilisateur {current_user.username}"
+        )
+        db.session.add(log)
+        db.session.commit()
+    
+    # Both files of a pair go to the same project folder
+    datetime_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+    project_folder = session.get('project_folder') if session.get('projet_id') == projet.id else None
+    if not project_folder:
+        project_folder = os.path.join('uploads', 'archive', f"{projet.nom_projet}_{datetime_str}")
+    os.makedirs(project_folder, exist_ok=True)
+    session['projet_id'] = projet.id
+    session['project_folder'] = project_folder
+    
+    base_name, ext = split_file_name(filename)
+    final_path = os.path.join(project_folder, f"{base_name}_{datetime_str}_original{ext}")
+    
+    meta = {
+        'upload_id': str(uuid.uuid4()),
+        'user_id': current_user.id,
+        'projet_id': projet.id,
+        'slot': slot,
+        'filename': filename,
+        'total_size': total_size,
+        'final_path': final_path,
+        'part_path': f"{final_path}.part"
+    }
+    _save_chunked_upload(meta)
+    
+    log = LogExecution(
+        projet_id=projet.id,
+        statut='succès',
+        message=f"Upload par morceaux démarré pour {filename} ({total_size} octets) dans {project_folder}"
+    )
+    db.session.add(log)
+    db.session.commit()
+    
+    return jsonify({
+        'upload_id': meta['upload_id'],
+        'projet_id': projet.id,
+        'received': 0,
+        'total_size': total_size
+    })
+
+@fichiers_bp.route('/upload/chunked/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Bytes already received: the client resumes from this offset"""
+    meta = _load_chunked_upload(upload_id) if current_user.is_authenticated else None
+    if meta is None:
+        return jsonify({'error': 'Upload introuvable'}), 404
+    return jsonify({'upload_id': upload_id, 'received': _received_bytes(meta), 'total_size': meta['total_size']})
+
+@fichiers_bp.route('/upload/chunked/<upload_id>/part', methods=['PUT', 'POST'])
+def chunked_upload_part(upload_id):
+    """Append a part (raw request body) at ?offset=N, hashing and profiling it on the fly"""
+    meta = _load_chunked_upload(upload_id) if current_user.is_authenticated else None
+    if meta is None:
+        return jsonify({'error': 'Upload introuvable'}), 404
+    
+    offset = request.args.get('offset', type=int)
+    with _locked_part_file(meta) as f:
+        if f is None:
+            return jsonify({'error': 'Upload déjà finalisé'}), 409
+        received = os.fstat(f.fileno()).st_size
+        if offset != received:
+            # The client resends from the offset actually stored on disk
+            return jsonify({'error': 'Offset inattendu', 'received': received}), 409
+        
+        profileur = get_profileur(upload_id, meta['final_path'], meta['part_path'])
+        while True:
+            block = request.stream.read(CHUNKED_READ_SIZE)
+            if not block:
+                break
+            if received + len(block) > meta['total_size']:
+                return jsonify({'error': 'Le morceau dépasse la taille annoncée', 'received': received}), 413
+            f.write(block)
+            f.flush()
+            profileur.feed(block)
+            received += len(block)
+    
+    return jsonify({'upload_id': upload_id, 'received': received, 'total_size': meta['total_size']})
+
+@fichiers_bp.route('/upload/chunked/<upload_id>/complete', methods=['POST'])
+def chunked_upload_complete(upload_id):
+    """Finalize the upload: the file is already profiled and ready to compare"""
+    meta = _load_chunked_upload(upload_id) if current_user.is_authenticated else None
+    if meta is None:
+        return jsonify({'error': 'Upload introuvable'}), 404
+    
+    projet = Projet.query.get(meta['projet_id'])
+    if projet is None:
+        return jsonify({'error': 'Projet introuvable'}), 404
+    
+    # No part can be appended while the complete file is checked and renamed
+    with _locked_part_file(meta) as f:
+        if f is None:
+            return jsonify({'error': 'Upload déjà finalisé'}), 409
+        received = os.fstat(f.fileno()).st_size
+        if received != meta['total_size']:
+            return jsonify({'error': 'Upload incomplet', 'received': received, 'total_size': meta['total_size']}), 409
+        
+        profileur = get_profileur(upload_id, meta['final_path'], meta['part_path'])
+        sha256 = profileur.sha256.hexdigest()
+        expected_sha256 = (request.get_json(silent=True) or {}).get('sha256')
+        if expected_sha256 and expected_sha256.lower() != sha256:
+            # Nothing is stored: the part file stays for the client to inspect or resend
+            return jsonify({'error': 'Empreinte SHA-256 différente du fichier envoyé', 'sha256': sha256}), 422
+        
+        release_profileur(upload_id)
+        # The complete file takes its final name to be profiled, and goes back to the part file if profiling fails
+        os.replace(meta['part_path'], meta['final_path'])
+    try:
+        try:
+            file_info = profileur.finish()
+        except Exception:
+            os.replace(meta['final_path'], meta['part_path'])
+            raise
+        finally:
+            profileur.discard()
+        # The profiled content goes to the blob store (deduplicated) and the project gets a link to it
+        blob = store_file(meta['final_path'], meta['filename'], sha256)
+        link_to_project(blob, projet, meta['final_path'])
+    except Exception as e:
+        log = LogExecution(
+            projet_id=meta['projet_id'],
+            statut='échec',
+            message=f"Erreur lors du profilage de {meta['filename']}: {str(e)}"
+        )
+        db.session.add(log)
+        db.session.commit()
+        return jsonify({'error': f"Erreur de lecture : {e}"}), 500
+    
+    slot = meta['slot']
+    stored_name = os.path.basename(meta['final_path'])
+    project_folder = os.path.dirname(meta['final_path'])
+    if slot == 1:
+        projet.fichier_1 = stored_name
+    else:
+        projet.fichier_2 = stored_name
+    if not projet.emplacement_source or not projet.emplacement_archive:
+        projet.emplacement_source = project_folder
+        projet.emplacement_archive = project_folder
+    log = LogExecution(
+        projet_id=projet.id,
+        statut='succès',
+        message=f"Fichier reçu par morceaux pour le projet {projet.nom_projet}: {stored_name} "
+                f"({file_info['total_rows']} lignes, sha256 {file_info['sha256'][:12]})"
+    )
+    db.session.add(log)
+    db.session.commit()
+    
+    session[f'file{slot}_path'] = meta['final_path']
+    session[f'file{slot}_info'] = {
+        'total_rows': file_info['total_rows'],
+        'total_columns': file_info['total_columns']
+    }
+    session[f'file{slot}_name'] = meta['filename']
+    session['projet_id'] = meta['projet_id']
+    session['project_folder'] = project_folder
+    if not is_large_file(file_info):
+        # Small files are also saved for the in-memory comparison, as by the regular upload
+        from app.utils.encoding_utils import safe_read_file
+        temp_folder = os.path.join(os.getcwd(), "temp")
+        os.makedirs(temp_folder, exist_ok=True)
+        df_path = os.path.join(temp_folder, f"{uuid.uuid4()}.json")
+        safe_read_file(meta['final_path']).to_json(df_path, orient="records", force_ascii=False)
+        session['df_path' if slot == 1 else 'df2_path'] = df_path
+    # Both files are compared from disk as soon as one of them is large
+    session['is_large_files'] = any(is_large_file(session[f'file{n}_info'])
+                                    for n in (1, 2) if session.get(f'file{n}_info'))
+    os.remove(_chunked_upload_meta_path(upload_id))
+    
+    ready = bool(session.get('file1_path') and session.get('file2_path'))
+    return jsonify({
+        'upload_id': upload_id,
+        'slot': slot,
+        'sha256': file_info['sha256'],
+        'file_info': {key: value for key, value in file_info.items() if key != 'sample_data'},
+        'ready': ready,
+        'preview_url': url_for('fichiers.chunked_upload_preview') if ready else None
+    })
+
+@fichiers_bp.route('/upload/chunked/preview')
+def chunked_upload_preview():
+    """Preview of the two files received by chunked upload, with the comparison form"""
+    if not session.get('file1_path') or not session.get('file2_path'):
+        return render_index_with_errors(project_error="Veuillez sélectionner les deux fichiers", show_main_modal=True)
+    
+    try:
+        lecteur = LecteurFichierOptimise()
+        df = lecteur.get_file_sample(session['file1_path'], 100)
+        df2 = lecteur.get_file_sample(session['file2_path'], 100)
+    except Exception as e:
+        return render_index_with_errors(project_error=f"Erreur de lecture : {e}", show_main_modal=True)
+    
+    key_estimates = estimate_keys_for_preview(lecteur, session['file1_path'], session['file2_path'])
+    key_suggestions = suggest_keys_for_preview(lecteur, session['file1_path'], session['file2_path'])
+    
+    return render_template('index.html',
+                           data=df.to_dict(orient='records'),
+                           columns=df.columns.tolist(),
+                           data2=df2.to_dict(orient='records'),
+                           columns2=df2.columns.tolist(),
+                           form_action=url_for('comparaison.compare'),
+                           is_large_files=session.get('is_large_files', False),
+                           file1_info=session.get('file1_info'),
+                           file2_info=session.get('file2_info'),
+                           key_estimates=key_estimates,
+                           key_suggestions=key_suggestions,
+                           regles=regles_projet(session.get('projet_id')))
 
 @fichiers_bp.route('/fast_test', methods=['POST'])
 def fast_upload():
     # Clear only file-related session data
     file_session_keys = ['df_path', 'df2_path', 'file1_path', 'file2_path', 'file1_info', 'file2_info', 
                         'is_large_files', 'projet_id', 'file1_name', 'file2_name', 'project_folder',
-                        'download_results_path']
+                        'download_results_path', 'column_mapping']
     for key in file_session_keys:
         session.pop(key, None)
 
@@ -468,6 +818,29 @@ def fast_upload():
                             file1_info=session.get('file1_info'),
                             file2_info=session.get('file2_info'))
 
+@fichiers_bp.route('/rows/<int:file_num>')
+def preview_rows(file_num):
+    """Paginate the raw rows of an uploaded large file (random access through the line offset index)"""
+    file_path = session.get(f'file{file_num}_path') if file_num in (1, 2) else None
+    if not file_path or not os.path.exists(file_path):
+        return jsonify({'error': 'Fichier introuvable, veuillez recharger vos fichiers.'}), 404
+    
+    start = max(request.args.get('start', 0, type=int), 0)
+    count = min(max(request.args.get('count', 100, type=int), 1), 1000)
+    
+    try:
+        df = LecteurFichierOptimise().get_file_sample(file_path, count, start=start)
+        file_info = session.get(f'file{file_num}_info') or {}
+        return jsonify({
+            'start': start,
+            'count': len(df),
+            'total_rows': file_info.get('total_rows'),
+            'columns': df.columns.tolist(),
+            'rows': json.loads(df.to_json(orient='records', force_ascii=False))
+        })
+    except Exception as e:
+        return jsonify({'error': f"Erreur lors de la lecture des lignes: {str(e)}"}), 500
+
 # Debug route to check DataFrame columns after processing
 @fichiers_bp.route('/debug_columns')
 def debug_columns():
@@ -521,7 +894,9 @@ def download_excel():
         generateur_excel = GenerateurExcel(
             ecarts1=resultats['ecarts_fichier1'],
             ecarts2=resultats['ecarts_fichier2'],
-            communs=resultats['communs']
+            communs=resultats['communs'],
+            rapprochements=resultats.get('rapprochements_flous'),
+            lignes_modifiees=resultats.get('lignes_modifiees')
         )
         excel_response = generateur_excel.generer_rapport()
         
@@ -474,6 +474,7 @@ def project_evolution(project_id):
                 'error': False,
                 'message': 'Aucune donnée d\'évolution disponible pour ce projet',
                 'dates': [],
+                'stat_ids': [],
                 'ecarts_fichier1': [],
                 'ecarts_fichier2': [],
                 'ecarts_communs': [],
@@ -482,6 +483,7 @@ def project_evolution(project_id):
         
         # Préparer les données pour le graphique
         dates = []
+        stat_ids = []
         ecarts_fichier1 = []
         ecarts_fichier2 = []
         ecarts_communs = []
@@ -491,6 +493,7 @@ def project_evolution(project_id):
             # Formater la date
             date_str = stat.date_execution.strftime("%d/%m/%Y %H:%M") if stat.date_execution else "N/A"
             dates.append(date_str)
+            stat_ids.append(stat.id)
             
             # Ajouter les données (avec valeurs par défaut si None)
             f1_ecarts = stat.nb_ecarts_uniquement_fichier1 or 0
@@ -506,6 +509,7 @@ def project_evolution(project_id):
             'error': False,
             'project_name': projet.nom_projet,
             'dates': dates,
+            'stat_ids': stat_ids,
             'ecarts_fichier1': ecarts_fichier1,
             'ecarts_fichier2': ecarts_fichier2,
             'ecarts_communs': ecarts_communs,
@@ -524,6 +528,94 @@ def project_evolution(project_id):
             'details': error_details
         }), 500
 
+@projets_bp.route('/project-churn/<int:project_id>')
+@login_required
+def project_churn(project_id):
+    """Route pour comparer les clés de deux exécutions d'un projet (nouveaux écarts, écarts résolus)"""
+    from app.services.empreintes_cles import compute_churn
+    
+    projet = Projet.query.get_or_404(project_id)
+    
+    # Vérifier les permissions : seul le propriétaire ou l'admin peut voir l'évolution
+    if not current_user.is_admin() and projet.user_id != current_user.id:
+        return jsonify({
+            'error': True,
+            'message': 'Accès non autorisé à ce projet'
+        }), 403
+    
+    # Par défaut : les deux dernières exécutions disposant d'empreintes de clés
+    from_id = request.args.get('from', type=int)
+    to_id = request.args.get('to', type=int)
+    if from_id is None or to_id is None:
+        derniers = StatistiqueEcart.query.filter(
+            StatistiqueEcart.projet_id == project_id,
+            StatistiqueEcart.chemin_empreintes.isnot(None)
+        ).order_by(StatistiqueEcart.date_execution.desc()).limit(2).all()
+        if len(derniers) < 2:
+            return jsonify({
+                'error': False,
+                'message': "Au moins deux exécutions avec empreintes de clés sont nécessaires",
+                'churn': None
+            })
+        stat_to, stat_from = derniers
+    else:
+        stat_from = StatistiqueEcart.query.filter_by(id=from_id, projet_id=project_id).first_or_404()
+        stat_to = StatistiqueEcart.query.filter_by(id=to_id, projet_id=project_id).first_or_404()
+    
+    churn = compute_churn(stat_from, stat_to)
+    if churn is None:
+        return jsonify({
+            'error': True,
+            'message': "Empreintes de clés indisponibles pour l'une des exécutions"
+        }), 404
+    
+    return jsonify({
+        'error': False,
+        'project_name': projet.nom_projet,
+        'from': {'id': stat_from.id, 'date': stat_from.date_execution.strftime("%d/%m/%Y %H:%M") if stat_from.date_execution else "N/A"},
+        'to': {'id': stat_to.id, 'date': stat_to.date_execution.strftime("%d/%m/%Y %H:%M") if stat_to.date_execution else "N/A"},
+        'churn': churn
+    })
+
+@projets_bp.route('/project-breakdown/<int:project_id>')
+@login_required
+def project_breakdown(project_id):
+    """Route pour la ventilation des écarts par dimension d'une exécution (la dernière par défaut)"""
+    from app.services.ventilation_ecarts import charger_ventilation
+
+    projet = Projet.query.get_or_404(project_id)
+
+    # Vérifier les permissions : seul le propriétaire ou l'admin peut voir l'évolution
+    if not current_user.is_admin() and projet.user_id != current_user.id:
+        return jsonify({
+            'error': True,
+            'message': 'Accès non autorisé à ce projet'
+        }), 403
+
+    stat_id = request.args.get('stat', type=int)
+    if stat_id is None:
+        stat = StatistiqueEcart.query.filter(
+            StatistiqueEcart.projet_id == project_id,
+            StatistiqueEcart.ventilation.isnot(None)
+        ).order_by(StatistiqueEcart.date_execution.desc()).first()
+    else:
+        stat = StatistiqueEcart.query.filter_by(id=stat_id, projet_id=project_id).first_or_404()
+
+    ventilation = charger_ventilation(stat) if stat else None
+    if ventilation is None:
+        return jsonify({
+            'error': False,
+            'message': "Aucune exécution avec ventilation des écarts",
+            'ventilation': None
+        })
+
+    return jsonify({
+        'error': False,
+        'project_name': projet.nom_projet,
+        'stat': {'id': stat.id, 'date': stat.date_execution.strftime("%d/%m/%Y %H:%M") if stat.date_execution else "N/A"},
+        'ventilation': ventilation
+    })
+
 @projets_bp.route('/projet-chart/<int:projet_id>')
 @login_required
 def projet_chart(projet_id):
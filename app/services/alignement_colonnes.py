@@ -0,0 +1,168 @@
+"""
+Column alignment between two files: candidate column pairs come from an LSH index over the
+one-permutation MinHash signatures of the profiling pass (similar values) and from buckets of
+normalized column names, then are scored by value overlap and name similarity and matched
+one-to-one. Buckets are bounded, so the work grows linearly with the number of columns.
+"""
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Set, Tuple
+import pandas as pd
+from app.services.esquisses import EsquissesCles, SIGNATURE_BINS
+
+# LSH: BANDES bands of LIGNES_PAR_BANDE bins (Jaccard 0.5 collides in one band with ~98 % chance)
+BANDES = 64
+LIGNES_PAR_BANDE = SIGNATURE_BINS // BANDES
+# Buckets holding more columns than this are not informative (ex: many flags sharing 0/1 values)
+TAILLE_MAX_SEAU = 20
+# Weight of the value overlap in the score (the rest is name similarity)
+POIDS_VALEURS = 0.7
+# Minimum score of an aligned pair (identical names always pass)
+SEUIL_ALIGNEMENT = 0.3
+# Below this name similarity, a pair rests on its values alone and must pass the distinct-count check:
+# flags (O/N, 0/1) and small codes share their values whatever the data they hold
+SIMILARITE_NOMS_MIN = 0.5
+# Distinct-count check of a value-only pair: enough distinct values on both sides, of the same order
+DISTINCTS_MIN = 50
+RATIO_DISTINCTS_MIN = 0.5
+
+
+def normaliser_nom(name: str) -> str:
+    """Column name reduced to its sorted lowercase words: 'CLIENT_ID', 'id_client', 'ClientId' -> 'client id'"""
+    name = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii')
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', name)
+    return ' '.join(sorted(re.findall(r'[a-z0-9]+', name.lower())))
+
+
+def similarite_noms(name1: str, name2: str) -> float:
+    return SequenceMatcher(None, normaliser_nom(name1), normaliser_nom(name2)).ratio()
+
+
+def _distincts_compatibles(esquisses1: EsquissesCles, col1: str, esquisses2: EsquissesCles, col2: str) -> bool:
+    """Whether two columns have enough distinct values, in similar numbers, for their overlap to mean anything"""
+    distinct1 = esquisses1.estimate_distinct([col1])
+    distinct2 = esquisses2.estimate_distinct([col2])
+    return (min(distinct1, distinct2) >= DISTINCTS_MIN
+            and min(distinct1, distinct2) >= RATIO_DISTINCTS_MIN * max(distinct1, distinct2))
+
+
+def _paires_bornees(buckets: Dict, pairs: Set[Tuple[str, str]]):
+    """Cross pairs (file 1 column, file 2 column) of every bucket small enough to be informative"""
+    for columns1, columns2 in buckets.values():
+        if columns1 and columns2 and len(columns1) + len(columns2) <= TAILLE_MAX_SEAU:
+            pairs.update((col1, col2) for col1 in columns1 for col2 in columns2)
+
+
+def _paires_valeurs(esquisses1: EsquissesCles, esquisses2: EsquissesCles) -> Set[Tuple[str, str]]:
+    """Column pairs whose signatures agree on at least one whole LSH band"""
+    buckets = defaultdict(lambda: ([], []))
+    for side, esquisses in enumerate((esquisses1, esquisses2)):
+        for col, minhash in esquisses.signatures.items():
+            signature = minhash.signature()
+            if signature is None:
+                continue
+            for band in range(BANDES):
+                values = signature[band * LIGNES_PAR_BANDE:(band + 1) * LIGNES_PAR_BANDE]
+                buckets[(band, values.tobytes())][side].append(col)
+    pairs: Set[Tuple[str, str]] = set()
+    _paires_bornees(buckets, pairs)
+    return pairs
+
+
+def _paires_noms(columns1: List[str], columns2: List[str]) -> Set[Tuple[str, str]]:
+    """Column pairs with the same normalized name or sharing a name word of 3 letters or more"""
+    buckets = defaultdict(lambda: ([], []))
+    pairs: Set[Tuple[str, str]] = set()
+    exact = defaultdict(lambda: ([], []))
+    for side, columns in enumerate((columns1, columns2)):
+        for col in columns:
+            normalized = normaliser_nom(col)
+            exact[normalized][side].append(col)
+            for word in set(normalized.split()):
+                if len(word) >= 3:
+                    buckets[word][side].append(col)
+    # Same normalized name: always a candidate, whatever the number of homonyms
+    for columns1_, columns2_ in exact.values():
+        pairs.update((col1, col2) for col1 in columns1_ for col2 in columns2_)
+    _paires_bornees(buckets, pairs)
+    return pairs
+
+
+def aligner_colonnes(esquisses1: EsquissesCles, esquisses2: EsquissesCles,
+                     seuil: float = SEUIL_ALIGNEMENT, exclure1: Optional[List[str]] = None,
+                     exclure2: Optional[List[str]] = None) -> List[dict]:
+    """
+    One-to-one mapping of the columns of file 1 onto the columns of file 2, proposed to the user
+    (the comparison only applies the pairs confirmed in the form).
+    Pairs with dissimilar names need comparable distinct counts on both sides (no flags, no small codes).
+
+    Args:
+        esquisses1, esquisses2: Profiles of both files (MinHash signatures and samples per column)
+        seuil: Minimum score (0-1) of an aligned pair
+        exclure1, exclure2: Columns left out of the alignment (ex: the comparison keys)
+
+    Returns:
+        List[dict]: colonne1, colonne2, score, recouvrement (estimated Jaccard of the values, %),
+        similarite_noms (%), methode - pairs taken greedily by decreasing score, best first
+    """
+    start = time.time()
+    columns1 = [col for col in esquisses1.signatures if col not in set(exclure1 or [])]
+    columns2 = [col for col in esquisses2.signatures if col not in set(exclure2 or [])]
+    by_values = {pair for pair in _paires_valeurs(esquisses1, esquisses2)
+                 if pair[0] in columns1 and pair[1] in columns2}
+    by_names = _paires_noms(columns1, columns2)
+
+    scored = []
+    for col1, col2 in by_values | by_names:
+        overlap = esquisses1.jaccard(col1, esquisses2, col2)
+        names = similarite_noms(col1, col2)
+        score = POIDS_VALEURS * overlap + (1 - POIDS_VALEURS) * names
+        if score < seuil:
+            continue
+        if names < SIMILARITE_NOMS_MIN and not _distincts_compatibles(esquisses1, col1, esquisses2, col2):
+            continue
+        methode = 'valeurs+noms' if (col1, col2) in by_values and (col1, col2) in by_names \
+            else 'valeurs' if (col1, col2) in by_values else 'noms'
+        scored.append((score, col1, col2, overlap, names, methode))
+
+    # One column of file 2 per column of file 1: pairs taken by decreasing score
+    scored.sort(key=lambda item: (-item[0], item[1], item[2]))
+    used1, used2, alignement = set(), set(), []
+    for score, col1, col2, overlap, names, methode in scored:
+        if col1 in used1 or col2 in used2:
+            continue
+        used1.add(col1)
+        used2.add(col2)
+        alignement.append({
+            'colonne1': col1,
+            'colonne2': col2,
+            'score': round(score, 4),
+            'recouvrement': round(overlap * 100, 1),
+            'similarite_noms': round(names * 100, 1),
+            'methode': methode
+        })
+    print(f"🧩 Alignement des colonnes: {len(alignement)} paires sur {len(columns1)} x {len(columns2)} colonnes "
+          f"({len(by_values)} candidates par valeurs, {len(by_names)} par noms) en {time.time() - start:.2f}s")
+    return alignement
+
+
+def correspondance_colonnes(alignement: List[dict]) -> Dict[str, str]:
+    """Renaming of the file 2 columns aligned on a differently named file 1 column ({colonne2: colonne1})"""
+    return {pair['colonne2']: pair['colonne1'] for pair in alignement if pair['colonne1'] != pair['colonne2']}
+
+
+def appliquer_correspondance(df: pd.DataFrame, correspondance: Optional[Dict[str, str]],
+                             key_columns: List[str]) -> pd.DataFrame:
+    """
+    File 2 frame with its aligned columns renamed after file 1, so that both files share column
+    names where they hold the same data. Key columns and renamings that would clash with an
+    existing column are left as they are.
+    """
+    if not correspondance:
+        return df
+    renames = {col2: col1 for col2, col1 in correspondance.items()
+               if col2 in df.columns and col2 not in key_columns and col1 not in df.columns}
+    return df.rename(columns=renames) if renames else df
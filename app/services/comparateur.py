@@ -1,17 +1,47 @@
 import pandas as pd
+from app.utils.string_storage import to_string_storage, build_composite_key
+from app.services.empreintes_cles import empreintes_from_merge
+from app.services.rapprochement_flou import rapprocher_cles
+from app.services.alignement_colonnes import appliquer_correspondance
+from app.services.filtres_lignes import filtrer
+from app.services.lecteur_fichier_optimise import required_columns
+from app.services.empreintes_lignes import (COLONNE_EMPREINTE, DiffValeurs, colonnes_comparees, empreinte_lignes,
+                                            sans_empreintes)
+from app.services.regles_comparaison import regles_colonnes
+from app.services.ventilation_ecarts import VentilationEcarts, colonnes_dimensions
 
 class ComparateurFichiers:
-    def __init__(self, df1, df2, keys1, keys2):
-        self.df1 = df1.copy()
-        self.df2 = df2.copy()
+    def __init__(self, df1, df2, keys1, keys2, column_mapping=None, predicats1=None, predicats2=None,
+                 colonnes1=None, colonnes2=None, dimensions=None):
+        # Only the rows matching the predicates of each file (date range, segment) are compared
+        df1 = filtrer(df1, predicats1)
+        df2 = filtrer(df2, predicats2)
+        # Dimension columns of the discrepancy breakdown (file 1 names) and their file 2 counterparts
+        self.dimensions, dimensions2 = colonnes_dimensions(dimensions, column_mapping)
+        # Only the keys, the compared / exported columns and the dimensions are kept (None = every column)
+        usecols1 = required_columns(keys1, None, list(colonnes1) + self.dimensions if colonnes1 is not None else None)
+        usecols2 = required_columns(keys2, None, list(colonnes2) + dimensions2 if colonnes2 is not None else None)
+        self.df1 = to_string_storage((df1[usecols1] if usecols1 is not None else df1).copy())
+        # File 2 columns aligned on differently named file 1 columns take the file 1 name
+        self.df2 = appliquer_correspondance(to_string_storage((df2[usecols2] if usecols2 is not None else df2).copy()),
+                                            column_mapping, keys2)
         self.keys1 = keys1
         self.keys2 = keys2
         
-    def comparer(self):
-        """Compare two DataFrames and return comparison results"""
+    def comparer(self, fuzzy_matching=False, fuzzy_threshold=0.8, comparer_valeurs=False, regles=None):
+        """
+        Compare two DataFrames and return comparison results (with likely matches of the unmatched keys if requested,
+        and the value diff of the matched rows under the comparison rules `regles` if comparer_valeurs)
+        """
         # Create concatenated keys for comparison
-        self.df1['_compare_key'] = self.df1[self.keys1].astype(str).agg('|'.join, axis=1)
-        self.df2['_compare_key'] = self.df2[self.keys2].astype(str).agg('|'.join, axis=1)
+        self.df1['_compare_key'] = build_composite_key(self.df1, self.keys1)
+        self.df2['_compare_key'] = build_composite_key(self.df2, self.keys2)
+        if comparer_valeurs:
+            # Row fingerprints next to the keys: identical matched rows are not diffed column by column
+            colonnes = [col for col, _ in colonnes_comparees(self.df1.columns, self.df2.columns, self.keys1, self.keys2)]
+            regles_alignees = regles_colonnes(colonnes, regles)
+            self.df1[COLONNE_EMPREINTE] = empreinte_lignes(self.df1, colonnes, regles_alignees)
+            self.df2[COLONNE_EMPREINTE] = empreinte_lignes(self.df2, colonnes, regles_alignees)
         
         # Merge DataFrames
         merged = pd.merge(self.df1, self.df2, on='_compare_key', how='outer', indicator=True)
@@ -20,6 +50,18 @@ class ComparateurFichiers:
         ecarts_fichier1 = merged[merged['_merge'] == 'left_only']
         ecarts_fichier2 = merged[merged['_merge'] == 'right_only']
         communs = merged[merged['_merge'] == 'both']
+        diff = None
+        differences = None
+        if comparer_valeurs:
+            diff = DiffValeurs(colonnes, len(communs), regles)
+            differences = diff.ajouter(communs)
+            ecarts_fichier1, ecarts_fichier2, communs = (sans_empreintes(bucket) for bucket in
+                                                         (ecarts_fichier1, ecarts_fichier2, communs))
+        ventilation = None
+        if self.dimensions:
+            # Discrepancies per value of the dimension columns
+            ventilation = VentilationEcarts(self.dimensions, colonnes if comparer_valeurs else None)
+            ventilation.ajouter(merged, differences)
         
         # Calculate statistics
         total = len(merged)
@@ -31,7 +73,7 @@ class ComparateurFichiers:
         pct2 = round(n2 / total * 100, 2) if total > 0 else 0
         pct_both = round(n_common / total * 100, 2) if total > 0 else 0
         
-        return {
+        results = {
             'ecarts_fichier1': ecarts_fichier1,
             'ecarts_fichier2': ecarts_fichier2,
             'communs': communs,
@@ -44,5 +86,19 @@ class ComparateurFichiers:
             'nb_df2': len(self.df2),
             'pct1': pct1,
             'pct2': pct2,
-            'pct_both': pct_both
+            'pct_both': pct_both,
+            # Key hashes per bucket, saved as the run snapshot for churn tracking
+            'empreintes': empreintes_from_merge(merged)
         }
+        if diff is not None:
+            results['diff_valeurs'] = diff.resultat()
+            results['lignes_modifiees'] = diff.lignes_modifiees()
+        if ventilation is not None:
+            results['ventilation'] = ventilation.resultat()
+        
+        if fuzzy_matching:
+            matches = rapprocher_cles(ecarts_fichier1['_compare_key'], ecarts_fichier2['_compare_key'], fuzzy_threshold)
+            results['rapprochements_flous'] = matches
+            results['n_fuzzy'] = len(matches)
+        
+        return results
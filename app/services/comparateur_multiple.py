@@ -0,0 +1,201 @@
+"""
+N-way comparison: one reference file against several files in a single run. The key index of the
+reference is built (or reused) once, each other file is streamed into its own key index in parallel
+and compared with it, and a presence matrix tells which keys appear in which files
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from app.config import Config
+from app.utils.string_storage import build_composite_key
+from .index_cles import IndexCles, hasher_cles
+from .echantillonnage import priorites, plus_petites_priorites
+from .comparateur_mysql_integre import ComparateurFichiersAvecMySQL
+
+# Files of one presence matrix, reference included (one bit per file)
+MAX_FICHIERS = 64
+
+
+def _lignes_echantillon(key_index: IndexCles, hashes: np.ndarray, sample_size: int) -> np.ndarray:
+    """First row of the sampled keys (seeded sample, same keys as the two-file strategies)"""
+    hashes = hashes[plus_petites_priorites(priorites(hashes, Config.SAMPLE_SEED), sample_size)]
+    positions = np.searchsorted(key_index.hashes, hashes, side='left')
+    return np.sort(np.asarray(key_index.rows[positions]).astype(np.int64))
+
+
+class ComparateurMultiple:
+    """
+    Compare a reference file with several files.
+
+    Args:
+        reference_path: Reference file (master extract)
+        reference_keys: Key columns of the reference
+        fichiers: Other files, as dicts with 'path', 'keys' and 'nom'
+        chunk_size: Rows per chunk when a key index has to be built
+        max_workers: Files indexed and compared at the same time
+    """
+
+    def __init__(self, reference_path: str, reference_keys: List[str], fichiers: List[Dict],
+                 chunk_size: int = 5000, max_workers: Optional[int] = None):
+        if not fichiers:
+            raise ValueError("Au moins un fichier à comparer avec la référence est nécessaire")
+        if len(fichiers) + 1 > MAX_FICHIERS:
+            raise ValueError(f"Au plus {MAX_FICHIERS - 1} fichiers peuvent être comparés avec la référence")
+        self.reference_path = reference_path
+        self.reference_keys = reference_keys
+        self.fichiers = fichiers
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers or Config.NWAY_MAX_WORKERS
+
+    def _lecteur(self):
+        from .lecteur_fichier_optimise import LecteurFichierOptimise
+        return LecteurFichierOptimise(chunk_size=self.chunk_size)
+
+    def _comparer_fichier(self, reference_unique: np.ndarray, fichier: Dict, sample_size: int) -> Dict:
+        """Index one file (streamed in chunks) and compare its distinct keys with the reference"""
+        start = time.time()
+        lecteur = self._lecteur()
+        index, reused = ComparateurFichiersAvecMySQL._load_key_index(lecteur, fichier['path'], fichier['keys'],
+                                                                     fichier['nom'])
+        unique = index.unique_hashes()
+        in_reference = np.isin(unique, reference_unique, assume_unique=True)
+        only_file = unique[~in_reference]
+        ecarts_fichier = ComparateurFichiersAvecMySQL._read_rows_by_number(
+            lecteur, fichier['path'], _lignes_echantillon(index, only_file, sample_size), index)
+        return {
+            'nom': fichier['nom'],
+            'keys': fichier['keys'],
+            'index': index,
+            'unique': unique,
+            'index_reutilise': reused,
+            'n_fichier_seul': len(only_file),
+            'n_communs': int(np.count_nonzero(in_reference)),
+            'nb_cles': len(unique),
+            'ecarts_fichier': ecarts_fichier,
+            'duree_s': round(time.time() - start, 2)
+        }
+
+    def _matrice_presence(self, reference_index: IndexCles, resultats: List[Dict], sample_size: int) -> Dict:
+        """
+        Presence of every distinct key in each file, as one bitmask per key (bit 0: reference):
+        key counts per presence pattern, and a seeded sample of the keys missing from at least one file
+        """
+        indexes = [reference_index] + [resultat['index'] for resultat in resultats]
+        key_columns = [self.reference_keys] + [resultat['keys'] for resultat in resultats]
+        paths = [self.reference_path] + [fichier['path'] for fichier in self.fichiers]
+        names = ['Référence'] + [resultat['nom'] for resultat in resultats]
+        uniques = [reference_index.unique_hashes()] + [resultat['unique'] for resultat in resultats]
+
+        all_keys = np.unique(np.concatenate(uniques))
+        presence = np.zeros(len(all_keys), dtype=np.uint64)
+        for bit, unique in enumerate(uniques):
+            presence[np.searchsorted(all_keys, unique)] |= np.uint64(1 << bit)
+        everywhere = np.uint64((1 << len(uniques)) - 1)
+
+        patterns, counts = np.unique(presence, return_counts=True)
+        motifs = []
+        for pattern, count in sorted(zip(patterns.tolist(), counts.tolist()), key=lambda item: -item[1]):
+            motifs.append({'fichiers': [name for bit, name in enumerate(names) if pattern >> bit & 1],
+                           'presence': [bool(pattern >> bit & 1) for bit in range(len(names))],
+                           'n_cles': int(count)})
+
+        # Readable keys of the sample: each key is read from the first file that holds it
+        partial = all_keys[presence != everywhere]
+        sampled = partial[plus_petites_priorites(priorites(partial, Config.SAMPLE_SEED), sample_size)]
+        texts: Dict[int, str] = {}
+        lecteur = self._lecteur()
+        for key_index, keys, path in zip(indexes, key_columns, paths):
+            missing = np.asarray([h for h in sampled.tolist() if h not in texts], dtype=np.uint64)
+            if len(missing) == 0:
+                break
+            held = missing[key_index.contains(missing)]
+            if len(held) == 0:
+                continue
+            positions = np.searchsorted(key_index.hashes, held, side='left')
+            rows = np.sort(np.asarray(key_index.rows[positions]).astype(np.int64))
+            frame = ComparateurFichiersAvecMySQL._read_rows_by_number(lecteur, path, rows, key_index)
+            if len(frame):
+                composite = build_composite_key(frame, keys)
+                texts.update(zip(hasher_cles(composite).tolist(), composite.astype(str).tolist()))
+
+        sample_presence = presence[np.searchsorted(all_keys, sampled)]
+        echantillon = pd.DataFrame({'cle': [texts.get(h, '') for h in sampled.tolist()]})
+        for bit, name in enumerate(names):
+            echantillon[name] = (sample_presence >> np.uint64(bit) & np.uint64(1)).astype(bool)
+        echantillon = echantillon.sort_values('cle', ignore_index=True)
+        return {
+            'fichiers': names,
+            'n_cles': len(all_keys),
+            'n_partout': int(np.count_nonzero(presence == everywhere)),
+            'motifs': motifs,
+            'echantillon': echantillon
+        }
+
+    def comparer(self, sample_size: int = 1000) -> Dict:
+        """
+        Run the N-way comparison.
+
+        Returns:
+            Dict: reference summary, one result per file (bucket counts and samples: keys only
+            in the reference, keys only in the file) and the presence matrix
+        """
+        start = time.time()
+        lecteur = self._lecteur()
+        reference_index, reference_reused = ComparateurFichiersAvecMySQL._load_key_index(
+            lecteur, self.reference_path, self.reference_keys, 'Référence')
+        reference_unique = reference_index.unique_hashes()
+
+        # The reference index is shared (read-only, memory-mapped); each file builds its own index.
+        # Identical contents share their sidecars, so each (content, key) pair is compared once.
+        distinct = {}
+        for fichier in self.fichiers:
+            distinct.setdefault((os.path.realpath(fichier['path']), tuple(fichier['keys'])), fichier)
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(distinct))) as executor:
+            computed = dict(zip(distinct, executor.map(
+                lambda fichier: self._comparer_fichier(reference_unique, fichier, sample_size), distinct.values())))
+        resultats = [{**computed[(os.path.realpath(fichier['path']), tuple(fichier['keys']))], 'nom': fichier['nom']}
+                     for fichier in self.fichiers]
+
+        # Reference rows missing from each file (read one file at a time: the reference line index is shared)
+        for resultat in resultats:
+            only_reference = reference_unique[~np.isin(reference_unique, resultat['unique'], assume_unique=True)]
+            resultat['n_reference_seul'] = len(only_reference)
+            resultat['ecarts_reference'] = ComparateurFichiersAvecMySQL._read_rows_by_number(
+                lecteur, self.reference_path, _lignes_echantillon(reference_index, only_reference, sample_size),
+                reference_index)
+            total = resultat['n_reference_seul'] + resultat['n_fichier_seul'] + resultat['n_communs']
+            resultat['total'] = total
+            resultat['pct_communs'] = round(resultat['n_communs'] / total * 100, 2) if total else 0
+
+        matrice = self._matrice_presence(reference_index, resultats, sample_size)
+        for resultat in resultats:
+            del resultat['index'], resultat['unique']
+
+        duration = time.time() - start
+        print(f"🗂️ Comparaison multiple: référence ({len(reference_unique)} clés) contre {len(resultats)} fichiers, "
+              f"{matrice['n_partout']} / {matrice['n_cles']} clés présentes partout en {duration:.2f}s")
+        return {
+            'reference': {'keys': self.reference_keys, 'nb_cles': len(reference_unique),
+                          'index_reutilise': reference_reused},
+            'fichiers': resultats,
+            'matrice': matrice,
+            'duree_s': round(duration, 2)
+        }
+
+
+def comparer_reference_multiple(reference_path: str, reference_keys: List[str], fichiers: List[Dict],
+                                sample_size: int = 1000, chunk_size: int = 5000) -> Dict:
+    """
+    High-level function: compare one reference file with several files
+
+    Args:
+        reference_path: Reference file
+        reference_keys: Key columns of the reference
+        fichiers: Other files, as dicts with 'path', 'keys' and 'nom'
+        sample_size: Rows kept per bucket sample (and keys in the presence matrix sample)
+        chunk_size: Rows per chunk when a key index has to be built
+    """
+    return ComparateurMultiple(reference_path, reference_keys, fichiers, chunk_size).comparer(sample_size)
@@ -1,14 +1,32 @@
 import pandas as pd
+import numpy as np
 import os
 import sqlite3
 from sqlalchemy import create_engine, text
 from typing import Dict, List, Tuple, Iterator, Optional
 import tempfile
 import json
+import glob
+import shutil
 from datetime import datetime
 from .memory_manager import MemoryManager, ChunkProcessor
 from app import db
-from app.utils.encoding_utils import safe_read_csv, detect_csv_encoding
+from app.config import Config
+from app.utils.string_storage import build_composite_key
+from .index_cles import IndexCles, hasher_cles
+from .index_lignes import IndexLignes
+from .empreintes_cles import empreintes_from_merge, unique_key_hashes, save_snapshot
+from .esquisses import EsquissesCles, estimer_recouvrement
+from .planificateur import PlanificateurComparaison, ENGINES, format_plans, measure, record_plan_execution
+from .echantillonnage import (masque_echantillon, estimer_depuis_echantillon, priorites,
+                              plus_petites_priorites, ReservoirBottomK)
+from .rapprochement_flou import rapprocher_cles, resume_rapprochements
+from .alignement_colonnes import appliquer_correspondance
+from .filtres_lignes import filtrer
+from .empreintes_lignes import (COLONNE_EMPREINTE, DiffValeurs, colonnes_comparees, empreinte_lignes,
+                                sans_empreintes)
+from .regles_comparaison import regles_colonnes
+from .ventilation_ecarts import VentilationEcarts, colonnes_dimensions
 
 class ComparateurFichiersAvecMySQL:
     """
@@ -18,12 +36,41 @@ class ComparateurFichiersAvecMySQL:
     
     def __init__(self, file1_path: str, file2_path: str, keys1: List[str], keys2: List[str], 
                  chunk_size: int = 5000, use_mysql_for_comparison: bool = False, 
-                 mysql_connection_string: Optional[str] = None):
+                 mysql_connection_string: Optional[str] = None, sample_size: int = 1000,
+                 sampling_fraction: Optional[float] = None, fuzzy_matching: bool = False,
+                 column_mapping: Optional[Dict[str, str]] = None, predicats1: Optional[List[dict]] = None,
+                 predicats2: Optional[List[dict]] = None, colonnes1: Optional[List[str]] = None,
+                 colonnes2: Optional[List[str]] = None, comparer_valeurs: bool = False,
+                 regles: Optional[Dict[str, Dict]] = None, dimensions: Optional[List[str]] = None):
         self.file1_path = file1_path
         self.file2_path = file2_path
         self.keys1 = keys1
         self.keys2 = keys2
         self.chunk_size = chunk_size
+        self.sample_size = sample_size
+        # Approximate mode: only keys whose hash falls in this fraction of the hash space
+        self.sampling_fraction = sampling_fraction
+        # Fuzzy matching of the keys left unmatched in both files (near-miss keys)
+        self.fuzzy_matching = fuzzy_matching
+        # Renaming of the file 2 columns aligned on file 1 columns ({colonne2: colonne1})
+        self.column_mapping = column_mapping or {}
+        # Row predicates of each file (date range, segment IN list) pushed down into the readers
+        self.predicats1 = predicats1 or []
+        self.predicats2 = predicats2 or []
+        # Dimension columns of the discrepancy breakdown (file 1 names) and their file 2 counterparts
+        self.dimensions, self.dimensions2 = colonnes_dimensions(dimensions, self.column_mapping)
+        # Columns parsed from each file (keys, predicate columns, compared / exported ones and dimensions,
+        # None = all)
+        from .lecteur_fichier_optimise import required_columns
+        self.usecols1 = required_columns(keys1, self.predicats1,
+                                         list(colonnes1) + self.dimensions if colonnes1 is not None else None)
+        self.usecols2 = required_columns(keys2, self.predicats2,
+                                         list(colonnes2) + self.dimensions2 if colonnes2 is not None else None)
+        # Value diff of the matched rows (row fingerprints computed at load time, next to the key hashes)
+        self.comparer_valeurs = comparer_valeurs
+        self._paires_valeurs = None
+        # Comparison rules by file 1 column (numeric tolerance, date granularity, text, ignored column)
+        self.regles = regles or {}
         self.use_mysql_for_comparison = use_mysql_for_comparison
         self.memory_manager = MemoryManager()
         self.chunk_processor = ChunkProcessor(chunk_size)
@@ -33,6 +80,9 @@ class ComparateurFichiersAvecMySQL:
         
         # Determine optimal processing strategy
         self._determine_processing_strategy()
+        if sampling_fraction is not None and sampling_fraction < 1:
+            self.processing_strategy = 'hash_sample'
+            print(f"Approximate comparison on {sampling_fraction:.2%} of the key hash space")
         
         # Setup temporary processing database
         if self.processing_strategy == 'sqlite_temp':
@@ -41,9 +91,9 @@ class ComparateurFichiersAvecMySQL:
             self._setup_mysql_temp()
     
     def _determine_processing_strategy(self):
-        """Determine the best processing strategy based on file sizes and available resources"""
+        """Choose the processing strategy with the cost-based planner (file profiles, key estimates, machine)"""
         try:
-            from .lecteur_fichier_optimise import LecteurFichierOptimise
+            from .lecteur_fichier_optimise import LecteurFichierOptimise, key_index_options
             lecteur = LecteurFichierOptimise()
             file1_info = lecteur.read_file_info(self.file1_path)
             file2_info = lecteur.read_file_info(self.file2_path)
@@ -53,19 +103,40 @@ class ComparateurFichiersAvecMySQL:
             
             print(f"File analysis: {total_rows} total rows, {max_columns} max columns")
             
-            # Strategy decision logic
-            if total_rows > 100000 or max_columns > 200:
-                # Very large files - use SQLite for temporary processing
-                self.processing_strategy = 'sqlite_temp'
-                print("Using SQLite temporary database for very large files")
-            elif total_rows > 20000 and self.use_mysql_for_comparison:
-                # Medium files - can use MySQL temp tables if preferred
-                self.processing_strategy = 'mysql_temp'
-                print("Using MySQL temporary tables for medium files")
-            else:
-                # Small files - use in-memory processing
-                self.processing_strategy = 'memory'
-                print("Using in-memory processing for small files")
+            # Key cardinality and overlap from the profiling sketches (when the files were profiled)
+            self.estimation_cles = self._estimate_keys()
+            
+            planificateur = PlanificateurComparaison()
+            fingerprints = self._fingerprint_columns()
+            rules = self._fingerprint_rules()
+            indexes_reused = (IndexCles.load(self.file1_path, self.keys1,
+                                             key_index_options(self.predicats1, fingerprints[0], rules)) is not None,
+                              IndexCles.load(self.file2_path, self.keys2,
+                                             key_index_options(self.predicats2, fingerprints[1], rules)) is not None)
+            random_access = tuple(info['file_extension'] == 'csv' and not info.get('compression')
+                                  for info in (file1_info, file2_info))
+            self.plans = planificateur.estimate(file1_info, file2_info, self.estimation_cles,
+                                                indexes_reused=indexes_reused, sample_size=self.sample_size,
+                                                random_access=random_access)
+            # Key index engines can be disabled (KEY_INDEX_COMPARISON=false); they never read the dimension
+            # columns of a breakdown
+            allowed = [engine for engine in ENGINES
+                       if (Config.KEY_INDEX_COMPARISON and not self.dimensions)
+                       or engine not in ('key_index', 'stats_only')]
+            self.processing_strategy = planificateur.choose(self.plans, self.sample_size, allowed)
+            self.calibration = planificateur.calibration
+            self.plan_inputs = {
+                'rows': [file1_info['total_rows'], file2_info['total_rows']],
+                'raw_bytes': [file1_info.get('raw_bytes'), file2_info.get('raw_bytes')],
+                'columns': max_columns,
+                'indexes_reused': list(indexes_reused),
+                'merged_rows': self.estimation_cles['merged_rows'] if self.estimation_cles else None,
+                'available_mb': round(planificateur.available_mb),
+                'cores': planificateur.cores,
+                'sample_size': self.sample_size
+            }
+            print(f"🧭 Plan de comparaison ({ENGINES[self.processing_strategy]}):\n"
+                  f"{format_plans(self.plans, self.processing_strategy)}")
             
             # Adjust chunk size based on strategy
             if self.processing_strategy != 'memory':
@@ -77,6 +148,68 @@ class ComparateurFichiersAvecMySQL:
         except Exception as e:
             print(f"Could not analyze files, defaulting to memory processing: {e}")
             self.processing_strategy = 'memory'
+            self.estimation_cles = None
+            self.plans = {}
+    
+    def _value_pairs(self) -> List[Tuple[str, str]]:
+        """Compared (file 1, file 2) column pairs, from the file headers or the projected columns"""
+        if self._paires_valeurs is None:
+            from .lecteur_fichier_optimise import LecteurFichierOptimise
+            lecteur = LecteurFichierOptimise()
+            columns1 = self.usecols1 or lecteur.read_file_info(self.file1_path)['columns']
+            columns2 = self.usecols2 or lecteur.read_file_info(self.file2_path)['columns']
+            self._paires_valeurs = colonnes_comparees(columns1, columns2, self.keys1, self.keys2, self.column_mapping)
+        return self._paires_valeurs
+    
+    def _fingerprint_columns(self) -> Tuple[Optional[List[str]], Optional[List[str]]]:
+        """Row fingerprint columns of each file (None for both when values are not compared)"""
+        if not self.comparer_valeurs:
+            return None, None
+        pairs = self._value_pairs()
+        return [col1 for col1, _ in pairs], [col2 for _, col2 in pairs]
+    
+    def _fingerprint_rules(self) -> Optional[List[Optional[Dict]]]:
+        """Comparison rule of each fingerprint column, aligned with the columns of both files"""
+        if not self.comparer_valeurs:
+            return None
+        return regles_colonnes([col1 for col1, _ in self._value_pairs()], self.regles)
+    
+    def _ventilation(self, colonnes: Optional[List[str]] = None) -> Optional[VentilationEcarts]:
+        """Discrepancy breakdown fed while the rows are classified (None without dimension columns)"""
+        if not self.dimensions:
+            return None
+        return VentilationEcarts(self.dimensions, colonnes if self.comparer_valeurs else None)
+    
+    def _estimate_keys(self) -> Optional[Dict]:
+        """
+        Estimate distinct keys, overlap and merged row count from the HyperLogLog sketches of both files.
+        
+        Returns None when a file has no sketches (they are computed by the upload preview, not here).
+        """
+        esquisses1 = EsquissesCles.load(self.file1_path)
+        esquisses2 = EsquissesCles.load(self.file2_path)
+        if esquisses1 is None or esquisses2 is None:
+            return None
+        
+        estimation = estimer_recouvrement(esquisses1, self.keys1, esquisses2, self.keys2)
+        if estimation is None:
+            # Composite key without its own sketch: per-column bound, overlap unknown (worst case)
+            distinct1 = esquisses1.estimate_distinct(self.keys1)
+            distinct2 = esquisses2.estimate_distinct(self.keys2)
+            common = min(distinct1, distinct2)
+            estimation = {
+                'distinct1': distinct1, 'distinct2': distinct2, 'common': common,
+                'only1': distinct1 - common, 'only2': distinct2 - common,
+                'rows_per_key1': round(esquisses1.rows / distinct1, 2) if distinct1 else 0,
+                'rows_per_key2': round(esquisses2.rows / distinct2, 2) if distinct2 else 0
+            }
+        
+        estimation['merged_rows'] = int(estimation['only1'] * estimation['rows_per_key1']
+                                        + estimation['only2'] * estimation['rows_per_key2']
+                                        + estimation['common'] * estimation['rows_per_key1'] * estimation['rows_per_key2'])
+        print(f"📐 Estimation des clés: {estimation['distinct1']} / {estimation['distinct2']} distinctes, "
+              f"~{estimation['common']} communes, ~{estimation['merged_rows']} lignes fusionnées")
+        return estimation
     
     def _setup_sqlite_temp(self):
         """Setup temporary SQLite database for large file processing"""
@@ -92,6 +225,8 @@ class ComparateurFichiersAvecMySQL:
             CREATE TABLE temp_file1 (
                 id INTEGER PRIMARY KEY,
                 composite_key TEXT,
+                priority INTEGER,
+                empreinte INTEGER,
                 row_data TEXT,
                 UNIQUE(composite_key)
             )
@@ -101,6 +236,8 @@ class ComparateurFichiersAvecMySQL:
             CREATE TABLE temp_file2 (
                 id INTEGER PRIMARY KEY,
                 composite_key TEXT,
+                priority INTEGER,
+                empreinte INTEGER,
                 row_data TEXT,
                 UNIQUE(composite_key)
             )
@@ -109,6 +246,9 @@ class ComparateurFichiersAvecMySQL:
         # Create indexes for performance
         cursor.execute('CREATE INDEX idx_temp_file1_key ON temp_file1(composite_key)')
         cursor.execute('CREATE INDEX idx_temp_file2_key ON temp_file2(composite_key)')
+        # Seeded sampling order: result samples read the k smallest priorities
+        cursor.execute('CREATE INDEX idx_temp_file1_priority ON temp_file1(priority)')
+        cursor.execute('CREATE INDEX idx_temp_file2_priority ON temp_file2(priority)')
         
         self.sqlite_conn.commit()
     
@@ -141,48 +281,58 @@ class ComparateurFichiersAvecMySQL:
             
             conn.commit()
     
-    def _read_file_chunks(self, file_path: str) -> Iterator[pd.DataFrame]:
-        """Read file in chunks"""
-        ext = file_path.split('.')[-1].lower()
-        
-        if ext == 'csv':
-            encoding = detect_csv_encoding(file_path)
-            chunk_iter = pd.read_csv(file_path, chunksize=self.chunk_size, encoding=encoding)
-            for chunk in chunk_iter:
-                yield chunk
-        elif ext in ['xls', 'xlsx']:
-            df = pd.read_excel(file_path)
-            for i in range(0, len(df), self.chunk_size):
-                yield df.iloc[i:i + self.chunk_size]
-        else:
-            raise ValueError(f"Type de fichier non supporté: {ext}")
+    def _read_file_chunks(self, file_path: str, predicats: Optional[List[dict]] = None,
+                          usecols: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+        """
+        Read file in chunks (only the rows matching the predicates, if any, and only `usecols` if given),
+        with the same readers as the other engines (CSV, Excel, JSON, compressed or not)
+        """
+        from .lecteur_fichier_optimise import LecteurFichierOptimise
+        yield from LecteurFichierOptimise(chunk_size=self.chunk_size).read_file_chunks(file_path, predicats=predicats,
+                                                                                       usecols=usecols)
     
-    def _create_composite_key(self, row: pd.Series, key_columns: List[str]) -> str:
-        """Create composite key from specified columns"""
-        return '|'.join(str(row[col]) for col in key_columns)
+    def _read_file(self, file_path: str, usecols: Optional[List[str]] = None) -> pd.DataFrame:
+        """Whole file as one frame (only `usecols` if given)"""
+        chunks = list(self._read_file_chunks(file_path, usecols=usecols))
+        if not chunks:
+            return pd.DataFrame(columns=usecols or [])
+        return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0].reset_index(drop=True)
     
-    def _load_file_to_sqlite(self, file_path: str, table_name: str, key_columns: List[str]):
-        """Load file data into SQLite database in chunks"""
+    def _load_file_to_sqlite(self, file_path: str, table_name: str, key_columns: List[str],
+                             predicats: Optional[List[dict]] = None, usecols: Optional[List[str]] = None,
+                             fingerprint_columns: Optional[List[str]] = None,
+                             fingerprint_rules: Optional[List[Optional[Dict]]] = None):
+        """
+        Load file data into SQLite database in chunks (only `usecols` are serialized, if given, with the row
+        fingerprint over `fingerprint_columns` under `fingerprint_rules` when values are compared)
+        """
         cursor = self.sqlite_conn.cursor()
         processed_rows = 0
         
         print(f"Loading {file_path} into SQLite table {table_name}...")
         
-        for chunk_idx, chunk in enumerate(self._read_file_chunks(file_path)):
+        for chunk_idx, chunk in enumerate(self._read_file_chunks(file_path, predicats, usecols)):
             if chunk_idx % 10 == 0:
                 memory_info = self.memory_manager.get_memory_usage()
                 print(f"Processed {processed_rows} rows, Memory: {memory_info['rss_mb']:.1f} MB")
             
             chunk = self.memory_manager.optimize_dataframe_memory(chunk)
             
+            composite_keys = build_composite_key(chunk, key_columns)
+            # SQLite integers are signed 64-bit: flipping the top bit keeps the unsigned order
+            key_priorities = (priorites(hasher_cles(composite_keys), Config.SAMPLE_SEED)
+                              ^ np.uint64(1 << 63)).view(np.int64).tolist()
+            # Fingerprints are only compared for equality: stored as their signed reinterpretation
+            fingerprints = (empreinte_lignes(chunk, fingerprint_columns, fingerprint_rules).view(np.int64).tolist()
+                            if fingerprint_columns is not None else [None] * len(chunk))
             batch_data = []
-            for _, row in chunk.iterrows():
-                composite_key = self._create_composite_key(row, key_columns)
+            for composite_key, priority, fingerprint, (_, row) in zip(composite_keys, key_priorities, fingerprints,
+                                                                      chunk.iterrows()):
                 row_data = row.to_json()
-                batch_data.append((composite_key, row_data))
+                batch_data.append((composite_key, priority, fingerprint, row_data))
             
             cursor.executemany(
-                f'INSERT OR IGNORE INTO {table_name} (composite_key, row_data) VALUES (?, ?)',
+                f'INSERT OR IGNORE INTO {table_name} (composite_key, priority, empreinte, row_data) VALUES (?, ?, ?, ?)',
                 batch_data
             )
             
@@ -208,9 +358,9 @@ class ComparateurFichiersAvecMySQL:
                 
                 chunk = self.memory_manager.optimize_dataframe_memory(chunk)
                 
+                composite_keys = build_composite_key(chunk, key_columns)
                 batch_data = []
-                for _, row in chunk.iterrows():
-                    composite_key = self._create_composite_key(row, key_columns)
+                for composite_key, (_, row) in zip(composite_keys, chunk.iterrows()):
                     row_data = json.dumps(row.to_dict(), default=str)
                     batch_data.append((composite_key, row_data))
                 
@@ -240,7 +390,15 @@ class ComparateurFichiersAvecMySQL:
         Optimized comparison method that integrates with MySQL for persistent data
         """
         def _perform_comparison():
-            if self.processing_strategy == 'sqlite_temp':
+            if self.processing_strategy == 'hash_sample':
+                return self._compare_hash_sample(sample_size)
+            elif self.processing_strategy == 'key_index':
+                return self._compare_with_key_index(sample_size, projet_id)
+            elif self.processing_strategy == 'stats_only':
+                return self._compare_with_key_index(0, projet_id)
+            elif self.processing_strategy == 'partitioned':
+                return self._compare_partitioned(sample_size, projet_id)
+            elif self.processing_strategy == 'sqlite_temp':
                 return self._compare_with_sqlite(sample_size, projet_id)
             elif self.processing_strategy == 'mysql_temp':
                 return self._compare_with_mysql_temp(sample_size, projet_id)
@@ -248,18 +406,256 @@ class ComparateurFichiersAvecMySQL:
                 return self._compare_in_memory(sample_size, projet_id)
         
         try:
-            return self.chunk_processor.process_with_memory_monitoring(_perform_comparison)
+            results, actual_s, actual_mb = measure(self.chunk_processor.process_with_memory_monitoring,
+                                                   _perform_comparison)
+            self._record_plan(actual_s, actual_mb, projet_id)
+            if self.fuzzy_matching:
+                self._fuzzy_match(results, projet_id)
+            return results
         except Exception as e:
             # Log error to MySQL
             if projet_id:
                 self._log_to_mysql(projet_id, 'échec', f"Erreur lors de la comparaison: {str(e)}")
             raise e
     
+    def _unmatched_keys(self, file_path: str, key_columns: List[str], hashes: np.ndarray,
+                        predicats: Optional[List[dict]] = None) -> pd.Series:
+        """Distinct composite keys of a file whose hash is in the given unmatched bucket (one pass over the keys)"""
+        from .lecteur_fichier_optimise import LecteurFichierOptimise, required_columns
+        lecteur = LecteurFichierOptimise(chunk_size=self.chunk_size)
+        selected = []
+        for chunk in lecteur.read_file_chunks(file_path, predicats=predicats,
+                                              usecols=required_columns(key_columns, predicats, [])):
+            composite_keys = build_composite_key(chunk, key_columns)
+            selected.append(composite_keys[np.isin(hasher_cles(composite_keys), hashes)])
+        if not selected:
+            return pd.Series([], dtype=object)
+        return pd.Series(pd.unique(pd.concat(selected, ignore_index=True).astype(str)), dtype=object)
+    
+    def _fuzzy_match(self, results: Dict, projet_id: Optional[int]):
+        """
+        Add the likely matches between the unmatched keys of both files to the results
+        ('rapprochements_flous' bucket, 'n_fuzzy' count).
+        
+        Works from the bucket key hashes, so every exact strategy is supported; the approximate
+        mode has no complete buckets and is skipped.
+        """
+        empreintes = results.get('empreintes')
+        if not empreintes:
+            print("⚠️ Rapprochement flou ignoré: pas de clés non appariées complètes (mode approximatif)")
+            return
+        only1 = empreintes['uniquement_fichier1']
+        only2 = empreintes['uniquement_fichier2']
+        if len(only1) + len(only2) > Config.FUZZY_MATCH_MAX_KEYS:
+            message = (f"Rapprochement flou ignoré: {len(only1) + len(only2)} clés non appariées "
+                       f"(maximum {Config.FUZZY_MATCH_MAX_KEYS})")
+            print(f"⚠️ {message}")
+            if projet_id:
+                self._log_to_mysql(projet_id, 'avertissement', message)
+            return
+        
+        if len(only1) and len(only2):
+            matches = rapprocher_cles(self._unmatched_keys(self.file1_path, self.keys1, only1, self.predicats1),
+                                      self._unmatched_keys(self.file2_path, self.keys2, only2, self.predicats2),
+                                      Config.FUZZY_MATCH_THRESHOLD)
+        else:
+            matches = rapprocher_cles(pd.Series([], dtype=object), pd.Series([], dtype=object))
+        results['rapprochements_flous'] = matches
+        results['n_fuzzy'] = len(matches)
+        if projet_id:
+            summary = resume_rapprochements(matches)
+            self._log_to_mysql(projet_id, 'succès',
+                               f"Rapprochement flou: {summary['total']} correspondances probables "
+                               f"{summary['par_methode']}")
+    
+    def _record_plan(self, actual_s: float, actual_mb: float, projet_id: Optional[int]):
+        """Log predicted vs actual time and memory of the chosen plan (calibration of the planner)"""
+        if self.processing_strategy not in self.plans:
+            return
+        record = record_plan_execution(self.processing_strategy, self.plans, actual_s, actual_mb,
+                                       self.plan_inputs, self.calibration)
+        message = (f"Plan {self.processing_strategy}: prévu ~{record['predicted_s']}s / ~{record['predicted_mb']} MB, "
+                   f"réel {record['actual_s']}s / {record['actual_mb']} MB")
+        print(f"🧭 {message}")
+        if projet_id:
+            self._log_to_mysql(projet_id, 'succès', message)
+    
+    def _compare_hash_sample(self, sample_size: int) -> Dict:
+        """
+        Approximate comparison: keep in both files only the rows whose key hash falls in the
+        sampled fraction of the hash space, merge them in memory and scale the counts.
+        
+        The same keys are sampled on both sides, so the estimates are unbiased. Results are not
+        saved as project statistics.
+        """
+        from .lecteur_fichier_optimise import LecteurFichierOptimise
+        lecteur = LecteurFichierOptimise(chunk_size=self.chunk_size)
+        fraction = self.sampling_fraction
+        
+        sampled = []
+        totals = []
+        for file_path, key_columns, predicats, usecols in (
+                (self.file1_path, self.keys1, self.predicats1, self.usecols1),
+                (self.file2_path, self.keys2, self.predicats2, self.usecols2)):
+            parts = []
+            rows = 0
+            for chunk in lecteur.read_file_chunks(file_path, predicats=predicats, usecols=usecols):
+                keys = build_composite_key(chunk, key_columns)
+                mask = masque_echantillon(hasher_cles(keys), fraction)
+                if mask.any():
+                    part = chunk[mask].copy()
+                    part['_compare_key'] = keys[mask]
+                    parts.append(part)
+                rows += len(chunk)
+            totals.append(rows)
+            sampled.append(pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['_compare_key']))
+        
+        merged = pd.merge(sampled[0], sampled[1], on='_compare_key', how='outer', indicator=True)
+        counts = merged['_merge'].value_counts()
+        n1 = int(counts.get('left_only', 0))
+        n2 = int(counts.get('right_only', 0))
+        n_common = int(counts.get('both', 0))
+        approximation = estimer_depuis_echantillon(n1, n2, n_common, fraction)
+        print(f"Hash sample: {len(sampled[0])} + {len(sampled[1])} rows kept out of {totals[0]} + {totals[1]}")
+        # Values are not compared in this mode: breakdown of the missing rows of the sampled keys only
+        ventilation = VentilationEcarts(self.dimensions) if self.dimensions else None
+        if ventilation is not None:
+            ventilation.ajouter(merged)
+        
+        results = {
+            'ecarts_fichier1': self._sample_bucket(merged[merged['_merge'] == 'left_only'], sample_size),
+            'ecarts_fichier2': self._sample_bucket(merged[merged['_merge'] == 'right_only'], sample_size),
+            'communs': self._sample_bucket(merged[merged['_merge'] == 'both'], sample_size),
+            'total': approximation['total']['estimate'],
+            'n1': approximation['n1']['estimate'],
+            'n2': approximation['n2']['estimate'],
+            'n_common': approximation['n_common']['estimate'],
+            'total_ecarts': approximation['n1']['estimate'] + approximation['n2']['estimate'],
+            'nb_df': totals[0],
+            'nb_df2': totals[1],
+            'pct1': approximation['pct1']['estimate'],
+            'pct2': approximation['pct2']['estimate'],
+            'pct_both': approximation['pct_both']['estimate'],
+            'approximation': approximation
+        }
+        if ventilation is not None:
+            results['ventilation'] = ventilation.resultat(fraction)
+        return results
+    
+    def _compare_partitioned(self, sample_size: int, projet_id: Optional[int]) -> Dict:
+        """
+        Hash-partition both files on their key into temporary files, then merge each partition in memory.
+        
+        Same results as the in-memory merge, with a memory peak of one partition.
+        """
+        from .lecteur_fichier_optimise import LecteurFichierOptimise
+        lecteur = LecteurFichierOptimise(chunk_size=self.chunk_size)
+        partitions = self.plans.get('partitioned', {}).get('partitions', 8)
+        fingerprints = self._fingerprint_columns()
+        diff = DiffValeurs(fingerprints[0], sample_size, self.regles) if self.comparer_valeurs else None
+        ventilation = self._ventilation(fingerprints[0])
+        temp_dir = tempfile.mkdtemp(prefix='partitions_')
+        print(f"Partitioning both files into {partitions} partitions...")
+        
+        try:
+            totals = []
+            schemas = []
+            for side, (file_path, key_columns, predicats, usecols) in enumerate((
+                    (self.file1_path, self.keys1, self.predicats1, self.usecols1),
+                    (self.file2_path, self.keys2, self.predicats2, self.usecols2))):
+                rows = 0
+                schema = None
+                for chunk_idx, chunk in enumerate(lecteur.read_file_chunks(file_path, predicats=predicats,
+                                                                           usecols=usecols)):
+                    chunk = chunk.copy()
+                    chunk['_compare_key'] = build_composite_key(chunk, key_columns)
+                    if diff is not None:
+                        # File 2 columns take their file 1 names first: fingerprints over the compared columns
+                        if side == 1:
+                            chunk = appliquer_correspondance(chunk, self.column_mapping, key_columns)
+                        chunk[COLONNE_EMPREINTE] = empreinte_lignes(chunk, diff.colonnes, diff.regles)
+                    if schema is None:
+                        schema = chunk.iloc[:0]
+                    partition_ids = hasher_cles(chunk['_compare_key']) % np.uint64(partitions)
+                    for partition_id, part in chunk.groupby(partition_ids, sort=False):
+                        part.to_pickle(os.path.join(temp_dir, f"f{side}_p{partition_id}_{chunk_idx}.pkl"))
+                    rows += len(chunk)
+                totals.append(rows)
+                schemas.append(schema if schema is not None else pd.DataFrame(columns=['_compare_key']))
+            
+            def _read_partition(side: int, partition_id: int) -> pd.DataFrame:
+                parts = sorted(glob.glob(os.path.join(temp_dir, f"f{side}_p{partition_id}_*.pkl")))
+                return pd.concat([pd.read_pickle(part) for part in parts], ignore_index=True) if parts else None
+            
+            n1 = n2 = n_common = 0
+            # One bounded reservoir per bucket, fed partition by partition
+            reservoirs = {bucket: ReservoirBottomK(sample_size) for bucket in ('left_only', 'right_only', 'both')}
+            empreintes = {bucket: [] for bucket in ('uniquement_fichier1', 'uniquement_fichier2', 'communs')}
+            for partition_id in range(partitions):
+                df1 = _read_partition(0, partition_id)
+                df2 = _read_partition(1, partition_id)
+                if df1 is None and df2 is None:
+                    continue
+                # A side without rows in this partition: empty frame with its columns
+                df1 = df1 if df1 is not None else schemas[0]
+                df2 = df2 if df2 is not None else schemas[1]
+                merged = pd.merge(df1, df2, on='_compare_key', how='outer', indicator=True)
+                
+                for bucket, reservoir in reservoirs.items():
+                    bucket_rows = merged[merged['_merge'] == bucket]
+                    reservoir.offer(self._key_priorities(bucket_rows), bucket_rows)
+                counts = merged['_merge'].value_counts()
+                n1 += int(counts.get('left_only', 0))
+                n2 += int(counts.get('right_only', 0))
+                n_common += int(counts.get('both', 0))
+                differences = diff.ajouter(merged[merged['_merge'] == 'both']) if diff is not None else None
+                if ventilation is not None:
+                    ventilation.ajouter(merged, differences)
+                for bucket, hashes in empreintes_from_merge(merged).items():
+                    empreintes[bucket].append(hashes)
+                self.memory_manager.force_garbage_collection()
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        
+        total = n1 + n2 + n_common
+        results = {
+            'ecarts_fichier1': sans_empreintes(reservoirs['left_only'].result()),
+            'ecarts_fichier2': sans_empreintes(reservoirs['right_only'].result()),
+            'communs': sans_empreintes(reservoirs['both'].result()),
+            'total': total,
+            'n1': n1,
+            'n2': n2,
+            'n_common': n_common,
+            'total_ecarts': n1 + n2,
+            'nb_df': totals[0],
+            'nb_df2': totals[1],
+            'pct1': round(n1 / total * 100, 2) if total > 0 else 0,
+            'pct2': round(n2 / total * 100, 2) if total > 0 else 0,
+            'pct_both': round(n_common / total * 100, 2) if total > 0 else 0,
+            # Partitions hold disjoint keys: concatenated hashes only need sorting
+            'empreintes': {bucket: np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.uint64)
+                           for bucket, parts in empreintes.items()}
+        }
+        if diff is not None:
+            results['diff_valeurs'] = diff.resultat()
+            results['lignes_modifiees'] = diff.lignes_modifiees()
+        if ventilation is not None:
+            results['ventilation'] = ventilation.resultat()
+        
+        if projet_id:
+            self._save_results_to_mysql(results, projet_id)
+        
+        return results
+    
     def _compare_with_sqlite(self, sample_size: int, projet_id: Optional[int]) -> Dict:
         """Compare using SQLite temporary database"""
         # Load files into SQLite
-        self._load_file_to_sqlite(self.file1_path, 'temp_file1', self.keys1)
-        self._load_file_to_sqlite(self.file2_path, 'temp_file2', self.keys2)
+        fingerprints1, fingerprints2 = self._fingerprint_columns()
+        rules = self._fingerprint_rules()
+        self._load_file_to_sqlite(self.file1_path, 'temp_file1', self.keys1, self.predicats1, self.usecols1,
+                                  fingerprints1, rules)
+        self._load_file_to_sqlite(self.file2_path, 'temp_file2', self.keys2, self.predicats2, self.usecols2,
+                                  fingerprints2, rules)
         
         # Get statistics
         cursor = self.sqlite_conn.cursor()
@@ -306,8 +702,17 @@ class ComparateurFichiersAvecMySQL:
             'pct1': round(n1 / total * 100, 2) if total > 0 else 0,
             'pct2': round(n2 / total * 100, 2) if total > 0 else 0,
             'pct_both': round(n_common / total * 100, 2) if total > 0 else 0,
+            'empreintes': self._get_sqlite_empreintes(),
             **sample_data
         }
+        ventilation = self._ventilation(fingerprints1)
+        if self.comparer_valeurs:
+            diff = self._get_sqlite_diff(fingerprints1, sample_size, ventilation)
+            results['diff_valeurs'] = diff.resultat()
+            results['lignes_modifiees'] = diff.lignes_modifiees()
+        if ventilation is not None:
+            self._get_sqlite_ventilation(ventilation)
+            results['ventilation'] = ventilation.resultat()
         
         # Save results to MySQL
         if projet_id:
@@ -315,8 +720,107 @@ class ComparateurFichiersAvecMySQL:
         
         return results
     
+    def _get_sqlite_diff(self, colonnes: List[str], sample_size: int,
+                         ventilation: Optional[VentilationEcarts] = None) -> DiffValeurs:
+        """
+        Value diff of the matched rows: equal fingerprints are counted in SQL, only the rows whose
+        fingerprints differ are decoded and diffed, in batches (modified rows added to the breakdown)
+        """
+        diff = DiffValeurs(colonnes, sample_size, self.regles)
+        cursor = self.sqlite_conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) FROM temp_file1 f1
+            INNER JOIN temp_file2 f2 ON f1.composite_key = f2.composite_key
+            WHERE f1.empreinte = f2.empreinte
+        ''')
+        diff.compter(cursor.fetchone()[0], 0)
+        
+        cursor.execute('''
+            SELECT f1.composite_key, f1.empreinte, f1.row_data, f2.empreinte, f2.row_data FROM temp_file1 f1
+            INNER JOIN temp_file2 f2 ON f1.composite_key = f2.composite_key
+            WHERE f1.empreinte != f2.empreinte
+        ''')
+        while True:
+            batch = cursor.fetchmany(self.chunk_size)
+            if not batch:
+                break
+            keys = [row[0] for row in batch]
+            rows1 = pd.DataFrame([json.loads(row[2]) for row in batch]).assign(
+                _compare_key=keys, **{COLONNE_EMPREINTE: [row[1] for row in batch]})
+            rows2 = appliquer_correspondance(pd.DataFrame([json.loads(row[4]) for row in batch]),
+                                             self.column_mapping, self.keys2).assign(
+                _compare_key=keys, **{COLONNE_EMPREINTE: [row[3] for row in batch]})
+            merged = pd.merge(rows1, rows2, on='_compare_key', how='inner').assign(_merge='both')
+            differences = diff.ajouter(merged)
+            if ventilation is not None:
+                ventilation.ajouter(merged, differences, compter_lignes=False)
+        return diff
+    
+    def _get_sqlite_ventilation(self, ventilation: VentilationEcarts):
+        """Rows per bucket and dimension value, grouped in SQL on the JSON rows and read in batches"""
+        queries = {
+            'uniquement_fichier1': ('f1', '''
+                FROM temp_file1 f1
+                LEFT JOIN temp_file2 f2 ON f1.composite_key = f2.composite_key
+                WHERE f2.composite_key IS NULL
+            '''),
+            'uniquement_fichier2': ('f2', '''
+                FROM temp_file2 f2
+                LEFT JOIN temp_file1 f1 ON f2.composite_key = f1.composite_key
+                WHERE f1.composite_key IS NULL
+            '''),
+            'communs': ('f1', '''
+                FROM temp_file1 f1
+                INNER JOIN temp_file2 f2 ON f1.composite_key = f2.composite_key
+            ''')
+        }
+        for dimension, dimension2 in zip(self.dimensions, self.dimensions2):
+            for mesure, (table, query) in queries.items():
+                column = dimension2 if table == 'f2' else dimension
+                path = f'$."{column}"'
+                cursor = self.sqlite_conn.cursor()
+                cursor.execute(f"SELECT json_extract({table}.row_data, ?) AS valeur, COUNT(*) {query} GROUP BY valeur",
+                               (path,))
+                while True:
+                    batch = cursor.fetchmany(self.chunk_size)
+                    if not batch:
+                        break
+                    ventilation.ajouter_groupes(dimension, mesure, [row[0] for row in batch],
+                                                [row[1] for row in batch])
+    
+    def _get_sqlite_empreintes(self) -> Dict[str, np.ndarray]:
+        """Key hashes per bucket, read from the SQLite tables in batches"""
+        queries = {
+            'uniquement_fichier1': '''
+                SELECT f1.composite_key FROM temp_file1 f1
+                LEFT JOIN temp_file2 f2 ON f1.composite_key = f2.composite_key
+                WHERE f2.composite_key IS NULL
+            ''',
+            'uniquement_fichier2': '''
+                SELECT f2.composite_key FROM temp_file2 f2
+                LEFT JOIN temp_file1 f1 ON f2.composite_key = f1.composite_key
+                WHERE f1.composite_key IS NULL
+            ''',
+            'communs': '''
+                SELECT f1.composite_key FROM temp_file1 f1
+                INNER JOIN temp_file2 f2 ON f1.composite_key = f2.composite_key
+            '''
+        }
+        empreintes = {}
+        for bucket, query in queries.items():
+            cursor = self.sqlite_conn.cursor()
+            cursor.execute(query)
+            parts = [np.empty(0, dtype=np.uint64)]
+            while True:
+                batch = cursor.fetchmany(100000)
+                if not batch:
+                    break
+                parts.append(unique_key_hashes(pd.Series([row[0] for row in batch], dtype=object)))
+            empreintes[bucket] = np.unique(np.concatenate(parts))
+        return empreintes
+    
     def _get_sqlite_sample_data(self, limit: int) -> Dict:
-        """Get sample data from SQLite tables"""
+        """Get seeded sample data from SQLite tables (rows with the smallest key priorities)"""
         cursor = self.sqlite_conn.cursor()
         
         # Sample from differences
@@ -324,6 +828,7 @@ class ComparateurFichiersAvecMySQL:
             SELECT f1.row_data FROM temp_file1 f1
             LEFT JOIN temp_file2 f2 ON f1.composite_key = f2.composite_key
             WHERE f2.composite_key IS NULL
+            ORDER BY f1.priority
             LIMIT ?
         ''', (limit,))
         
@@ -333,6 +838,7 @@ class ComparateurFichiersAvecMySQL:
             SELECT f2.row_data FROM temp_file2 f2
             LEFT JOIN temp_file1 f1 ON f2.composite_key = f1.composite_key
             WHERE f1.composite_key IS NULL
+            ORDER BY f2.priority
             LIMIT ?
         ''', (limit,))
         
@@ -341,6 +847,7 @@ class ComparateurFichiersAvecMySQL:
         cursor.execute('''
             SELECT f1.row_data FROM temp_file1 f1
             INNER JOIN temp_file2 f2 ON f1.composite_key = f2.composite_key
+            ORDER BY f1.priority
             LIMIT ?
         ''', (limit,))
         
@@ -352,28 +859,189 @@ class ComparateurFichiersAvecMySQL:
             'communs': pd.DataFrame(communs_data)
         }
     
+    @staticmethod
+    def _load_key_index(lecteur, file_path: str, key_columns: List[str], label: str,
+                        predicats: Optional[List[dict]] = None,
+                        fingerprint_columns: Optional[List[str]] = None,
+                        fingerprint_rules: Optional[List[Optional[Dict]]] = None) -> Tuple[IndexCles, bool]:
+        """Reuse the persisted key index of an unchanged file, or build it from one pass over the file"""
+        from .lecteur_fichier_optimise import key_index_options
+        # Sidecars live next to the content-addressed blob: same content, key columns, filter and
+        # fingerprint definition -> same index
+        index = IndexCles.load(file_path, key_columns,
+                               key_index_options(predicats, fingerprint_columns, fingerprint_rules))
+        if index is not None:
+            print(f"♻️ {label} inchangé: index de clés réutilisé ({index.row_count} lignes)")
+            return index, True
+        print(f"🔑 {label}: construction de l'index de clés...")
+        return lecteur.create_key_index(file_path, key_columns, predicats, fingerprint_columns,
+                                        fingerprint_rules), False
+    
+    @staticmethod
+    def _read_rows_by_number(lecteur, file_path: str, rows: np.ndarray, key_index: IndexCles,
+                             usecols: Optional[List[str]] = None) -> pd.DataFrame:
+        """Read the given data rows of a file (sorted row numbers of its key index), only `usecols` if given"""
+        if len(rows) == 0:
+            return pd.DataFrame()
+        
+        file_info = lecteur.read_file_info(file_path)
+        if file_info['file_extension'] == 'csv' and not file_info.get('compression'):
+            try:
+                line_index = IndexLignes.load_or_build(file_path, file_info.get('encoding', 'utf-8'))
+            except ValueError:
+                line_index = None
+            # Random access only when both indexes number the rows alike (filtered key indexes are numbered
+            # from the line index itself)
+            if line_index is not None and (key_index.meta.get('filtered')
+                                           or line_index.row_count == key_index.row_count):
+                return line_index.read_row_numbers(rows, file_info.get('encoding', 'utf-8'),
+                                                   file_info.get('delimiter', ','), usecols=usecols)
+        
+        # Other formats: one pass over the file keeping the requested rows
+        selected = []
+        offset = 0
+        for chunk in lecteur.read_file_chunks(file_path, usecols=usecols):
+            lo = np.searchsorted(rows, offset)
+            hi = np.searchsorted(rows, offset + len(chunk))
+            if hi > lo:
+                selected.append(chunk.iloc[rows[lo:hi] - offset])
+            offset += len(chunk)
+            if hi == len(rows):
+                break
+        return pd.concat(selected, ignore_index=True) if selected else pd.DataFrame()
+    
+    def _compare_with_key_index(self, sample_size: int, projet_id: Optional[int]) -> Dict:
+        """
+        Compare the sorted key hashes of both files.
+        
+        A file unchanged since a previous comparison (same content, same key columns) keeps its
+        persisted index, so only the changed file is read and hashed.
+        """
+        from .lecteur_fichier_optimise import LecteurFichierOptimise
+        lecteur = LecteurFichierOptimise(chunk_size=self.chunk_size)
+        
+        fingerprints1, fingerprints2 = self._fingerprint_columns()
+        rules = self._fingerprint_rules()
+        index1, reused1 = self._load_key_index(lecteur, self.file1_path, self.keys1, 'Fichier 1', self.predicats1,
+                                               fingerprints1, rules)
+        index2, reused2 = self._load_key_index(lecteur, self.file2_path, self.keys2, 'Fichier 2', self.predicats2,
+                                               fingerprints2, rules)
+        
+        # Distinct keys, as in the SQLite strategy (first row kept for duplicated keys)
+        unique1 = index1.unique_hashes()
+        unique2 = index2.unique_hashes()
+        in_file2 = np.isin(unique1, unique2, assume_unique=True)
+        in_file1 = np.isin(unique2, unique1, assume_unique=True)
+        
+        only1 = unique1[~in_file2]
+        only2 = unique2[~in_file1]
+        common = unique1[in_file2]
+        n1, n2, n_common = len(only1), len(only2), len(common)
+        
+        def _first_rows(key_index: IndexCles, hashes: np.ndarray) -> np.ndarray:
+            # Seeded sample of the bucket keys (same keys as the other strategies)
+            hashes = hashes[plus_petites_priorites(priorites(hashes, Config.SAMPLE_SEED), sample_size)]
+            # Stable sort: the leftmost entry of a hash is its first row in the file
+            positions = np.searchsorted(key_index.hashes, hashes, side='left')
+            return np.sort(np.asarray(key_index.rows[positions]).astype(np.int64))
+        
+        total = n1 + n2 + n_common
+        results = {
+            'n1': n1,
+            'n2': n2,
+            'n_common': n_common,
+            'total': total,
+            'nb_df': len(unique1),
+            'nb_df2': len(unique2),
+            'total_ecarts': n1 + n2,
+            'pct1': round(n1 / total * 100, 2) if total > 0 else 0,
+            'pct2': round(n2 / total * 100, 2) if total > 0 else 0,
+            'pct_both': round(n_common / total * 100, 2) if total > 0 else 0,
+            'ecarts_fichier1': self._read_rows_by_number(lecteur, self.file1_path, _first_rows(index1, only1), index1,
+                                                         self.usecols1),
+            'ecarts_fichier2': self._read_rows_by_number(lecteur, self.file2_path, _first_rows(index2, only2), index2,
+                                                         self.usecols2),
+            'communs': self._read_rows_by_number(lecteur, self.file1_path, _first_rows(index1, common), index1,
+                                                 self.usecols1),
+            'empreintes': {'uniquement_fichier1': only1, 'uniquement_fichier2': only2, 'communs': common}
+        }
+        if self.comparer_valeurs:
+            self._diff_key_index(results, lecteur, index1, index2, common, _first_rows)
+        
+        if projet_id:
+            reused = [label for label, flag in (('fichier1', reused1), ('fichier2', reused2)) if flag]
+            if reused:
+                self._log_to_mysql(projet_id, 'succès',
+                                   f"Index de clés réutilisé (fichier inchangé): {', '.join(reused)}")
+            self._save_results_to_mysql(results, projet_id)
+        
+        return results
+    
+    def _diff_key_index(self, results: Dict, lecteur, index1: IndexCles, index2: IndexCles, common: np.ndarray,
+                        first_rows) -> None:
+        """
+        Value diff from the row fingerprints of both key indexes: matched keys (first row of each key) with
+        equal fingerprints are identical; only a seeded sample of the modified rows is read and diffed.
+        """
+        fingerprints1 = np.asarray(index1.empreintes)[np.searchsorted(index1.hashes, common, side='left')]
+        fingerprints2 = np.asarray(index2.empreintes)[np.searchsorted(index2.hashes, common, side='left')]
+        same = fingerprints1 == fingerprints2
+        pairs = self._value_pairs()
+        diff = DiffValeurs([col1 for col1, _ in pairs], self.sample_size, self.regles)
+        diff.partiel = True
+        
+        modified = common[~same]
+        rows1 = self._read_rows_by_number(lecteur, self.file1_path, first_rows(index1, modified), index1, self.usecols1)
+        rows2 = self._read_rows_by_number(lecteur, self.file2_path, first_rows(index2, modified), index2, self.usecols2)
+        if len(rows1) and len(rows2):
+            rows2 = appliquer_correspondance(rows2, self.column_mapping, self.keys2)
+            for frame, key_columns in ((rows1, self.keys1), (rows2, self.keys2)):
+                frame['_compare_key'] = build_composite_key(frame, key_columns)
+                frame[COLONNE_EMPREINTE] = empreinte_lignes(frame, diff.colonnes, diff.regles)
+            diff.ajouter(pd.merge(rows1, rows2, on='_compare_key', how='inner'), compter=False)
+        # Rows whose fingerprints differ may still be equal under a tolerance: the modified share
+        # measured on the sample is applied to all of them (every one of them when none was read)
+        n_candidats = len(modified)
+        n_modifies = (int(round(n_candidats * diff.reservoir.seen / diff.n_candidats)) if diff.n_candidats
+                      else n_candidats)
+        diff.compter(len(common) - n_modifies, n_modifies)
+        results['diff_valeurs'] = diff.resultat()
+        results['lignes_modifiees'] = diff.lignes_modifiees()
+    
+    @staticmethod
+    def _key_priorities(frame: pd.DataFrame) -> np.ndarray:
+        """Seeded sampling priority of each row, from its composite key"""
+        return priorites(hasher_cles(frame['_compare_key']), Config.SAMPLE_SEED)
+    
+    def _sample_bucket(self, bucket: pd.DataFrame, sample_size: int) -> pd.DataFrame:
+        """Seeded uniform sample of a bucket (rows with the smallest key priorities, in file order)"""
+        if len(bucket) <= sample_size:
+            return bucket
+        keep = plus_petites_priorites(self._key_priorities(bucket), sample_size)
+        return bucket.iloc[np.sort(keep)]
+    
     def _compare_in_memory(self, sample_size: int, projet_id: Optional[int]) -> Dict:
         """Fallback in-memory comparison for smaller files"""
-        ext1 = self.file1_path.split('.')[-1].lower()
-        ext2 = self.file2_path.split('.')[-1].lower()
+        df1 = self._read_file(self.file1_path, self.usecols1)
+        df2 = self._read_file(self.file2_path, self.usecols2)
         
-        if ext1 == 'csv':
-            df1 = safe_read_csv(self.file1_path)
-        elif ext1 in ['xls', 'xlsx']:
-            df1 = pd.read_excel(self.file1_path)
-        
-        if ext2 == 'csv':
-            df2 = safe_read_csv(self.file2_path)
-        elif ext2 in ['xls', 'xlsx']:
-            df2 = pd.read_excel(self.file2_path)
+        df1 = filtrer(df1, self.predicats1)
+        df2 = filtrer(df2, self.predicats2)
         
         # Optimize memory
         df1 = self.memory_manager.optimize_dataframe_memory(df1)
         df2 = self.memory_manager.optimize_dataframe_memory(df2)
+        df2 = appliquer_correspondance(df2, self.column_mapping, self.keys2)
         
         # Create composite keys
-        df1['_compare_key'] = df1[self.keys1].astype(str).agg('|'.join, axis=1)
-        df2['_compare_key'] = df2[self.keys2].astype(str).agg('|'.join, axis=1)
+        df1['_compare_key'] = build_composite_key(df1, self.keys1)
+        df2['_compare_key'] = build_composite_key(df2, self.keys2)
+        if self.comparer_valeurs:
+            # Row fingerprints next to the keys (file 2 columns already renamed after file 1)
+            colonnes = [col for col, _ in colonnes_comparees(df1.columns, df2.columns, self.keys1, self.keys2)]
+            regles = regles_colonnes(colonnes, self.regles)
+            df1[COLONNE_EMPREINTE] = empreinte_lignes(df1, colonnes, regles)
+            df2[COLONNE_EMPREINTE] = empreinte_lignes(df2, colonnes, regles)
         
         # Merge and compare
         merged = pd.merge(df1, df2, on='_compare_key', how='outer', indicator=True)
@@ -381,14 +1049,21 @@ class ComparateurFichiersAvecMySQL:
         ecarts_fichier1 = merged[merged['_merge'] == 'left_only']
         ecarts_fichier2 = merged[merged['_merge'] == 'right_only']
         communs = merged[merged['_merge'] == 'both']
+        diff = None
+        differences = None
+        if self.comparer_valeurs:
+            diff = DiffValeurs(colonnes, sample_size, self.regles)
+            differences = diff.ajouter(communs)
+            ecarts_fichier1, ecarts_fichier2, communs = (sans_empreintes(bucket) for bucket in
+                                                         (ecarts_fichier1, ecarts_fichier2, communs))
+        ventilation = self._ventilation(colonnes if diff is not None else None)
+        if ventilation is not None:
+            ventilation.ajouter(merged, differences)
         
-        # Limit sample size for display
-        if len(ecarts_fichier1) > sample_size:
-            ecarts_fichier1 = ecarts_fichier1.sample(sample_size)
-        if len(ecarts_fichier2) > sample_size:
-            ecarts_fichier2 = ecarts_fichier2.sample(sample_size)
-        if len(communs) > sample_size:
-            communs = communs.sample(sample_size)
+        # Limit sample size for display (seeded, reproducible sample)
+        ecarts_fichier1 = self._sample_bucket(ecarts_fichier1, sample_size)
+        ecarts_fichier2 = self._sample_bucket(ecarts_fichier2, sample_size)
+        communs = self._sample_bucket(communs, sample_size)
         
         total = len(merged)
         n1 = len(merged[merged['_merge'] == 'left_only'])
@@ -408,8 +1083,14 @@ class ComparateurFichiersAvecMySQL:
             'nb_df2': len(df2),
             'pct1': round(n1 / total * 100, 2) if total > 0 else 0,
             'pct2': round(n2 / total * 100, 2) if total > 0 else 0,
-            'pct_both': round(n_common / total * 100, 2) if total > 0 else 0
+            'pct_both': round(n_common / total * 100, 2) if total > 0 else 0,
+            'empreintes': empreintes_from_merge(merged)
         }
+        if diff is not None:
+            results['diff_valeurs'] = diff.resultat()
+            results['lignes_modifiees'] = diff.lignes_modifiees()
+        if ventilation is not None:
+            results['ventilation'] = ventilation.resultat()
         
         # Save results to MySQL
         if projet_id:
@@ -454,12 +1135,18 @@ class ComparateurFichiersAvecMySQL:
                 nb_ecarts_uniquement_fichier1=results['n1'],
                 nb_ecarts_uniquement_fichier2=results['n2'],
                 nb_ecarts_communs=results['n_common'],
-                date_execution=datetime.now()
+                date_execution=datetime.now(),
+                # Discrepancy breakdown by dimension, shown by the dashboard without reading the files again
+                ventilation=(json.dumps(results['ventilation'], ensure_ascii=False)
+                             if results.get('ventilation') else None)
             )
             db.session.add(stat)
             
             db.session.commit()
             
+            # Key hashes of this run, for churn reports between runs
+            save_snapshot(stat, results.get('empreintes'))
+            
             # Log success
             self._log_to_mysql(projet_id, 'succès', 
                              f"Comparaison terminée: {results['n_common']} communs, "
@@ -506,7 +1193,16 @@ class ComparateurFichiersAvecMySQL:
 # Convenience function that integrates with existing MySQL setup
 def comparer_fichiers_avec_mysql(file1_path: str, file2_path: str, keys1: List[str], keys2: List[str], 
                                 projet_id: Optional[int] = None, chunk_size: int = 5000, 
-                                sample_size: int = 1000, use_mysql_temp: bool = False) -> Dict:
+                                sample_size: int = 1000, use_mysql_temp: bool = False,
+                                sampling_fraction: Optional[float] = None, fuzzy_matching: bool = False,
+                                column_mapping: Optional[Dict[str, str]] = None,
+                                predicats1: Optional[List[dict]] = None,
+                                predicats2: Optional[List[dict]] = None,
+                                colonnes1: Optional[List[str]] = None,
+                                colonnes2: Optional[List[str]] = None,
+                                comparer_valeurs: bool = False,
+                                regles: Optional[Dict[str, Dict]] = None,
+                                dimensions: Optional[List[str]] = None) -> Dict:
     """
     High-level function to compare files with full MySQL integration
     
@@ -519,11 +1215,33 @@ def comparer_fichiers_avec_mysql(file1_path: str, file2_path: str, keys1: List[s
         chunk_size: Size of chunks for processing
         sample_size: Size of sample data to return
         use_mysql_temp: Whether to use MySQL temporary tables (vs SQLite) for medium files
+                        (not selected by the cost-based planner)
+        sampling_fraction: Approximate mode, fraction (0-1] of the key hash space compared
+        fuzzy_matching: Report likely matches between the keys left unmatched in both files
+        column_mapping: File 2 columns renamed after their aligned file 1 column ({colonne2: colonne1})
+        predicats1, predicats2: Row predicates of each file (see app.services.filtres_lignes), only the
+                                matching rows are compared
+        colonnes1, colonnes2: Compared / exported columns of each file (None = all): only these, the keys
+                              and the predicate columns are parsed
+        comparer_valeurs: Value diff of the matched rows (identical / modified rows, mismatches per column)
+        regles: Comparison rules of the value diff by file 1 column (see app.services.regles_comparaison)
+        dimensions: File 1 columns breaking the discrepancies down by value (top values per column)
     """
     comparateur = ComparateurFichiersAvecMySQL(
         file1_path, file2_path, keys1, keys2, 
         chunk_size=chunk_size, 
-        use_mysql_for_comparison=use_mysql_temp
+        use_mysql_for_comparison=use_mysql_temp,
+        sample_size=sample_size,
+        sampling_fraction=sampling_fraction,
+        fuzzy_matching=fuzzy_matching,
+        column_mapping=column_mapping,
+        predicats1=predicats1,
+        predicats2=predicats2,
+        colonnes1=colonnes1,
+        colonnes2=colonnes2,
+        comparer_valeurs=comparer_valeurs,
+        regles=regles,
+        dimensions=dimensions
     )
     
     try:
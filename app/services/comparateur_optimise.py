@@ -7,6 +7,8 @@ import json
 from datetime import datetime
 from .memory_manager import MemoryManager, ChunkProcessor
 from app.utils.encoding_utils import safe_read_csv, detect_csv_encoding
+from app.utils.compression import get_file_extension
+from app.utils.string_storage import to_string_storage, build_composite_key
 
 class ComparateurFichiersOptimise:
     """Optimized file comparator for large files using chunking and database operations"""
@@ -84,24 +86,20 @@ class ComparateurFichiersOptimise:
     
     def _read_file_chunks(self, file_path: str) -> Iterator[pd.DataFrame]:
         """Read file in chunks"""
-        ext = file_path.split('.')[-1].lower()
+        ext = get_file_extension(file_path)
         
         if ext == 'csv':
             encoding = detect_csv_encoding(file_path)
             chunk_iter = pd.read_csv(file_path, chunksize=self.chunk_size, encoding=encoding)
             for chunk in chunk_iter:
-                yield chunk
+                yield to_string_storage(chunk)
         elif ext in ['xls', 'xlsx']:
-            df = pd.read_excel(file_path)
+            df = to_string_storage(pd.read_excel(file_path))
             for i in range(0, len(df), self.chunk_size):
                 yield df.iloc[i:i + self.chunk_size]
         else:
             raise ValueError(f"Type de fichier non supporté: {ext}")
     
-    def _create_composite_key(self, row: pd.Series, key_columns: List[str]) -> str:
-        """Create composite key from specified columns"""
-        return '|'.join(str(row[col]) for col in key_columns)
-    
     def _load_file_to_db(self, file_path: str, table_name: str, key_columns: List[str]):
         """Load file data into SQLite database in chunks with memory monitoring"""
         cursor = self.conn.cursor()
@@ -122,9 +120,9 @@ class ComparateurFichiersOptimise:
             # Optimize chunk memory usage
             chunk = self.memory_manager.optimize_dataframe_memory(chunk)
             
+            composite_keys = build_composite_key(chunk, key_columns)
             batch_data = []
-            for _, row in chunk.iterrows():
-                composite_key = self._create_composite_key(row, key_columns)
+            for composite_key, (_, row) in zip(composite_keys, chunk.iterrows()):
                 row_data = row.to_json()
                 batch_data.append((composite_key, row_data))
             
@@ -276,22 +274,22 @@ class ComparateurFichiersOptimise:
     def _comparer_in_memory(self) -> Dict:
         """Fallback in-memory comparison for smaller files"""
         # Read files completely
-        ext1 = self.file1_path.split('.')[-1].lower()
-        ext2 = self.file2_path.split('.')[-1].lower()
+        ext1 = get_file_extension(self.file1_path)
+        ext2 = get_file_extension(self.file2_path)
         
         if ext1 == 'csv':
             df1 = safe_read_csv(self.file1_path)
         elif ext1 in ['xls', 'xlsx']:
-            df1 = pd.read_excel(self.file1_path)
+            df1 = to_string_storage(pd.read_excel(self.file1_path))
         
         if ext2 == 'csv':
             df2 = safe_read_csv(self.file2_path)
         elif ext2 in ['xls', 'xlsx']:
-            df2 = pd.read_excel(self.file2_path)
+            df2 = to_string_storage(pd.read_excel(self.file2_path))
         
         # Create composite keys
-        df1['_compare_key'] = df1[self.keys1].astype(str).agg('|'.join, axis=1)
-        df2['_compare_key'] = df2[self.keys2].astype(str).agg('|'.join, axis=1)
+        df1['_compare_key'] = build_composite_key(df1, self.keys1)
+        df2['_compare_key'] = build_composite_key(df2, self.keys2)
         
         # Merge and compare
         merged = pd.merge(df1, df2, on='_compare_key', how='outer', indicator=True)
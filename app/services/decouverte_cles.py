@@ -0,0 +1,225 @@
+"""
+Local candidate-key discovery: minimal unique column combinations of each file (level-wise search
+pruned on a row sample, confirmed with the HyperLogLog sketches of the profiling pass), and key pairs
+between both files ranked by value overlap (bottom-k MinHash) and column name similarity
+"""
+import time
+from itertools import combinations, permutations
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from app.services.esquisses import EsquissesCles
+from app.services.alignement_colonnes import aligner_colonnes, similarite_noms
+
+# Rows of each file used to prune the search (a key must be unique on the sample)
+ECHANTILLON_LIGNES = 2000
+# Largest composite key searched
+TAILLE_MAX_CLE = 3
+# Non-unique columns combined into composite keys (most distinct values first)
+COLONNES_COMBINEES = 12
+# Rows of the sample checked first (most non-unique combinations already collide there)
+ECHANTILLON_PREFILTRE = 500
+# Columns with more missing values than this are not key candidates
+TAUX_NULS_MAX = 0.05
+# Score penalty per extra column of a composite key (random combinations of columns become unique
+# on wide files, the smallest key is the likely one)
+PENALITE_TAILLE = 0.1
+# Column names that usually denote identifiers
+INDICES_NOMS = ('id', 'code', 'num', 'ref', 'cle', 'key', 'matricule', 'siret', 'siren', 'no')
+
+
+def _profil_echantillon(sample: pd.DataFrame) -> Dict[str, dict]:
+    """Integer codes, distinct count and missing ratio of each column of the sample"""
+    profil = {}
+    for col in sample.columns:
+        codes, uniques = pd.factorize(sample[col])
+        missing = codes < 0
+        n_missing = int(np.count_nonzero(missing))
+        # Missing values form one more code
+        codes = np.where(missing, len(uniques), codes).astype(np.int64)
+        profil[col] = {'codes': codes, 'distinct': len(uniques) + (n_missing > 0),
+                       'nulls': n_missing / max(len(sample), 1)}
+    return profil
+
+
+def _unique_sur_echantillon(profil: Dict[str, dict], columns: tuple, n_rows: int) -> bool:
+    """Whether the combination has no duplicate on the sample (codes combined into one integer)"""
+    combined = np.zeros(n_rows, dtype=np.int64)
+    for col in columns:
+        combined = combined * profil[col]['distinct'] + profil[col]['codes']
+    combined.sort()
+    return not (combined[1:] == combined[:-1]).any()
+
+
+def _bonus_nom(columns: tuple) -> float:
+    return 0.01 * sum(any(hint in col.lower() for hint in INDICES_NOMS) for col in columns) / len(columns)
+
+
+def combinaisons_uniques(esquisses: EsquissesCles, sample: pd.DataFrame, limit: int = 8) -> List[dict]:
+    """
+    Minimal column combinations unique on the sample, best first.
+
+    Level-wise search: combinations are built from the columns with the most distinct values
+    (anchors) extended with any usable column, and a combination is only tried when none of its
+    subsets is already unique (minimality) and when the product of the distinct counts of its
+    columns on the sample can reach the sample size. Combinations are first checked on the head
+    of the sample, which rejects most of them cheaply. Full-file uniqueness comes from the sketches.
+    """
+    n_rows = len(sample)
+    if n_rows == 0:
+        return []
+    profil = _profil_echantillon(sample)
+    usable = [col for col in sample.columns if profil[col]['nulls'] <= TAUX_NULS_MAX and profil[col]['distinct'] > 1]
+    head = min(n_rows, ECHANTILLON_PREFILTRE)
+    profil_head = {col: {'codes': profil[col]['codes'][:head], 'distinct': profil[col]['distinct']}
+                   for col in usable}
+
+    found: List[tuple] = []
+    non_unique = []
+    for col in usable:
+        if profil[col]['distinct'] == n_rows and _unique_sur_echantillon(profil, (col,), n_rows):
+            found.append((col,))
+        else:
+            non_unique.append(col)
+    anchors = sorted(non_unique, key=lambda col: -profil[col]['distinct'])[:COLONNES_COMBINEES]
+
+    def _candidates(size):
+        if size == 2:
+            seen = set()
+            for anchor in anchors:
+                for col in non_unique:
+                    combo = tuple(sorted((anchor, col), key=non_unique.index))
+                    if col != anchor and combo not in seen:
+                        seen.add(combo)
+                        yield combo
+        else:
+            yield from combinations(anchors, size)
+
+    for size in range(2, TAILLE_MAX_CLE + 1):
+        for combo in _candidates(size):
+            if any(set(key) <= set(combo) for key in found):
+                continue
+            if np.prod([float(profil[col]['distinct']) for col in combo]) < n_rows:
+                continue
+            if _unique_sur_echantillon(profil_head, combo, head) and \
+                    _unique_sur_echantillon(profil, combo, n_rows):
+                found.append(combo)
+
+    candidates = []
+    for combo in found:
+        distinct = esquisses.estimate_distinct(list(combo)) if esquisses.rows else n_rows
+        uniqueness = min(distinct / esquisses.rows, 1.0) if esquisses.rows else 1.0
+        nulls = max(profil[col]['nulls'] for col in combo)
+        candidates.append({
+            'columns': list(combo),
+            'distinct': int(distinct),
+            'uniqueness': round(uniqueness * 100, 1),
+            'score': round(uniqueness - PENALITE_TAILLE * (len(combo) - 1) - nulls + _bonus_nom(combo), 4)
+        })
+    candidates.sort(key=lambda item: (-item['score'], len(item['columns'])))
+    return candidates[:limit]
+
+
+def _aligner(columns1: List[str], columns2: List[str], jaccard: Callable[[str, str], float]) -> Optional[dict]:
+    """
+    Best column order of key 2 for key 1. The overlap of a composite key is the smallest overlap
+    of its aligned columns, so that a low-cardinality column (shared by any two files) cannot
+    make up for an identifier column whose values differ.
+    """
+    best = None
+    for order in permutations(columns2):
+        overlaps = [jaccard(col1, col2) for col1, col2 in zip(columns1, order)]
+        names = [similarite_noms(col1, col2) for col1, col2 in zip(columns1, order)]
+        candidate = {'key2': list(order), 'recouvrement': float(min(overlaps)),
+                     'similarite_noms': float(np.mean(names))}
+        if best is None or (candidate['recouvrement'], candidate['similarite_noms']) > \
+                (best['recouvrement'], best['similarite_noms']):
+            best = candidate
+    return best
+
+
+def classer_paires(esquisses1: EsquissesCles, candidats1: List[dict], esquisses2: EsquissesCles,
+                   candidats2: List[dict], limit: int = 5, alignement: Optional[List[dict]] = None) -> List[dict]:
+    """
+    Key pairs (key1, key2) ranked by cross-file value overlap, then column name similarity.
+
+    Besides the candidates of both files, each key of file 1 is also mirrored onto the file 2
+    columns aligned with its columns (file 2 may have duplicates on the true key).
+    """
+    overlaps: Dict[tuple, float] = {}
+
+    def jaccard(col1: str, col2: str) -> float:
+        if (col1, col2) not in overlaps:
+            overlaps[(col1, col2)] = esquisses1.jaccard(col1, esquisses2, col2)
+        return overlaps[(col1, col2)]
+
+    uniqueness2 = {tuple(c['columns']): c['uniqueness'] for c in candidats2}
+    keys2 = [c['columns'] for c in candidats2]
+    aligned_columns = {pair['colonne1']: pair['colonne2'] for pair in alignement or []}
+    for candidate in candidats1:
+        mirrored = [aligned_columns.get(col1) for col1 in candidate['columns']]
+        if None not in mirrored and mirrored not in keys2:
+            keys2.append(mirrored)
+
+    pairs = []
+    for candidate in candidats1:
+        for key2 in keys2:
+            if len(key2) != len(candidate['columns']):
+                continue
+            aligned = _aligner(candidate['columns'], key2, jaccard)
+            if aligned is None or aligned['recouvrement'] == 0 and aligned['similarite_noms'] < 0.5:
+                continue
+            unique2 = uniqueness2.get(tuple(key2))
+            if unique2 is None:
+                distinct2 = esquisses2.estimate_distinct(aligned['key2'])
+                unique2 = round(min(distinct2 / esquisses2.rows, 1.0) * 100, 1) if esquisses2.rows else 0.0
+            score = (0.8 * aligned['recouvrement'] + 0.2 * aligned['similarite_noms']) \
+                * min(candidate['uniqueness'], unique2) / 100 - PENALITE_TAILLE * (len(key2) - 1)
+            pairs.append({
+                'key1': candidate['columns'],
+                'key2': aligned['key2'],
+                'recouvrement': round(aligned['recouvrement'] * 100, 1),
+                'similarite_noms': round(aligned['similarite_noms'] * 100, 1),
+                'unicite1': candidate['uniqueness'],
+                'unicite2': unique2,
+                'score': round(score, 4)
+            })
+    pairs.sort(key=lambda item: (-item['score'], len(item['key1'])))
+    return pairs[:limit]
+
+
+def suggerer_cles(lecteur, file1_path: str, file2_path: str, sample_rows: int = ECHANTILLON_LIGNES,
+                  limit: int = 5) -> Dict:
+    """
+    Suggest key1 / key2 for two files from their profiles (no external call).
+
+    Args:
+        lecteur: LecteurFichierOptimise (sketches are loaded from the sidecars, built if missing)
+        file1_path, file2_path: Uploaded files
+        sample_rows: Rows of each file read to prune the search
+        limit: Number of key pairs returned
+
+    Returns:
+        Dict: candidates of each file, ranked key pairs, column alignment and duration
+    """
+    start = time.time()
+    esquisses1 = lecteur.read_key_sketches(file1_path)
+    esquisses2 = lecteur.read_key_sketches(file2_path)
+    # Raw text is enough to test uniqueness (no type inference on hundreds of columns)
+    sample1 = lecteur.get_file_sample(file1_path, sample_rows, dtype=str)
+    sample2 = lecteur.get_file_sample(file2_path, sample_rows, dtype=str)
+
+    candidats1 = combinaisons_uniques(esquisses1, sample1)
+    candidats2 = combinaisons_uniques(esquisses2, sample2)
+    alignement = aligner_colonnes(esquisses1, esquisses2)
+    paires = classer_paires(esquisses1, candidats1, esquisses2, candidats2, limit, alignement)
+    duration = time.time() - start
+    print(f"🧭 Découverte de clés: {len(candidats1)} / {len(candidats2)} clés candidates, "
+          f"{len(paires)} paires en {duration:.2f}s")
+    return {
+        'fichier1': candidats1,
+        'fichier2': candidats2,
+        'paires': paires,
+        'alignement': alignement,
+        'duree_s': round(duration, 3)
+    }
@@ -0,0 +1,124 @@
+"""
+Sampling helpers: consistent key-hash sampling with estimators and confidence intervals,
+and seeded bottom-k reservoirs for the result samples
+"""
+import math
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+# z value of the reported confidence intervals (95 %)
+Z_95 = 1.959964
+
+
+def seuil_fraction(fraction: float) -> np.uint64:
+    """Hash threshold keeping `fraction` of the 64-bit hash space"""
+    if not 0 < fraction <= 1:
+        raise ValueError(f"Fraction d'échantillonnage invalide: {fraction}")
+    return np.uint64(min(int(fraction * 2 ** 64), 2 ** 64 - 1))
+
+
+def masque_echantillon(hashes: np.ndarray, fraction: float) -> np.ndarray:
+    """
+    Rows whose key hash falls in the sampled part of the hash space.
+
+    The same keys are kept in both files, so a key is either sampled on both sides or on neither.
+    """
+    if fraction >= 1:
+        return np.ones(len(hashes), dtype=bool)
+    return hashes < seuil_fraction(fraction)
+
+
+def intervalle_comptage(n_sample: int, fraction: float, z: float = Z_95) -> Tuple[int, int, int]:
+    """
+    Estimate of a count from its sampled value, with its confidence interval.
+
+    Each key is kept independently with probability `fraction`, so the sampled count
+    is binomial: estimate n/f, variance n(1-f)/f^2.
+    """
+    estimate = n_sample / fraction
+    margin = z * math.sqrt(n_sample * (1 - fraction)) / fraction
+    return int(round(estimate)), int(max(0, math.floor(estimate - margin))), int(math.ceil(estimate + margin))
+
+
+def intervalle_proportion(n_bucket: int, n_total: int, fraction: float, z: float = Z_95) -> Tuple[float, float, float]:
+    """Share of a bucket in percent with its confidence interval (finite population correction 1-f)"""
+    if n_total == 0:
+        return 0.0, 0.0, 0.0
+    p = n_bucket / n_total
+    margin = z * math.sqrt(p * (1 - p) / n_total * (1 - min(fraction, 1.0)))
+    return round(p * 100, 2), round(max(0.0, p - margin) * 100, 2), round(min(1.0, p + margin) * 100, 2)
+
+
+def estimer_depuis_echantillon(n1: int, n2: int, n_common: int, fraction: float) -> Dict:
+    """Estimated counts and percentages of a comparison from the counts of its hash sample"""
+    total = n1 + n2 + n_common
+    estimation = {'fraction': fraction, 'confidence': 0.95,
+                  'sampled': {'n1': n1, 'n2': n2, 'n_common': n_common}}
+    for name, value in (('n1', n1), ('n2', n2), ('n_common', n_common), ('total', total)):
+        estimate, low, high = intervalle_comptage(value, fraction)
+        estimation[name] = {'estimate': estimate, 'low': low, 'high': high}
+    for name, value in (('pct1', n1), ('pct2', n2), ('pct_both', n_common)):
+        estimate, low, high = intervalle_proportion(value, total, fraction)
+        estimation[name] = {'estimate': estimate, 'low': low, 'high': high}
+    return estimation
+
+
+def priorites(key_hashes: np.ndarray, seed: int) -> np.ndarray:
+    """
+    Seeded pseudo-random priority of each key hash (splitmix64 finalizer).
+
+    The priority only depends on the key and the seed, so every strategy samples the same keys.
+    """
+    with np.errstate(over='ignore'):
+        z = np.asarray(key_hashes, dtype=np.uint64) ^ np.uint64((seed * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def plus_petites_priorites(priorities: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k smallest priorities (unordered)"""
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if len(priorities) <= k:
+        return np.arange(len(priorities))
+    return np.argpartition(priorities, k - 1)[:k]
+
+
+class ReservoirBottomK:
+    """
+    Uniform sample of k rows from a stream of chunks: the k rows with the smallest priorities.
+
+    Memory stays bounded by k rows whatever the size of the bucket.
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.priorities = np.empty(0, dtype=np.uint64)
+        self.frame: Optional[pd.DataFrame] = None
+        self.seen = 0
+
+    def offer(self, priorities: np.ndarray, frame: pd.DataFrame):
+        """Offer the rows of a chunk with their priorities"""
+        self.seen += len(frame)
+        if self.k <= 0 or len(frame) == 0:
+            return
+        keep = plus_petites_priorites(priorities, self.k)
+        priorities = np.asarray(priorities)[keep]
+        frame = frame.iloc[keep]
+        if self.frame is not None:
+            priorities = np.concatenate([self.priorities, priorities])
+            frame = pd.concat([self.frame, frame], ignore_index=True)
+            keep = plus_petites_priorites(priorities, self.k)
+            priorities = priorities[keep]
+            frame = frame.iloc[keep]
+        self.priorities = priorities
+        self.frame = frame.reset_index(drop=True)
+
+    def result(self) -> pd.DataFrame:
+        """Sampled rows, in priority order"""
+        if self.frame is None:
+            return pd.DataFrame()
+        order = np.argsort(self.priorities, kind='stable')
+        return self.frame.iloc[order].reset_index(drop=True)
@@ -0,0 +1,103 @@
+"""
+Key-set snapshots of each comparison run (sorted uint64 key hashes per bucket) and churn between two runs
+"""
+import os
+from typing import Dict, Optional
+import numpy as np
+import pandas as pd
+from flask import current_app
+from app import db
+from app.services.index_cles import hasher_cles
+
+# Buckets of a comparison run, as stored in StatistiqueEcart
+BUCKETS = ('uniquement_fichier1', 'uniquement_fichier2', 'communs')
+
+
+def unique_key_hashes(keys: pd.Series) -> np.ndarray:
+    """Sorted distinct hashes of composite keys"""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.uint64)
+    return np.unique(hasher_cles(keys))
+
+
+def empreintes_from_merge(merged: pd.DataFrame, key_column: str = '_compare_key') -> Dict[str, np.ndarray]:
+    """Bucket key hashes of an outer merge with indicator (left_only / right_only / both)"""
+    return {
+        'uniquement_fichier1': unique_key_hashes(merged.loc[merged['_merge'] == 'left_only', key_column]),
+        'uniquement_fichier2': unique_key_hashes(merged.loc[merged['_merge'] == 'right_only', key_column]),
+        'communs': unique_key_hashes(merged.loc[merged['_merge'] == 'both', key_column])
+    }
+
+
+def get_snapshot_path(stat) -> str:
+    """uploads/snapshots/<projet_id>/stat_<id>.npz"""
+    folder = current_app.config.get('SNAPSHOT_FOLDER', 'uploads/snapshots')
+    return os.path.join(folder, str(stat.projet_id), f"stat_{stat.id}.npz")
+
+
+def save_snapshot(stat, empreintes: Optional[Dict[str, np.ndarray]]) -> Optional[str]:
+    """
+    Save the key hashes of a run next to its statistics.
+
+    Args:
+        stat: StatistiqueEcart of the run (already committed, so it has an id)
+        empreintes: Sorted distinct hashes per bucket, or None when the strategy did not produce them
+
+    Returns:
+        Optional[str]: Snapshot path, or None if nothing was saved
+    """
+    if not empreintes:
+        return None
+    path = get_snapshot_path(stat)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **{bucket: np.asarray(empreintes[bucket], dtype=np.uint64) for bucket in BUCKETS})
+    os.replace(tmp_path, path)
+
+    stat.chemin_empreintes = path
+    db.session.commit()
+    size_kb = os.path.getsize(path) / 1024
+    print(f"📸 Empreintes de clés enregistrées pour la statistique {stat.id} ({size_kb:.1f} KB)")
+    return path
+
+
+def load_snapshot(stat) -> Optional[Dict[str, np.ndarray]]:
+    """Load the key hashes of a run, or None if the run has no snapshot"""
+    if not stat.chemin_empreintes or not os.path.exists(stat.chemin_empreintes):
+        return None
+    with np.load(stat.chemin_empreintes) as data:
+        return {bucket: data[bucket] for bucket in BUCKETS}
+
+
+def compute_churn(stat_from, stat_to) -> Optional[Dict]:
+    """
+    Key churn between two runs, from their snapshots only (source files are not read).
+
+    - nouvelles_cles: keys of the later run absent from the earlier one
+    - nouveaux_ecarts_fichier1/2: keys newly missing from file 2 (resp. file 1)
+    - ecarts_resolus(_fichier1/2): keys in a discrepancy bucket before and common now
+    - cles_disparues: keys of the earlier run absent from the later one
+
+    Returns:
+        Optional[Dict]: Counts per category, or None if a snapshot is missing
+    """
+    before = load_snapshot(stat_from)
+    after = load_snapshot(stat_to)
+    if before is None or after is None:
+        return None
+
+    all_before = np.union1d(np.union1d(before['uniquement_fichier1'], before['uniquement_fichier2']),
+                            before['communs'])
+    all_after = np.union1d(np.union1d(after['uniquement_fichier1'], after['uniquement_fichier2']),
+                           after['communs'])
+    ecarts_before = np.union1d(before['uniquement_fichier1'], before['uniquement_fichier2'])
+
+    churn = {
+        'nouvelles_cles': len(np.setdiff1d(all_after, all_before, assume_unique=True)),
+        'cles_disparues': len(np.setdiff1d(all_before, all_after, assume_unique=True)),
+        'ecarts_resolus': len(np.intersect1d(ecarts_before, after['communs'], assume_unique=True))
+    }
+    for bucket, label in (('uniquement_fichier1', 'fichier1'), ('uniquement_fichier2', 'fichier2')):
+        churn[f'nouveaux_ecarts_{label}'] = len(np.setdiff1d(after[bucket], before[bucket], assume_unique=True))
+        churn[f'ecarts_resolus_{label}'] = len(np.intersect1d(before[bucket], after['communs'], assume_unique=True))
+    return churn
@@ -0,0 +1,159 @@
+"""
+Value comparison of the matched rows. Each row gets a 64-bit fingerprint of its normalized non-key
+columns when it is loaded (next to its key hash): matched rows with equal fingerprints are identical
+in one integer comparison, the column-by-column diff only runs on the rows whose fingerprints differ.
+The per-column comparison rules (regles_comparaison) shape both the fingerprints and the diff.
+"""
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from app.config import Config
+from app.utils.normalisation_cles import options_valeurs
+from app.services.index_cles import hasher_cles
+from app.services.echantillonnage import ReservoirBottomK, priorites
+from app.services.regles_comparaison import MoteurRegles, compiler, decrire_regle, regles_colonnes
+
+# Column holding the row fingerprint (suffixed _x / _y once both files are merged)
+COLONNE_EMPREINTE = '_empreinte'
+# Column of the sampled modified rows listing their differing columns
+COLONNE_DIFFERENCES = '_colonnes_modifiees'
+# Odd multiplier mixing the column hashes (the fingerprint depends on the column order)
+_MULTIPLICATEUR = np.uint64(0x100000001B3)
+
+
+def colonnes_comparees(colonnes1: List[str], colonnes2: List[str], keys1: List[str], keys2: List[str],
+                       column_mapping: Optional[Dict[str, str]] = None) -> List[Tuple[str, str]]:
+    """
+    (file 1 column, file 2 column) pairs compared value by value: non-key columns of both files,
+    file 2 columns taking the name of their aligned file 1 column (as in appliquer_correspondance)
+    """
+    column_mapping = column_mapping or {}
+    renamed = {}
+    for col2 in colonnes2:
+        if col2 in keys2 or str(col2).startswith('_'):
+            continue
+        col1 = column_mapping.get(col2)
+        renamed[col1 if col1 and col1 not in colonnes2 else col2] = col2
+    return [(col1, renamed[col1]) for col1 in colonnes1
+            if col1 not in keys1 and not str(col1).startswith('_') and col1 in renamed]
+
+
+def options_empreinte(colonnes: List[str], regles: Optional[List[Optional[Dict]]] = None) -> Dict:
+    """Identity of a fingerprint: its columns in order, their normalization and comparison rules"""
+    options = {'colonnes': list(colonnes), 'normalisation': options_valeurs()}
+    if regles and any(regles):
+        options['regles'] = list(regles)
+    return options
+
+
+def empreinte_lignes(frame: pd.DataFrame, colonnes: List[str],
+                     regles: Optional[List[Optional[Dict]]] = None) -> np.ndarray:
+    """
+    Fingerprint (uint64) of each row over the canonical values of the given columns, vectorized per column.
+
+    Args:
+        regles: Comparison rule of each column, in the order of the columns (ignored columns are left out)
+    """
+    empreintes = np.zeros(len(frame), dtype=np.uint64)
+    for col, regle in zip(colonnes, regles or [None] * len(colonnes)):
+        canonique = compiler(regle)[1]
+        if canonique is None:
+            continue
+        # uint64 arithmetic wraps around: no overflow handling needed
+        empreintes = empreintes * _MULTIPLICATEUR + pd.util.hash_array(canonique(frame[col], col))
+    return empreintes
+
+
+class DiffValeurs:
+    """
+    Value diff of the matched rows, accumulated chunk by chunk (merge partitions, SQLite batches).
+
+    Args:
+        colonnes: Compared columns, under their file 1 names (_x / _y suffixed in the merged rows)
+        sample_size: Modified rows kept as a seeded sample (bounded memory)
+        regles: Comparison rules by file 1 column (numeric tolerance, date granularity, text, ignored)
+    """
+
+    def __init__(self, colonnes: List[str], sample_size: int = 1000, regles: Optional[Dict[str, Dict]] = None):
+        self.colonnes = list(colonnes)
+        self.moteur = MoteurRegles(self.colonnes, regles)
+        # Rule of each column, aligned with the columns (fingerprints of the merged rows)
+        self.regles = regles_colonnes(self.colonnes, regles)
+        self.n_identiques = 0
+        self.n_modifies = 0
+        self.par_colonne = dict.fromkeys(self.colonnes, 0)
+        self.reservoir = ReservoirBottomK(sample_size)
+        # Rows whose fingerprints differ, diffed column by column
+        self.n_candidats = 0
+        # Per-column counts measured on a sample of the modified rows only (key index strategy)
+        self.partiel = False
+
+    def differences(self, rows: pd.DataFrame) -> np.ndarray:
+        """Boolean matrix (rows x compared columns): values that differ under the rule of their column"""
+        return self.moteur.differences(rows)
+
+    def ajouter(self, communs: pd.DataFrame, compter: bool = True) -> np.ndarray:
+        """
+        Matched rows of a merge ('_compare_key', fingerprints and compared columns _x / _y).
+
+        Args:
+            compter: Count the rows as identical / modified (False when the counts come from elsewhere)
+
+        Returns:
+            np.ndarray: Differing values of every matched row (rows x compared columns), for the breakdowns
+        """
+        differ = communs[f"{COLONNE_EMPREINTE}_x"].to_numpy() != communs[f"{COLONNE_EMPREINTE}_y"].to_numpy()
+        candidates = communs[differ]
+        matrix = self.differences(candidates)
+        modified = matrix.any(axis=1)
+        self.n_candidats += len(candidates)
+        if compter:
+            self.n_modifies += int(modified.sum())
+            self.n_identiques += len(communs) - int(modified.sum())
+        for position, col in enumerate(self.colonnes):
+            self.par_colonne[col] += int(matrix[:, position].sum())
+        rows = candidates[modified]
+        self.reservoir.offer(priorites(hasher_cles(rows['_compare_key']), Config.SAMPLE_SEED), rows)
+        full = np.zeros((len(communs), len(self.colonnes)), dtype=bool)
+        full[differ] = matrix
+        return full
+
+    def compter(self, n_identiques: int, n_modifies: int):
+        """Counts established without a column diff (fingerprints of the key indexes)"""
+        self.n_identiques += n_identiques
+        self.n_modifies += n_modifies
+
+    def lignes_modifiees(self) -> pd.DataFrame:
+        """Sampled modified rows with the list of their differing columns"""
+        rows = self.reservoir.result()
+        if rows.empty:
+            return rows
+        matrix = self.differences(rows)
+        labels = np.array(self.colonnes, dtype=object)
+        rows = rows.drop(columns=[f"{COLONNE_EMPREINTE}_x", f"{COLONNE_EMPREINTE}_y", '_merge'], errors='ignore')
+        rows.insert(0, COLONNE_DIFFERENCES, [', '.join(labels[line]) for line in matrix])
+        return rows
+
+    def resultat(self) -> Dict:
+        """Counts of the value diff (JSON serializable), with the mismatch rate of each column among matched rows"""
+        matched = self.n_identiques + self.n_modifies
+        # Sampled diff: counts scaled from the sample to every modified row
+        scale = self.n_modifies / self.reservoir.seen if self.partiel and self.reservoir.seen else 1
+        return {
+            'colonnes': self.colonnes,
+            'n_identiques': self.n_identiques,
+            'n_modifies': self.n_modifies,
+            'par_colonne': sorted(({'colonne': col, 'n_ecarts': int(round(count * scale)),
+                                    'pct': round(count * scale / matched * 100, 2) if matched else 0,
+                                    'regle': decrire_regle(regle)}
+                                   for (col, count), regle in zip(self.par_colonne.items(), self.regles)),
+                                  key=lambda item: -item['n_ecarts'])
+            # No modified row read (statistics only): no per-column figures rather than zeros
+            if not self.partiel or self.reservoir.seen else [],
+            'partiel': self.partiel
+        }
+
+
+def sans_empreintes(frame: pd.DataFrame) -> pd.DataFrame:
+    """Frame without the fingerprint columns (result buckets shown to the user)"""
+    return frame.drop(columns=[col for col in frame.columns if str(col).startswith(COLONNE_EMPREINTE)])
@@ -0,0 +1,330 @@
+"""
+Cardinality sketches (HyperLogLog), value samples (bottom-k MinHash) and fixed-length MinHash
+signatures of the columns of a file, computed in one profiling pass and stored as a JSON sidecar,
+to estimate key cardinality and overlap between two files before comparing
+"""
+import base64
+import json
+import time
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import pandas as pd
+from app.utils.cache_utils import load_json_sidecar, save_json_sidecar
+from app.utils.string_storage import build_composite_key
+from app.utils.normalisation_cles import empreinte_regles
+from app.services.index_cles import hasher_cles
+
+# 2^12 registers: ~1.6% standard error, 4 KB per sketch
+HLL_PRECISION = 12
+SKETCHES_SUFFIX = 'sketches.json'
+# Leading columns combined by pairs (composite keys usually come first in exports)
+MAX_PAIR_COLUMNS = 6
+# Smallest distinct hashes kept per column: ~6% standard error on Jaccard estimates, 2 KB per column
+MINHASH_K = 256
+# Bins of the one-permutation MinHash signatures (signature length, used for LSH banding)
+SIGNATURE_BINS = 256
+
+
+class HyperLogLog:
+    """HyperLogLog sketch fed with 64-bit hashes (vectorized with numpy)"""
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: Optional[np.ndarray] = None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = registers if registers is not None else np.zeros(self.m, dtype=np.uint8)
+
+    def add_hashes(self, hashes: np.ndarray):
+        """Add uint64 hashes: the first bits pick the register, the rank of the rest updates it"""
+        if len(hashes) == 0:
+            return
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        width = 64 - self.precision
+        index = (hashes >> np.uint64(width)).astype(np.int64)
+        rest = hashes & np.uint64((1 << width) - 1)
+        # Bit length through frexp is exact: with precision >= 12, rest < 2^52 is exactly representable as float64
+        bit_length = np.frexp(rest.astype(np.float64))[1]
+        rank = (width - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        """Sketch of the union of both sets"""
+        return HyperLogLog(self.precision, np.maximum(self.registers, other.registers))
+
+    def count(self) -> int:
+        """Estimated number of distinct values"""
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros > 0:
+            # Small range correction (linear counting)
+            estimate = self.m * np.log(self.m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self) -> dict:
+        return {'p': self.precision, 'registers': base64.b64encode(self.registers.tobytes()).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'HyperLogLog':
+        registers = np.frombuffer(base64.b64decode(data['registers']), dtype=np.uint8).copy()
+        return cls(data['p'], registers)
+
+
+class MinHashBasK:
+    """Bottom-k MinHash: the k smallest distinct 64-bit hashes of a set of values"""
+
+    def __init__(self, k: int = MINHASH_K, values: Optional[np.ndarray] = None):
+        self.k = k
+        self.values = values if values is not None else np.empty(0, dtype=np.uint64)
+
+    def add_hashes(self, hashes: np.ndarray):
+        if len(hashes) == 0:
+            return
+        smallest = np.unique(np.asarray(hashes, dtype=np.uint64))[:self.k]
+        self.values = np.union1d(self.values, smallest)[:self.k]
+
+    def jaccard(self, other: 'MinHashBasK') -> float:
+        """Estimated Jaccard similarity: share of the k smallest hashes of the union present in both sets"""
+        k = min(self.k, other.k)
+        # Both value arrays are distinct: a hash present in both sets appears twice once merged
+        merged = np.sort(np.concatenate([self.values, other.values]))
+        if len(merged) == 0:
+            return 0.0
+        shared = np.r_[merged[1:] == merged[:-1], False]
+        union = merged[~np.r_[False, shared[:-1]]][:k]
+        both = np.count_nonzero(merged[shared] <= union[-1])
+        return float(both) / len(union)
+
+    def to_dict(self) -> dict:
+        return {'k': self.k, 'values': base64.b64encode(self.values.astype('<u8').tobytes()).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'MinHashBasK':
+        values = np.frombuffer(base64.b64decode(data['values']), dtype='<u8').astype(np.uint64)
+        return cls(data['k'], values)
+
+
+class MinHashUnePermutation:
+    """
+    One-permutation MinHash: the hash space is split into bins by the leading bits of the hash
+    and the smallest hash of each bin is kept, which gives a fixed-length signature whose
+    positions can be compared between columns (LSH banding) in a single hashing pass
+    """
+    VIDE = np.iinfo(np.uint64).max
+
+    def __init__(self, bins: int = SIGNATURE_BINS, values: Optional[np.ndarray] = None):
+        self.bins = bins
+        self.values = values if values is not None else np.full(bins, self.VIDE, dtype=np.uint64)
+
+    def add_hashes(self, hashes: np.ndarray):
+        if len(hashes) == 0:
+            return
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        shift = np.uint64(64 - int(np.log2(self.bins)))
+        np.minimum.at(self.values, (hashes >> shift).astype(np.int64), hashes)
+
+    def signature(self) -> Optional[np.ndarray]:
+        """
+        Densified signature (None for an empty column): an empty bin borrows the value of the next
+        filled bin, mixed with its distance, so that low-cardinality columns still get comparable bins
+        """
+        filled = np.flatnonzero(self.values != self.VIDE)
+        if len(filled) == 0:
+            return None
+        positions = np.arange(self.bins)
+        # Next filled bin of every position, wrapping around
+        following = filled[np.searchsorted(filled, positions) % len(filled)]
+        distance = ((following - positions) % self.bins).astype(np.uint64)
+        with np.errstate(over='ignore'):
+            return self.values[following] ^ (distance * np.uint64(0x9E3779B97F4A7C15))
+
+    def to_dict(self) -> dict:
+        return {'bins': self.bins, 'values': base64.b64encode(self.values.astype('<u8').tobytes()).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'MinHashUnePermutation':
+        values = np.frombuffer(base64.b64decode(data['values']), dtype='<u8').astype(np.uint64)
+        return cls(data['bins'], values)
+
+
+def _sketch_name(key_columns: List[str]) -> str:
+    return json.dumps(list(key_columns), ensure_ascii=False)
+
+
+class EsquissesCles:
+    """
+    HyperLogLog sketches of every column and of pairs of leading columns of one file,
+    and a bottom-k MinHash and a one-permutation MinHash signature of the non-empty values
+    of every column
+    """
+
+    def __init__(self, file_path: str, rows: int, sketches: Dict[str, HyperLogLog],
+                 minhashes: Optional[Dict[str, MinHashBasK]] = None,
+                 signatures: Optional[Dict[str, MinHashUnePermutation]] = None):
+        self.file_path = file_path
+        self.rows = rows
+        self.sketches = sketches
+        self.minhashes = minhashes or {}
+        self.signatures = signatures or {}
+
+    @classmethod
+    def build(cls, file_path: str, chunks: Iterable[pd.DataFrame]) -> 'EsquissesCles':
+        """One pass over the chunks of the file, then save the sidecar"""
+        constructeur = ConstructeurEsquisses()
+        for chunk in chunks:
+            constructeur.feed(chunk)
+        return constructeur.finish(file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> Optional['EsquissesCles']:
+        """Sketches of the file, or None if missing or stale"""
+        data = load_json_sidecar(file_path, SKETCHES_SUFFIX)
+        # Sketches hashed with other normalization rules, or without value samples, are stale
+        if data is None or data.get('normalisation') != empreinte_regles() \
+                or 'minhashes' not in data or 'signatures' not in data:
+            return None
+        sketches = {name: HyperLogLog.from_dict(sketch) for name, sketch in data['sketches'].items()}
+        minhashes = {col: MinHashBasK.from_dict(minhash) for col, minhash in data['minhashes'].items()}
+        signatures = {col: MinHashUnePermutation.from_dict(signature)
+                      for col, signature in data['signatures'].items()}
+        return cls(file_path, data['rows'], sketches, minhashes, signatures)
+
+    def get(self, key_columns: List[str]) -> Optional[HyperLogLog]:
+        """Sketch of a key definition (column order does not matter for pairs)"""
+        sketch = self.sketches.get(_sketch_name(key_columns))
+        if sketch is None and len(key_columns) == 2:
+            sketch = self.sketches.get(_sketch_name(list(reversed(key_columns))))
+        return sketch
+
+    def estimate_distinct(self, key_columns: List[str]) -> int:
+        """
+        Estimated distinct keys: the sketch when available, otherwise the product
+        of the per-column estimates capped at the row count
+        """
+        sketch = self.get(key_columns)
+        if sketch is not None:
+            return min(sketch.count(), self.rows)
+        estimate = 1
+        for col in key_columns:
+            col_sketch = self.get([col])
+            if col_sketch is None:
+                return self.rows
+            estimate *= max(col_sketch.count(), 1)
+        return min(estimate, self.rows)
+
+    def jaccard(self, column: str, other: 'EsquissesCles', other_column: str) -> float:
+        """Estimated Jaccard similarity of the values of a column of this file and a column of another file"""
+        minhash = self.minhashes.get(column)
+        other_minhash = other.minhashes.get(other_column)
+        if minhash is None or other_minhash is None:
+            return 0.0
+        return minhash.jaccard(other_minhash)
+
+    def column_summary(self) -> List[dict]:
+        """Per column: estimated distinct values and uniqueness ratio (key candidates first)"""
+        summary = []
+        for name, sketch in self.sketches.items():
+            key_columns = json.loads(name)
+            distinct = min(sketch.count(), self.rows)
+            summary.append({
+                'columns': key_columns,
+                'distinct': distinct,
+                'uniqueness': round(distinct / self.rows * 100, 1) if self.rows else 0
+            })
+        return sorted(summary, key=lambda item: (-item['uniqueness'], len(item['columns'])))
+
+
+class ConstructeurEsquisses:
+    """
+    Sketches fed chunk by chunk, so that they are computed while the upload is received (see ProfileurFlux)
+    rather than in a separate parse
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.sketches: Dict[str, HyperLogLog] = {}
+        self.minhashes: Dict[str, MinHashBasK] = {}
+        self.signatures: Dict[str, MinHashUnePermutation] = {}
+        self.columns = None
+        self.pairs = None
+        self.rows = 0
+
+    def feed(self, chunk: pd.DataFrame):
+        """Add the rows of the next chunk"""
+        if self.columns is None:
+            self.columns = chunk.columns.tolist()
+            # Pairs of leading columns that are not unique on their own in the first chunk
+            leading = [col for col in self.columns[:MAX_PAIR_COLUMNS]
+                       if chunk[col].nunique(dropna=False) < len(chunk)]
+            self.pairs = list(combinations(leading, 2))
+        # Each column is normalized once; pair keys reuse the normalized parts
+        normalized = {col: build_composite_key(chunk, [col]) for col in self.columns}
+        for col in self.columns:
+            hashes = hasher_cles(normalized[col])
+            self.sketches.setdefault(_sketch_name([col]), HyperLogLog()).add_hashes(hashes)
+            present = chunk[col].notna().to_numpy() & (normalized[col] != '').to_numpy(dtype=bool)
+            self.minhashes.setdefault(col, MinHashBasK()).add_hashes(hashes[present])
+            self.signatures.setdefault(col, MinHashUnePermutation()).add_hashes(hashes[present])
+        for first, second in self.pairs:
+            pair_keys = normalized[first].str.cat(normalized[second], sep='|')
+            self.sketches.setdefault(_sketch_name([first, second]), HyperLogLog()).add_hashes(hasher_cles(pair_keys))
+        self.rows += len(chunk)
+
+    def finish(self, file_path: str) -> EsquissesCles:
+        """Save the sidecar of the file (complete at file_path) and return its sketches"""
+        save_json_sidecar(file_path, SKETCHES_SUFFIX, {
+            'rows': self.rows,
+            'normalisation': empreinte_regles(),
+            'sketches': {name: sketch.to_dict() for name, sketch in self.sketches.items()},
+            'minhashes': {col: minhash.to_dict() for col, minhash in self.minhashes.items()},
+            'signatures': {col: signature.to_dict() for col, signature in self.signatures.items()}
+        })
+        print(f"📐 Esquisses de cardinalité: {len(self.sketches)} clés candidates, {self.rows} lignes "
+              f"en {time.time() - self.start:.2f}s")
+        return EsquissesCles(file_path, self.rows, self.sketches, self.minhashes, self.signatures)
+
+
+def estimer_recouvrement(esquisses1: EsquissesCles, keys1: List[str],
+                         esquisses2: EsquissesCles, keys2: List[str]) -> Optional[Dict]:
+    """
+    Estimate distinct keys of each file and their overlap (inclusion-exclusion on the union sketch).
+
+    Returns:
+        Optional[Dict]: distinct1, distinct2, common, only1, only2 and duplication factors,
+        or None when a key definition has no sketch
+    """
+    sketch1 = esquisses1.get(keys1)
+    sketch2 = esquisses2.get(keys2)
+    if sketch1 is None or sketch2 is None:
+        return None
+
+    distinct1 = min(sketch1.count(), esquisses1.rows)
+    distinct2 = min(sketch2.count(), esquisses2.rows)
+    union = sketch1.merge(sketch2).count()
+    common = max(0, min(distinct1 + distinct2 - union, distinct1, distinct2))
+    return {
+        'distinct1': distinct1,
+        'distinct2': distinct2,
+        'common': common,
+        'only1': distinct1 - common,
+        'only2': distinct2 - common,
+        # Average rows per key (1.0 = unique key)
+        'rows_per_key1': round(esquisses1.rows / distinct1, 2) if distinct1 else 0,
+        'rows_per_key2': round(esquisses2.rows / distinct2, 2) if distinct2 else 0
+    }
+
+
+def resume_apercu(esquisses1: EsquissesCles, esquisses2: EsquissesCles, limit: int = 8) -> Dict:
+    """Key candidates of each file and estimated overlap of the columns present in both, for the upload preview"""
+    recouvrements = []
+    for name in esquisses1.sketches:
+        key_columns = json.loads(name)
+        if len(key_columns) == 1 and esquisses2.get(key_columns) is not None:
+            estimation = estimer_recouvrement(esquisses1, key_columns, esquisses2, key_columns)
+            recouvrements.append({'columns': key_columns, **estimation})
+    recouvrements.sort(key=lambda item: -item['common'])
+    return {
+        'fichier1': esquisses1.column_summary()[:limit],
+        'fichier2': esquisses2.column_summary()[:limit],
+        'recouvrements': recouvrements[:limit]
+    }
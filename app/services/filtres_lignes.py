@@ -0,0 +1,250 @@
+"""
+Row predicates pushed down into the readers: date range and segment IN list. A zone map (min / max
+and, when few, distinct values of the predicate column per block of rows) is kept next to each
+uncompressed CSV file, so that blocks that cannot match are skipped through the line offset index
+without being parsed; the rows of the blocks that are read are filtered with vectorized masks.
+"""
+import hashlib
+import io
+import json
+import time
+import warnings
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+from app.utils.cache_utils import load_json_sidecar, save_json_sidecar
+from app.utils.normalisation_cles import normaliser_colonne, options_normalisation
+
+# Rows per zone of the zone map (the unit of skipping)
+TAILLE_ZONE = 50000
+# Distinct values kept per zone for IN predicates (beyond, only min / max are kept)
+VALEURS_MAX_ZONE = 64
+# Values of a column looked at to infer its date format
+ECHANTILLON_FORMAT = 50
+_VERSION = 1
+
+
+def construire_predicats(colonne_date: Optional[str] = None, debut: Optional[str] = None, fin: Optional[str] = None,
+                         colonne_segment: Optional[str] = None, valeurs: Optional[List[str]] = None) -> List[dict]:
+    """
+    Predicates of one file from the comparison request.
+
+    Args:
+        colonne_date: Date column filtered on [debut, fin] (both days included, either may be empty)
+        colonne_segment: Column whose (normalized) value must be one of `valeurs`
+
+    Returns:
+        List[dict]: {'colonne', 'debut', 'fin'} and / or {'colonne', 'valeurs'}, empty when nothing is filtered
+    """
+    predicats = []
+    if colonne_date and (debut or fin):
+        for bound in (debut, fin):
+            if bound and pd.isna(pd.to_datetime(bound, errors='coerce')):
+                raise ValueError(f"Date invalide: {bound}")
+        predicats.append({'colonne': colonne_date, 'debut': debut or None, 'fin': fin or None})
+    valeurs = [str(v).strip() for v in valeurs or [] if str(v).strip()]
+    if colonne_segment and valeurs:
+        predicats.append({'colonne': colonne_segment, 'valeurs': sorted(set(valeurs))})
+    return predicats
+
+
+def options_index(predicats: Optional[List[dict]]) -> Optional[dict]:
+    """Key index options of a filtered read (a filtered index is a different index)"""
+    if not predicats:
+        return None
+    return {'filtre': sorted(predicats, key=lambda p: json.dumps(p, sort_keys=True))}
+
+
+def decrire_predicats(predicats: Optional[List[dict]]) -> str:
+    """Readable form of the predicates, for logs and result pages"""
+    parts = []
+    for predicat in predicats or []:
+        if 'valeurs' in predicat:
+            parts.append(f"{predicat['colonne']} ∈ {{{', '.join(predicat['valeurs'])}}}")
+        else:
+            parts.append(f"{predicat['colonne']} entre {predicat['debut'] or '…'} et {predicat['fin'] or '…'}")
+    return ' et '.join(parts)
+
+
+def deviner_format_date(series: pd.Series) -> Optional[str]:
+    """Date format of a column, inferred once from its first values (day first when ambiguous)"""
+    values = series.dropna().astype(str).str.strip()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for value in values[values != ''].head(ECHANTILLON_FORMAT):
+            # ISO dates may or may not carry a time: parsed as ISO 8601 rather than one exact format
+            # (day first only applies to the other layouts, '2024-03-04' is never read as April 3rd)
+            if (guess_datetime_format(value) or '').startswith('%Y-%m-%d'):
+                return 'ISO8601'
+            guessed = guess_datetime_format(value, dayfirst=True)
+            if guessed:
+                return guessed
+    return None
+
+
+def _dates_ns(series: pd.Series, date_format: Optional[str]) -> np.ndarray:
+    """Dates of a column as int64 nanoseconds (unparsed values -> NaT)"""
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        parsed = series
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            parsed = pd.to_datetime(series.astype(object), errors='coerce', format=date_format,
+                                    dayfirst=date_format is None)
+    return parsed.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def _bornes_ns(predicat: dict):
+    """[debut, fin + 1 day) in nanoseconds (the end day is included whatever the time of day)"""
+    low = pd.Timestamp(predicat['debut']).value if predicat.get('debut') else None
+    high = (pd.Timestamp(predicat['fin']).normalize() + pd.Timedelta(days=1)).value if predicat.get('fin') else None
+    return low, high
+
+
+def _valeurs_normalisees(predicat: dict) -> set:
+    return set(normaliser_colonne(pd.Series(predicat['valeurs'], dtype=object), predicat['colonne']).tolist())
+
+
+def masque(chunk: pd.DataFrame, predicats: List[dict], formats: Optional[Dict[str, Optional[str]]] = None) -> np.ndarray:
+    """
+    Rows of the chunk matching every predicate.
+
+    Args:
+        formats: Date format of each date column (inferred from the chunk when missing)
+    """
+    keep = np.ones(len(chunk), dtype=bool)
+    for predicat in predicats:
+        column = predicat['colonne']
+        if column not in chunk.columns:
+            raise ValueError(f"Colonne de filtre introuvable: {column}")
+        if 'valeurs' in predicat:
+            keep &= normaliser_colonne(chunk[column], column).isin(_valeurs_normalisees(predicat)).to_numpy()
+        else:
+            date_format = (formats or {}).get(column) or deviner_format_date(chunk[column])
+            dates = _dates_ns(chunk[column], date_format)
+            valid = dates != np.iinfo(np.int64).min
+            low, high = _bornes_ns(predicat)
+            if low is not None:
+                valid &= dates >= low
+            if high is not None:
+                valid &= dates < high
+            keep &= valid
+    return keep
+
+
+def filtrer(df: pd.DataFrame, predicats: Optional[List[dict]]) -> pd.DataFrame:
+    """Rows of an in-memory frame matching the predicates (the frame itself when nothing is filtered)"""
+    if not predicats:
+        return df
+    formats = {p['colonne']: deviner_format_date(df[p['colonne']]) for p in predicats
+               if 'valeurs' not in p and p['colonne'] in df.columns}
+    kept = df[masque(df, predicats, formats)]
+    print(f"🔎 Filtre {decrire_predicats(predicats)}: {len(kept)} / {len(df)} lignes retenues")
+    return kept
+
+
+class CarteZones:
+    """Per block of TAILLE_ZONE rows: statistics of one predicate column, to skip blocks that cannot match"""
+
+    def __init__(self, file_path: str, colonne: str, genre: str, data: dict):
+        self.file_path = file_path
+        self.colonne = colonne
+        # 'dates' (min / max in ns) or 'valeurs' (normalized min / max and distinct values)
+        self.genre = genre
+        self.format = data.get('format')
+        self.rows = data['rows']
+        self.zones = data['zones']
+
+    @staticmethod
+    def _suffix(colonne: str, genre: str) -> str:
+        spec = json.dumps({'colonne': colonne, 'genre': genre, 'taille': TAILLE_ZONE, 'version': _VERSION,
+                           'normalisation': options_normalisation([colonne]) if genre == 'valeurs' else None},
+                          sort_keys=True, ensure_ascii=False)
+        return f"zones.{hashlib.sha1(spec.encode('utf-8')).hexdigest()[:16]}.json"
+
+    @classmethod
+    def load(cls, file_path: str, colonne: str, genre: str) -> Optional['CarteZones']:
+        data = load_json_sidecar(file_path, cls._suffix(colonne, genre))
+        return cls(file_path, colonne, genre, data) if data is not None else None
+
+    @classmethod
+    def build(cls, file_path: str, colonne: str, genre: str, line_index, encoding: str = 'utf-8',
+              delimiter: str = ',') -> 'CarteZones':
+        """One pass over the file parsing only the predicate column, block by block"""
+        start = time.time()
+        header = line_index.read_raw(int(line_index.offsets[0]), int(line_index.offsets[1]))
+        zones = []
+        date_format = None
+        with open(file_path, 'rb') as f:
+            for first in range(0, line_index.row_count, TAILLE_ZONE):
+                begin, end = line_index.byte_range(first, TAILLE_ZONE)
+                f.seek(begin)
+                values = pd.read_csv(io.BytesIO(header + f.read(end - begin)), sep=delimiter, encoding=encoding,
+                                     usecols=[colonne], dtype=str, on_bad_lines='skip')[colonne]
+                if genre == 'dates':
+                    if date_format is None:
+                        date_format = deviner_format_date(values)
+                    dates = _dates_ns(values, date_format)
+                    dates = dates[dates != np.iinfo(np.int64).min]
+                    zones.append({'min': int(dates.min()) if len(dates) else None,
+                                  'max': int(dates.max()) if len(dates) else None})
+                else:
+                    normalized = normaliser_colonne(values, colonne)
+                    distinct = pd.unique(normalized[values.notna().to_numpy() & (normalized != '').to_numpy()])
+                    zones.append({'min': min(distinct) if len(distinct) else None,
+                                  'max': max(distinct) if len(distinct) else None,
+                                  'valeurs': sorted(distinct) if len(distinct) <= VALEURS_MAX_ZONE else None})
+        data = {'format': date_format, 'rows': line_index.row_count, 'zones': zones}
+        save_json_sidecar(file_path, cls._suffix(colonne, genre), data)
+        print(f"🗺️ Carte de zones de {colonne}: {len(zones)} zones en {time.time() - start:.2f}s")
+        return cls(file_path, colonne, genre, data)
+
+    def zones_candidates(self, predicat: dict) -> np.ndarray:
+        """Zones that may hold a matching row"""
+        keep = np.ones(len(self.zones), dtype=bool)
+        if self.genre == 'dates':
+            low, high = _bornes_ns(predicat)
+            for i, zone in enumerate(self.zones):
+                keep[i] = zone['min'] is not None and (high is None or zone['min'] < high) \
+                    and (low is None or zone['max'] >= low)
+        else:
+            wanted = _valeurs_normalisees(predicat)
+            for i, zone in enumerate(self.zones):
+                if zone['valeurs'] is not None:
+                    keep[i] = not wanted.isdisjoint(zone['valeurs'])
+                else:
+                    keep[i] = zone['min'] is not None and any(zone['min'] <= v <= zone['max'] for v in wanted)
+        return keep
+
+
+def lire_zones_filtrees(file_path: str, predicats: List[dict], line_index, chunk_size: int,
+                        encoding: str = 'utf-8', delimiter: str = ',', dtype=None,
+                        usecols: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Matching rows of an indexed CSV file: zones ruled out by a zone map are not read, contiguous
+    candidate zones are parsed as one byte range. Chunks are indexed by their data row numbers.
+    """
+    candidates = np.ones((line_index.row_count + TAILLE_ZONE - 1) // TAILLE_ZONE, dtype=bool)
+    formats = {}
+    for predicat in predicats:
+        genre = 'valeurs' if 'valeurs' in predicat else 'dates'
+        carte = CarteZones.load(file_path, predicat['colonne'], genre) or \
+            CarteZones.build(file_path, predicat['colonne'], genre, line_index, encoding, delimiter)
+        candidates &= carte.zones_candidates(predicat)
+        if genre == 'dates':
+            formats[predicat['colonne']] = carte.format
+    print(f"🔎 Filtre {decrire_predicats(predicats)}: {int(candidates.sum())} / {len(candidates)} zones lues")
+
+    # Runs of consecutive candidate zones
+    edges = np.diff(np.concatenate(([0], candidates.astype(np.int8), [0])))
+    for first_zone, end_zone in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+        end_row = min(end_zone * TAILLE_ZONE, line_index.row_count)
+        for first in range(first_zone * TAILLE_ZONE, end_row, chunk_size):
+            chunk = line_index.read_rows(first, min(chunk_size, end_row - first), encoding, delimiter,
+                                         dtype=dtype, usecols=usecols)
+            # Indexed by position in the range (a malformed record leaves a gap, never a shift)
+            chunk.index = chunk.index + first
+            chunk = chunk[masque(chunk, predicats, formats)]
+            if len(chunk):
+                yield chunk
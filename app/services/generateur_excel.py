@@ -4,10 +4,14 @@ import os
 from flask import send_file
 
 class GenerateurExcel:
-    def __init__(self, ecarts1, ecarts2, communs, project_folder=None):
+    def __init__(self, ecarts1, ecarts2, communs, project_folder=None, rapprochements=None, lignes_modifiees=None):
         self.ecarts1 = ecarts1
         self.ecarts2 = ecarts2
         self.communs = communs
+        # Likely matches of the fuzzy key matching stage (optional)
+        self.rapprochements = rapprochements
+        # Sampled matched rows whose values differ (value comparison, optional)
+        self.lignes_modifiees = lignes_modifiees
         self.project_folder = project_folder
         
     def generer_rapport(self):
@@ -38,6 +42,10 @@ class GenerateurExcel:
             write_sheet(only1, "Ecarts Fichier 1")
             write_sheet(only2, "Ecarts Fichier 2")
             write_sheet(both, "Communs")
+            if self.rapprochements is not None and len(self.rapprochements):
+                write_sheet(self.rapprochements, "Rapprochements flous")
+            if self.lignes_modifiees is not None and len(self.lignes_modifiees):
+                write_sheet(self.lignes_modifiees.drop(columns=['_compare_key'], errors='ignore'), "Lignes modifiées")
 
         output.seek(0)
         
@@ -80,3 +88,99 @@ class GenerateurExcel:
             write_sheet(only1, "Ecarts Fichier 1")
             write_sheet(only2, "Ecarts Fichier 2")
             write_sheet(both, "Communs")
+            if self.rapprochements is not None and len(self.rapprochements):
+                write_sheet(self.rapprochements, "Rapprochements flous")
+            if self.lignes_modifiees is not None and len(self.lignes_modifiees):
+                write_sheet(self.lignes_modifiees.drop(columns=['_compare_key'], errors='ignore'), "Lignes modifiées")
+
+
+def generer_rapport_multiple(resultats, file_path):
+    """Consolidated Excel report of an N-way comparison: summary, presence matrix and the samples of each file"""
+    fichiers = resultats['fichiers']
+    matrice = resultats['matrice']
+    synthese = pd.DataFrame([{
+        'Fichier': fichier['nom'],
+        'Clé': ' + '.join(fichier['keys']),
+        'Clés distinctes': fichier['nb_cles'],
+        'Communes avec la référence': fichier['n_communs'],
+        'Seulement dans la référence': fichier['n_reference_seul'],
+        'Seulement dans le fichier': fichier['n_fichier_seul'],
+        '% communes': fichier['pct_communs']
+    } for fichier in fichiers])
+    motifs = pd.DataFrame([{**dict(zip(matrice['fichiers'], motif['presence'])), 'Clés': motif['n_cles']}
+                           for motif in matrice['motifs']])
+
+    with pd.ExcelWriter(file_path, engine='xlsxwriter') as writer:
+        workbook = writer.book
+        header_format = workbook.add_format({
+            'bold': True,
+            'text_wrap': True,
+            'valign': 'middle',
+            'fg_color': '#D7E4BC',
+            'border': 1
+        })
+
+        def write_sheet(df, sheet_name):
+            # Excel sheet names: 31 characters at most
+            sheet_name = sheet_name[:31]
+            df.to_excel(writer, sheet_name=sheet_name, index=False, startrow=3)
+            worksheet = writer.sheets[sheet_name]
+            worksheet.insert_image('N1', 'app/static/sofrecom.png', {'x_scale': 0.5, 'y_scale': 0.5})
+            worksheet.write('C1', f"Comparaison multiple – {sheet_name}", workbook.add_format({'bold': True, 'font_size': 14}))
+            for col_num, value in enumerate(df.columns.values):
+                worksheet.write(3, col_num, value, header_format)
+
+        write_sheet(synthese, "Synthèse")
+        write_sheet(motifs, "Matrice de présence")
+        write_sheet(matrice['echantillon'], "Présence - échantillon")
+        for position, fichier in enumerate(fichiers, start=1):
+            write_sheet(fichier['ecarts_reference'], f"{position}. Absents du fichier")
+            write_sheet(fichier['ecarts_fichier'], f"{position}. Absents de la référence")
+
+
+def generer_rapport_agregats(resultats, file_path):
+    """Excel report of an aggregate reconciliation: grand totals, groups with differences and all groups"""
+    agregats = resultats['agregats']
+    synthese = pd.DataFrame([
+        {'Indicateur': 'Groupes', 'Valeur': resultats['n_groupes']},
+        {'Indicateur': 'Groupes identiques', 'Valeur': resultats['n_identiques']},
+        {'Indicateur': 'Groupes en écart', 'Valeur': resultats['n_ecarts']},
+        {'Indicateur': 'Groupes seulement dans le fichier 1', 'Valeur': resultats['n1']},
+        {'Indicateur': 'Groupes seulement dans le fichier 2', 'Valeur': resultats['n2']},
+        {'Indicateur': 'Lignes du fichier 1', 'Valeur': resultats['nb_lignes1']},
+        {'Indicateur': 'Lignes du fichier 2', 'Valeur': resultats['nb_lignes2']},
+        {'Indicateur': 'Valeurs non numériques exclues des totaux', 'Valeur': resultats.get('n_invalides', 0)},
+        {'Indicateur': 'Tolérance absolue', 'Valeur': resultats['tolerance_abs']},
+        {'Indicateur': 'Tolérance relative', 'Valeur': resultats['tolerance_rel']}
+    ])
+    totaux = pd.DataFrame([{
+        'Mesure': total['mesure'],
+        'Total fichier 1': total['total_fichier1'],
+        'Total fichier 2': total['total_fichier2'],
+        'Écart': total['ecart'],
+        'Valeurs non numériques fichier 1': total.get('invalides_fichier1', 0),
+        'Valeurs non numériques fichier 2': total.get('invalides_fichier2', 0)
+    } for total in resultats['totaux']])
+
+    with pd.ExcelWriter(file_path, engine='xlsxwriter') as writer:
+        workbook = writer.book
+        header_format = workbook.add_format({
+            'bold': True,
+            'text_wrap': True,
+            'valign': 'middle',
+            'fg_color': '#D7E4BC',
+            'border': 1
+        })
+
+        def write_sheet(df, sheet_name):
+            df.to_excel(writer, sheet_name=sheet_name, index=False, startrow=3)
+            worksheet = writer.sheets[sheet_name]
+            worksheet.insert_image('N1', 'app/static/sofrecom.png', {'x_scale': 0.5, 'y_scale': 0.5})
+            worksheet.write('C1', f"Rapprochement par agrégats – {sheet_name}", workbook.add_format({'bold': True, 'font_size': 14}))
+            for col_num, value in enumerate(df.columns.values):
+                worksheet.write(3, col_num, value, header_format)
+
+        write_sheet(synthese, "Synthèse")
+        write_sheet(totaux, "Totaux")
+        write_sheet(agregats[agregats['statut'] != 'identique'], "Groupes en écart")
+        write_sheet(agregats, "Tous les groupes")
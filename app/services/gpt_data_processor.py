@@ -2,9 +2,9 @@ import openai
 import pandas as pd
 import json
 import os
-import chardet
 from typing import Optional, Dict, Any, List
 from app.services.lecteur_fichier_optimise import LecteurFichierOptimise
+from app.utils.encoding_utils import detect_file_encoding
 import tempfile
 
 class GPTDataProcessor:
@@ -21,31 +21,18 @@ class GPTDataProcessor:
         self.lecteur = LecteurFichierOptimise(chunk_size=100)  # Smaller chunks for GPT processing
     
     def detect_encoding(self, file_path: str) -> str:
-        """Detect file encoding"""
-        with open(file_path, 'rb') as f:
-            raw_data = f.read()
-            result = chardet.detect(raw_data)
-            return result['encoding'] or 'utf-8'
+        """Detect file encoding (bounded incremental read)"""
+        return detect_file_encoding(file_path)['encoding']
     
     def analyze_and_fix_file_structure(self, file_path: str) -> Dict[str, Any]:
         """Use GPT-4 to analyze raw file content and detect/fix structural issues"""
         
         # Read raw file content
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
+            with open(file_path, 'r', encoding=self.detect_encoding(file_path)) as f:
                 raw_content = f.read(2048)  # First 2KB
-        except UnicodeDecodeError:
-            # Try with different encodings
-            encodings = ['latin-1', 'windows-1252', 'cp1252']
-            for enc in encodings:
-                try:
-                    with open(file_path, 'r', encoding=enc) as f:
-                        raw_content = f.read(2048)
-                    break
-                except UnicodeDecodeError:
-                    continue
-            else:
-                return {"error": "Cannot read file with supported encodings"}
+        except (UnicodeDecodeError, LookupError):
+            return {"error": "Cannot read file with supported encodings"}
         
         prompt = f"""
         Analysez ce contenu de fichier et détectez automatiquement les problèmes de structure:
@@ -0,0 +1,163 @@
+"""
+Persistent key index: sorted 64-bit hashes of the composite keys of a file, with their row numbers,
+stored as a memory-mapped NumPy sidecar
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Iterable, List, Optional
+import numpy as np
+import pandas as pd
+from app.utils.cache_utils import get_sidecar_path, load_json_sidecar, save_json_sidecar
+from app.utils.string_storage import build_composite_key
+from app.utils.normalisation_cles import options_normalisation
+
+INDEX_DTYPE = np.dtype([('hash', '<u8'), ('row', '<u8')])
+# Entries of an index that also holds the row fingerprints (value comparison of the matched rows)
+INDEX_EMPREINTE_DTYPE = np.dtype([('hash', '<u8'), ('row', '<u8'), ('empreinte', '<u8')])
+_VERSION = 1
+
+
+def hasher_cles(keys: pd.Series) -> np.ndarray:
+    """
+    Hash composite keys to uint64 (vectorized, identical for object and string[pyarrow] storage).
+
+    Collisions are negligible for 64-bit hashes at the file sizes handled here.
+    """
+    return pd.util.hash_array(keys.to_numpy(dtype=object, na_value='nan'))
+
+
+def key_spec_digest(key_columns: List[str], options: Optional[dict] = None) -> str:
+    """
+    Short digest identifying the key definition: columns, key options and the effective
+    normalization rules of the columns (changing a rule invalidates the persisted indexes)
+    """
+    spec = json.dumps({'columns': list(key_columns), 'options': options or {}, 'version': _VERSION,
+                       'normalisation': options_normalisation(key_columns)},
+                      sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(spec.encode('utf-8')).hexdigest()[:16]
+
+
+class IndexCles:
+    """Sorted (hash, row) pairs for one file and one key definition"""
+
+    def __init__(self, file_path: str, key_columns: List[str], entries: np.ndarray, meta: dict):
+        self.file_path = file_path
+        self.key_columns = list(key_columns)
+        self.entries = entries
+        self.meta = meta
+
+    @property
+    def hashes(self) -> np.ndarray:
+        return self.entries['hash']
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self.entries['row']
+
+    @property
+    def empreintes(self) -> Optional[np.ndarray]:
+        """Row fingerprints aligned with the hashes, None when the index was built without them"""
+        return self.entries['empreinte'] if 'empreinte' in self.entries.dtype.names else None
+
+    @property
+    def row_count(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def _paths(file_path: str, key_columns: List[str], options: Optional[dict] = None):
+        suffix = f"keys.{key_spec_digest(key_columns, options)}"
+        return f"{suffix}.npy", f"{suffix}.json"
+
+    @classmethod
+    def build(cls, file_path: str, key_columns: List[str], chunks: Iterable[pd.DataFrame],
+              options: Optional[dict] = None, rows_from_index: bool = False,
+              fingerprint_columns: Optional[List[str]] = None,
+              fingerprint_rules: Optional[List[Optional[dict]]] = None) -> 'IndexCles':
+        """
+        Hash the keys of every chunk, sort them and save the index next to the file.
+
+        Args:
+            file_path: Source file (the index is valid while the file is unchanged)
+            key_columns: Columns of the composite key
+            chunks: DataFrames of the file in row order
+            options: Key options that change the hashed values (part of the index identity)
+            rows_from_index: Row numbers taken from the chunk indexes (filtered reads) rather than
+                             from the position of the rows in the stream
+            fingerprint_columns: Columns of the row fingerprint stored next to each key hash (the
+                                 fingerprint definition must be part of `options`)
+            fingerprint_rules: Comparison rule of each fingerprint column (see regles_comparaison)
+        """
+        from .empreintes_lignes import empreinte_lignes
+        start = time.time()
+        hash_parts = []
+        row_parts = []
+        fingerprint_parts = []
+        for chunk in chunks:
+            hash_parts.append(hasher_cles(build_composite_key(chunk, key_columns)))
+            if rows_from_index:
+                row_parts.append(chunk.index.to_numpy(dtype=np.uint64))
+            if fingerprint_columns is not None:
+                fingerprint_parts.append(empreinte_lignes(chunk, fingerprint_columns, fingerprint_rules))
+        hashes = np.concatenate(hash_parts) if hash_parts else np.empty(0, dtype=np.uint64)
+
+        order = np.argsort(hashes, kind='stable')
+        entries = np.empty(len(hashes), dtype=INDEX_DTYPE if fingerprint_columns is None else INDEX_EMPREINTE_DTYPE)
+        entries['hash'] = hashes[order]
+        entries['row'] = np.concatenate(row_parts)[order] if rows_from_index and row_parts else order
+        if fingerprint_columns is not None:
+            entries['empreinte'] = np.concatenate(fingerprint_parts)[order] if fingerprint_parts else []
+
+        npy_suffix, meta_suffix = cls._paths(file_path, key_columns, options)
+        npy_path = get_sidecar_path(file_path, npy_suffix)
+        tmp_path = f"{npy_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, entries)
+        os.replace(tmp_path, npy_path)
+
+        n_unique = int(np.count_nonzero(np.diff(entries['hash']))) + 1 if len(entries) else 0
+        meta = {'key_columns': list(key_columns), 'options': options or {},
+                'rows': int(len(entries)), 'unique_keys': n_unique, 'filtered': rows_from_index}
+        save_json_sidecar(file_path, meta_suffix, meta)
+
+        print(f"🔑 Index de clés construit: {len(entries)} lignes, {n_unique} clés uniques "
+              f"en {time.time() - start:.2f}s")
+        return cls.load(file_path, key_columns, options)
+
+    @classmethod
+    def load(cls, file_path: str, key_columns: List[str], options: Optional[dict] = None) -> Optional['IndexCles']:
+        """Memory-map the index of this file and key definition, or None if missing or stale"""
+        npy_suffix, meta_suffix = cls._paths(file_path, key_columns, options)
+        meta = load_json_sidecar(file_path, meta_suffix)
+        npy_path = get_sidecar_path(file_path, npy_suffix)
+        if meta is None or not os.path.exists(npy_path):
+            return None
+        try:
+            entries = np.load(npy_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if entries.dtype not in (INDEX_DTYPE, INDEX_EMPREINTE_DTYPE) or len(entries) != meta.get('rows'):
+            return None
+        return cls(file_path, key_columns, entries, meta)
+
+    def lookup(self, key: str) -> np.ndarray:
+        """Row numbers of a composite key ('val1|val2|...')"""
+        key_hash = hasher_cles(pd.Series([key]))[0]
+        left = np.searchsorted(self.hashes, key_hash, side='left')
+        right = np.searchsorted(self.hashes, key_hash, side='right')
+        return np.sort(np.asarray(self.rows[left:right]))
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """Boolean mask: which of the given hashes exist in this index"""
+        if self.row_count == 0:
+            return np.zeros(len(hashes), dtype=bool)
+        positions = np.searchsorted(self.hashes, hashes)
+        positions = np.minimum(positions, self.row_count - 1)
+        return np.asarray(self.hashes[positions]) == hashes
+
+    def unique_hashes(self) -> np.ndarray:
+        """Sorted distinct key hashes"""
+        hashes = np.asarray(self.hashes)
+        if len(hashes) == 0:
+            return hashes
+        return hashes[np.concatenate(([True], hashes[1:] != hashes[:-1]))]
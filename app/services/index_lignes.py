@@ -0,0 +1,231 @@
+"""
+Line offset index: byte offset of every CSV record stored in a memory-mapped sidecar file
+"""
+import io
+import os
+from typing import List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from app.utils.cache_utils import get_sidecar_path, get_file_signature
+from app.utils.compression import open_binary
+from app.utils.string_storage import to_string_storage
+from app.services.lecteur_csv_parallele import LecteurCSVParallele
+
+# Sidecar layout: 4 uint64 header values (magic, version, file size, mtime ns) then the offsets
+_MAGIC = 0x58444e494c41  # 'ALINDX'
+_VERSION = 1
+_HEADER_SIZE = 4
+
+
+class ConstructeurIndexLignes:
+    """Build a line offset index from consecutive blocks of bytes"""
+
+    def __init__(self, output=None, quotechar: str = '"'):
+        self.output = output
+        self.quote = ord(quotechar)
+        self.position = 0
+        self.record_start = 0
+        self.quote_count = 0
+        self.n_offsets = 0
+
+    def _write(self, offsets: np.ndarray):
+        # Without output the builder only counts records
+        if len(offsets):
+            if self.output is not None:
+                self.output.write(offsets.astype(np.uint64).tobytes())
+            self.n_offsets += len(offsets)
+
+    def feed(self, block: bytes):
+        """Scan a block: newlines outside quoted fields end a record"""
+        if not block:
+            return
+        buf = np.frombuffer(block, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == 10)
+        quotes = np.flatnonzero(buf == self.quote)
+
+        # A newline is a record end when the number of quotes before it is even
+        quotes_before = np.searchsorted(quotes, newlines) + self.quote_count
+        ends = newlines[(quotes_before & 1) == 0]
+
+        if len(ends):
+            starts = np.empty(len(ends), dtype=np.int64)
+            starts[0] = self.record_start - self.position
+            starts[1:] = ends[:-1] + 1
+            lengths = ends - starts
+            # Blank lines ('\n' or '\r\n') are not records: their bytes stay attached to the previous record
+            prev_bytes = buf[np.maximum(ends - 1, 0)]
+            blank = (lengths == 0) | ((lengths == 1) & (prev_bytes == 13))
+            self._write(starts[~blank] + self.position)
+            self.record_start = self.position + int(ends[-1]) + 1
+
+        self.quote_count += len(quotes)
+        self.position += len(block)
+
+    def finish(self) -> int:
+        """Write the trailing record (no final newline) and the terminal offset"""
+        if self.record_start < self.position:
+            self._write(np.array([self.record_start]))
+        self._write(np.array([self.position]))
+        return self.n_offsets
+
+
+def compter_lignes(file_path: str, quotechar: str = '"', block_size: int = 8 * 1024 * 1024) -> Tuple[int, int]:
+    """
+    Count data rows of a file that cannot be indexed (compressed stream)
+
+    Returns:
+        (number of data rows, number of decompressed bytes)
+    """
+    builder = ConstructeurIndexLignes(quotechar=quotechar)
+    with open_binary(file_path) as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            builder.feed(block)
+    n_offsets = builder.finish()
+    return max(n_offsets - 2, 0), builder.position
+
+
+class IndexLignes:
+    """Record offsets of a CSV file (record 0 is the header, the last offset is the file size)"""
+
+    SUFFIX = 'lines.idx'
+
+    def __init__(self, file_path: str, offsets: np.ndarray):
+        self.file_path = file_path
+        self.offsets = offsets
+
+    @property
+    def row_count(self) -> int:
+        """Exact number of data rows (header excluded)"""
+        return max(len(self.offsets) - 2, 0)
+
+    @classmethod
+    def build(cls, file_path: str, encoding: str = 'utf-8', quotechar: str = '"',
+              block_size: int = 8 * 1024 * 1024) -> 'IndexLignes':
+        """Scan the file once and write the sidecar index"""
+        if not LecteurCSVParallele.supports_encoding(encoding):
+            raise ValueError(f"Index de lignes non supporté pour l'encodage {encoding}")
+
+        tmp_path = f"{get_sidecar_path(file_path, cls.SUFFIX)}.{os.getpid()}.tmp"
+        with open(file_path, 'rb') as src, cls.open_output(tmp_path) as out:
+            builder = ConstructeurIndexLignes(out, quotechar)
+            while True:
+                block = src.read(block_size)
+                if not block:
+                    break
+                builder.feed(block)
+            builder.finish()
+
+        return cls.install(tmp_path, file_path)
+
+    @staticmethod
+    def open_output(tmp_path: str):
+        """Open a temporary index file for a ConstructeurIndexLignes (header written by install)"""
+        out = open(tmp_path, 'wb')
+        out.write(np.zeros(_HEADER_SIZE, dtype=np.uint64).tobytes())
+        return out
+
+    @classmethod
+    def install(cls, tmp_path: str, file_path: str) -> 'IndexLignes':
+        """Stamp a complete temporary index with the source file signature and move it in place"""
+        size, mtime_ns = get_file_signature(file_path)
+        with open(tmp_path, 'r+b') as out:
+            out.write(np.array([_MAGIC, _VERSION, size, mtime_ns], dtype=np.uint64).tobytes())
+        os.replace(tmp_path, get_sidecar_path(file_path, cls.SUFFIX))
+        return cls.load(file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> Optional['IndexLignes']:
+        """Memory-map an existing index, or None if it is missing or stale"""
+        index_path = get_sidecar_path(file_path, cls.SUFFIX)
+        if not os.path.exists(index_path):
+            return None
+
+        try:
+            header = np.fromfile(index_path, dtype=np.uint64, count=_HEADER_SIZE)
+            size, mtime_ns = get_file_signature(file_path)
+            if (len(header) < _HEADER_SIZE or header[0] != _MAGIC or header[1] != _VERSION
+                    or header[2] != size or header[3] != mtime_ns):
+                return None
+            offsets = np.memmap(index_path, dtype=np.uint64, mode='r', offset=_HEADER_SIZE * 8)
+            if int(offsets[-1]) != size:
+                return None
+            return cls(file_path, offsets)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def load_or_build(cls, file_path: str, encoding: str = 'utf-8') -> 'IndexLignes':
+        """Reuse the sidecar index when it matches the file, rebuild it otherwise"""
+        return cls.load(file_path) or cls.build(file_path, encoding)
+
+    def row_bounds(self, start: int, count: int) -> Tuple[int, int]:
+        """Positions in the offsets of the first and past-the-end records of `count` data rows from data row `start`"""
+        first = min(max(start, 0) + 1, len(self.offsets) - 1)
+        last = min(first + max(count, 0), len(self.offsets) - 1)
+        return first, last
+
+    def byte_range(self, start: int, count: int) -> Tuple[int, int]:
+        """Byte range covering `count` data rows starting at data row `start`"""
+        first, last = self.row_bounds(start, count)
+        return int(self.offsets[first]), int(self.offsets[last])
+
+    def read_raw(self, start: int, end: int) -> bytes:
+        """Read a byte range of the indexed file"""
+        with open(self.file_path, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def read_rows(self, start: int, count: int, encoding: str = 'utf-8',
+                  delimiter: str = ',', dtype=None, usecols: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Parse `count` data rows starting at data row `start` without scanning the file (only `usecols` if given).
+        The frame is indexed by position in the range: malformed records are left out, the others keep their position.
+        """
+        first, last = self.row_bounds(start, count)
+        data = self.read_raw(int(self.offsets[first]), int(self.offsets[last]))
+        bounds = self.offsets[first:last + 1] - self.offsets[first]
+        records = [data[int(begin):int(end)] for begin, end in zip(bounds[:-1], bounds[1:])]
+        return to_string_storage(self._parse_records(records, encoding, delimiter, dtype, usecols))
+
+    def read_row_numbers(self, rows: np.ndarray, encoding: str = 'utf-8',
+                         delimiter: str = ',', usecols: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Parse the given data rows (in the given order), one seek per row (only `usecols` if given).
+        The frame is indexed by position in `rows`: malformed records are left out, the others keep their position.
+        """
+        records = []
+        with open(self.file_path, 'rb') as f:
+            for row in rows:
+                start, end = self.byte_range(int(row), 1)
+                f.seek(start)
+                record = f.read(end - start)
+                # The last record of the file may have no line terminator
+                records.append(record if record.endswith(b'\n') else record + b'\n')
+        return to_string_storage(self._parse_records(records, encoding, delimiter, None, usecols))
+
+    def _parse_records(self, records: List[bytes], encoding: str, delimiter: str, dtype,
+                       usecols: Optional[List[str]]) -> pd.DataFrame:
+        """
+        Parse records under the file header, one row per record: when the parser drops a record
+        (malformed or blank line), halves are parsed again until the dropped records are isolated,
+        so that rows are never shifted onto the wrong row numbers
+        """
+        header = self.read_raw(int(self.offsets[0]), int(self.offsets[min(1, len(self.offsets) - 1)]))
+
+        def parse(part: List[bytes], offset: int) -> List[pd.DataFrame]:
+            df = pd.read_csv(io.BytesIO(header + b''.join(part)), sep=delimiter, encoding=encoding,
+                             on_bad_lines='skip', engine='python', dtype=dtype, usecols=usecols, index_col=False)
+            if len(df) == len(part):
+                return [df.set_axis(pd.RangeIndex(offset, offset + len(df)))]
+            if len(part) == 1:
+                print(f"⚠️ Ligne mal formée ignorée dans {os.path.basename(self.file_path)}")
+                return [df.iloc[0:0]]
+            middle = len(part) // 2
+            return parse(part[:middle], offset) + parse(part[middle:], offset + middle)
+
+        frames = parse(records, 0)
+        frames = [frame for frame in frames if len(frame)] or frames[:1]
+        return frames[0] if len(frames) == 1 else pd.concat(frames)
@@ -0,0 +1,194 @@
+"""
+Parallel CSV reader: splits a file into byte ranges aligned on record boundaries
+and parses the ranges on a process pool
+"""
+import codecs
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+# Encodings where b'\n' is not a single byte cannot be split on raw bytes
+_UNSPLITTABLE_ENCODINGS = ('utf-16', 'utf-32')
+
+
+def _parse_byte_range(file_path: str, start: int, end: int, columns: List[str],
+                      encoding: str, delimiter: str, dtype, usecols: Optional[List[str]] = None) -> pd.DataFrame:
+    """Parse one byte range of a CSV file (executed in a worker process), only `usecols` if given"""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    return pd.read_csv(io.BytesIO(data), header=None, names=columns, index_col=False,
+                       sep=delimiter, encoding=encoding, dtype=dtype, usecols=usecols,
+                       on_bad_lines='skip', engine='c')
+
+
+class LecteurCSVParallele:
+    """Parse large CSV files on several cores using record-aligned byte ranges"""
+
+    def __init__(self, chunk_size: int = 5000, range_size_mb: int = 32,
+                 max_workers: Optional[int] = None, quotechar: str = '"'):
+        self.chunk_size = chunk_size
+        self.range_size = range_size_mb * 1024 * 1024
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.quotechar = quotechar.encode('ascii')
+
+    @staticmethod
+    def supports_encoding(encoding: str) -> bool:
+        """Check that the encoding keeps '\\n' and quotes as single ASCII bytes"""
+        try:
+            name = codecs.lookup(encoding or 'utf-8').name
+        except LookupError:
+            return False
+        return not name.startswith(_UNSPLITTABLE_ENCODINGS)
+
+    def _next_record_boundary(self, f, position: int, in_quotes: bool) -> Tuple[Optional[int], bool]:
+        """
+        Find the first record end at or after `position`.
+
+        A newline only ends a record when it is outside a quoted field, i.e. when the
+        number of quote characters seen since the file start is even.
+
+        Returns:
+            (offset just after the newline or None at EOF, quote state at that offset)
+        """
+        window_size = 1024 * 1024
+        f.seek(position)
+        while True:
+            window = f.read(window_size)
+            if not window:
+                return None, in_quotes
+
+            cursor = 0
+            newline = window.find(b'\n')
+            while newline != -1:
+                if window.count(self.quotechar, cursor, newline) % 2:
+                    in_quotes = not in_quotes
+                if not in_quotes:
+                    return position + newline + 1, False
+                cursor = newline
+                newline = window.find(b'\n', newline + 1)
+
+            if window.count(self.quotechar, cursor) % 2:
+                in_quotes = not in_quotes
+            position += len(window)
+
+    def _toggle_between(self, f, start: int, end: int, in_quotes: bool) -> bool:
+        """Update the quote state with the quote characters found in [start, end)"""
+        block_size = 16 * 1024 * 1024
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            if block.count(self.quotechar) % 2:
+                in_quotes = not in_quotes
+            remaining -= len(block)
+        return in_quotes
+
+    def compute_ranges(self, file_path: str, offsets: Optional[np.ndarray] = None) -> Tuple[int, List[Tuple[int, int]]]:
+        """
+        Split the file into byte ranges aligned on record boundaries.
+
+        With a line offset index (IndexLignes.offsets) the boundaries are looked up
+        directly. Otherwise the quote state is tracked with a sequential bytes.count()
+        scan, which runs at disk speed and keeps quoted newlines inside a single range.
+
+        Returns:
+            (header end offset, list of (start, end) data ranges)
+        """
+        file_size = os.path.getsize(file_path)
+
+        if offsets is not None and len(offsets) >= 2:
+            header_end = int(offsets[1])
+            targets = np.arange(header_end + self.range_size, file_size, self.range_size, dtype=np.uint64)
+            cuts = np.unique(offsets[np.searchsorted(offsets, targets)])
+            boundaries = [header_end] + [int(c) for c in cuts if header_end < c < file_size] + [file_size]
+            return header_end, [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
+
+        with open(file_path, 'rb') as f:
+            header_end, _ = self._next_record_boundary(f, 0, False)
+            if header_end is None:
+                return file_size, []
+
+            boundaries = [header_end]
+            in_quotes = False
+            target = header_end + self.range_size
+            while target < file_size:
+                in_quotes = self._toggle_between(f, boundaries[-1], target, in_quotes)
+                boundary, in_quotes = self._next_record_boundary(f, target, in_quotes)
+                if boundary is None or boundary >= file_size:
+                    break
+                boundaries.append(boundary)
+                target = boundary + self.range_size
+
+        boundaries.append(file_size)
+        ranges = [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
+        return header_end, ranges
+
+    def read_header(self, file_path: str, header_end: int, encoding: str, delimiter: str) -> List[str]:
+        """Read column names from the header record"""
+        with open(file_path, 'rb') as f:
+            header = f.read(header_end)
+        return pd.read_csv(io.BytesIO(header), nrows=0, sep=delimiter,
+                           encoding=encoding).columns.tolist()
+
+    def read_chunks(self, file_path: str, encoding: str = 'utf-8', delimiter: str = ',',
+                    dtype=None, ordered: bool = True,
+                    offsets: Optional[np.ndarray] = None,
+                    usecols: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+        """
+        Parse the file on a process pool and yield DataFrames of at most chunk_size rows.
+
+        Args:
+            file_path: CSV file to read
+            encoding: Profiled encoding
+            delimiter: Profiled delimiter
+            dtype: dtype plan applied to every range (a single dtype or a {column: dtype} dict)
+                   so that all ranges produce the same column types
+            ordered: Yield chunks in file order (True) or as soon as ranges are parsed (False)
+            offsets: Optional line offset index used to place range boundaries without scanning
+            usecols: Columns kept (all when None): the other fields are tokenized but never converted
+        """
+        header_end, ranges = self.compute_ranges(file_path, offsets)
+        columns = self.read_header(file_path, header_end, encoding, delimiter)
+        # The BOM only appears in the header range
+        range_encoding = 'utf-8' if codecs.lookup(encoding).name == 'utf-8-sig' else encoding
+
+        print(f"Parallel CSV read: {len(ranges)} ranges on {self.max_workers} processes")
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            # Keep a bounded number of parsed ranges in flight to cap memory usage
+            max_in_flight = self.max_workers * 2
+            pending = deque()
+            next_range = 0
+
+            def submit_next():
+                nonlocal next_range
+                start, end = ranges[next_range]
+                pending.append(executor.submit(_parse_byte_range, file_path, start, end, columns,
+                                               range_encoding, delimiter, dtype, usecols))
+                next_range += 1
+
+            while next_range < len(ranges) and len(pending) < max_in_flight:
+                submit_next()
+
+            while pending:
+                if ordered:
+                    future = pending.popleft()
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    future = done.pop()
+                    pending.remove(future)
+
+                df = future.result()
+                if next_range < len(ranges):
+                    submit_next()
+
+                for i in range(0, len(df), self.chunk_size):
+                    yield df.iloc[i:i + self.chunk_size]
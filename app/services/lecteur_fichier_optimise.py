@@ -1,22 +1,74 @@
 import pandas as pd
 import os
-from typing import Iterator, Tuple, Optional
+from typing import Iterator, List, Tuple, Optional
+from app.config import Config
+from app.utils.encoding_utils import detect_file_encoding
+from app.utils.compression import get_file_extension, get_compression, open_text
+from app.utils.string_storage import to_string_storage, get_string_dtype
+from app.services.lecteur_csv_parallele import LecteurCSVParallele
+from app.utils.cache_utils import load_json_sidecar, save_json_sidecar
+from app.services.index_lignes import IndexLignes, compter_lignes
+from app.services.index_cles import IndexCles
+from app.services.esquisses import EsquissesCles
+from app.services.filtres_lignes import lire_zones_filtrees, masque, deviner_format_date, options_index
+from app.services.empreintes_lignes import options_empreinte
+
+# Suffix of the profile sidecar saved next to each source file
+PROFILE_SUFFIX = 'profile.json'
+# Largest upload compared in memory (small path), in rows and columns
+SMALL_FILE_MAX_ROWS = 10000
+SMALL_FILE_MAX_COLUMNS = 50
+
+
+def required_columns(key_columns: List[str], predicats: Optional[List[dict]] = None,
+                     columns: Optional[List[str]] = None) -> Optional[List[str]]:
+    """
+    Columns a comparison has to parse: key columns, predicate columns and the compared / exported ones.
+
+    Returns:
+        Optional[List[str]]: None (every column) when `columns` is None, else the ordered unique column list
+    """
+    if columns is None:
+        return None
+    wanted = list(key_columns) + [p['colonne'] for p in predicats or []] + list(columns)
+    return list(dict.fromkeys(wanted))
+
+
+def key_index_options(predicats: Optional[List[dict]] = None,
+                      fingerprint_columns: Optional[List[str]] = None,
+                      fingerprint_rules: Optional[List[Optional[dict]]] = None) -> Optional[dict]:
+    """Options identifying a key index: row filter and row fingerprint definition, if any"""
+    options = options_index(predicats) or {}
+    if fingerprint_columns is not None:
+        options['empreinte'] = options_empreinte(fingerprint_columns, fingerprint_rules)
+    return options or None
+
 
 class LecteurFichierOptimise:
     """Optimized file reader for large files using chunking and memory-efficient operations"""
     
-    def __init__(self, chunk_size: int = 5000):
+    def __init__(self, chunk_size: int = 5000, backend: str = None):
         self.chunk_size = chunk_size
+        # 'pandas' (sequential) or 'parallel' (byte ranges parsed on a process pool)
+        self.backend = (backend or Config.CSV_READER_BACKEND).lower()
     
     def _detect_csv_delimiter(self, file_path: str, encoding: str = 'utf-8') -> str:
         """Detect CSV delimiter (comma, semicolon, tab, etc.)"""
-        import csv
-        
         try:
-            with open(file_path, 'r', encoding=encoding) as f:
+            with open_text(file_path, encoding=encoding) as f:
                 # Read a small sample
                 sample = f.read(1024)
-                
+            return self.detect_delimiter_from_sample(sample)
+        except Exception:
+            # Default fallback
+            return ','
+    
+    @staticmethod
+    def detect_delimiter_from_sample(sample: str) -> str:
+        """Detect CSV delimiter from a text sample"""
+        import csv
+        
+        try:
             # Use csv.Sniffer to detect delimiter
             sniffer = csv.Sniffer()
             delimiter = sniffer.sniff(sample).delimiter
@@ -41,38 +93,41 @@ class LecteurFichierOptimise:
             return ','
     
     def read_file_info(self, file_path: str) -> dict:
-        """Get basic file information without loading entire file"""
-        ext = file_path.split('.')[-1].lower()
+        """Get basic file information without loading entire file (compressed files are read as a stream)"""
+        # Profile saved next to the file (chunked upload or previous call) while the file is unchanged
+        profile = load_json_sidecar(file_path, PROFILE_SUFFIX)
+        if profile is not None:
+            return profile
+        
+        ext = get_file_extension(file_path)
+        compressed_bytes = os.path.getsize(file_path)
+        raw_bytes = compressed_bytes
         
         if ext == 'csv':
-            # Try multiple encodings with robust parameters
-            encodings_to_try = ['utf-8', 'latin-1', 'windows-1252', 'iso-8859-1', 'cp1252']
+            # Bounded incremental encoding detection (BOM, UTF-8 validity, chardet)
+            detection = detect_file_encoding(file_path)
+            used_encoding = detection['encoding']
+            used_delimiter = self._detect_csv_delimiter(file_path, used_encoding)
             sample_df = None
-            used_encoding = None
-            used_delimiter = None
             
-            for encoding in encodings_to_try:
-                try:
-                    # Detect delimiter first
-                    delimiter = self._detect_csv_delimiter(file_path, encoding)
-                    used_delimiter = delimiter
-                    
-                    sample_df = pd.read_csv(file_path, nrows=5, encoding=encoding,
-                                          delimiter=delimiter, on_bad_lines='skip', engine='python')
-                    used_encoding = encoding
-                    break
-                except UnicodeDecodeError:
-                    continue
-                except Exception as e:
-                    if "codec can't decode" not in str(e) and "tokenizing data" not in str(e):
-                        continue
+            try:
+                sample_df = pd.read_csv(file_path, nrows=5, encoding=used_encoding,
+                                      delimiter=used_delimiter, on_bad_lines='skip', engine='python')
+            except Exception as e:
+                print(f"Erreur lors de la lecture de l'échantillon ({used_encoding}): {e}")
             
             if sample_df is None:
-                raise ValueError("Impossible de lire le fichier avec les encodages supportés (utf-8, latin-1, windows-1252)")
+                raise ValueError(f"Impossible de lire le fichier avec l'encodage détecté ({used_encoding})")
             
-            # Get total row count efficiently with the same encoding and delimiter
+            # Exact row count from the line offset index (built once, then memory-mapped)
             try:
-                with open(file_path, 'r', encoding=used_encoding) as f:
+                if get_compression(file_path):
+                    # No random access into a compressed stream: count rows while decompressing
+                    row_count, raw_bytes = compter_lignes(file_path)
+                else:
+                    row_count = IndexLignes.load_or_build(file_path, used_encoding).row_count
+            except ValueError:
+                with open_text(file_path, encoding=used_encoding) as f:
                     row_count = sum(1 for line in f) - 1  # Subtract header
             except Exception:
                 # Fallback: read the file and count rows
@@ -86,98 +141,194 @@ class LecteurFichierOptimise:
             # Get total rows (this is less efficient for Excel, but necessary)
             full_df = pd.read_excel(file_path, usecols=[0])  # Just first column
             row_count = len(full_df)
+        elif ext == 'json':
+            # JSON cannot be read partially: load it once (decompressed on the fly)
+            full_df = pd.read_json(file_path)
+            sample_df = full_df.head(5)
+            row_count = len(full_df)
         else:
             raise ValueError(f"Type de fichier non supporté: {ext}")
         
-        return {
+        file_info = {
             'columns': sample_df.columns.tolist(),
             'total_rows': row_count,
             'total_columns': len(sample_df.columns),
             'sample_data': sample_df.to_dict(orient='records'),
             'file_extension': ext,
             'encoding': used_encoding if ext == 'csv' else None,
-            'delimiter': used_delimiter if ext == 'csv' else None
+            'encoding_confidence': detection['confidence'] if ext == 'csv' else None,
+            'delimiter': used_delimiter if ext == 'csv' else None,
+            'compression': get_compression(file_path),
+            'compressed_bytes': compressed_bytes,
+            'raw_bytes': raw_bytes
         }
+        
+        try:
+            save_json_sidecar(file_path, PROFILE_SUFFIX, file_info)
+        except OSError as e:
+            print(f"⚠️ Impossible d'enregistrer le profil du fichier: {e}")
+        return file_info
     
-    def read_file_chunks(self, file_path: str, encoding: str = None) -> Iterator[pd.DataFrame]:
-        """Read file in chunks to manage memory usage"""
-        ext = file_path.split('.')[-1].lower()
+    def read_file_chunks(self, file_path: str, encoding: str = None, ordered: bool = True,
+                         predicats: Optional[List[dict]] = None,
+                         usecols: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+        """
+        Read file in chunks to manage memory usage (ordered=False lets the parallel backend yield chunks as they are parsed)
+
+        With predicates (see app.services.filtres_lignes) only the matching rows are yielded, in file
+        order, in chunks indexed by their data row numbers.
+        With `usecols` only those columns are kept: CSV lines are still tokenized whole, the other fields
+        are dropped before conversion (memory is saved, not parsing time).
+        """
+        if predicats:
+            yield from self._read_filtered_chunks(file_path, encoding, predicats, usecols)
+            return
+        ext = get_file_extension(file_path)
         
         if ext == 'csv':
             # Determine encoding if not provided
             if encoding is None:
-                encodings_to_try = ['utf-8', 'latin-1', 'windows-1252', 'iso-8859-1', 'cp1252']
-                for enc in encodings_to_try:
-                    try:
-                        # Test with first few rows
-                        pd.read_csv(file_path, nrows=5, encoding=enc,
-                                  on_bad_lines='skip', engine='python')
-                        encoding = enc
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                    except Exception:
-                        continue
-                
-                if encoding is None:
-                    encoding = 'utf-8'  # Fallback
+                encoding = detect_file_encoding(file_path)['encoding']
+            
+            if self._use_parallel_backend(file_path, encoding):
+                lecteur = LecteurCSVParallele(chunk_size=self.chunk_size,
+                                              range_size_mb=Config.CSV_PARALLEL_RANGE_MB,
+                                              max_workers=Config.CSV_PARALLEL_WORKERS)
+                # Range boundaries come from the line offset index when it was already built
+                index = IndexLignes.load(file_path)
+                # Same dtype plan for every range so that chunks have consistent column types
+                yield from lecteur.read_chunks(file_path, encoding=encoding,
+                                               delimiter=self._detect_csv_delimiter(file_path, encoding),
+                                               dtype=get_string_dtype(), ordered=ordered,
+                                               offsets=index.offsets if index is not None else None,
+                                               usecols=usecols)
+                return
             
+            # Compressed files are decompressed as a stream by pandas (compression inferred from the extension);
+            # same delimiter detection and dtype plan as the parallel backend
             chunk_iter = pd.read_csv(file_path, chunksize=self.chunk_size, encoding=encoding,
-                                   on_bad_lines='skip', engine='python')
+                                   sep=self._detect_csv_delimiter(file_path, encoding), dtype=get_string_dtype(),
+                                   on_bad_lines='skip', engine='python', usecols=usecols)
             for chunk in chunk_iter:
-                yield chunk
-        elif ext in ['xls', 'xlsx']:
-            # Excel doesn't support native chunking, so we read and split
-            df = pd.read_excel(file_path)
+                yield to_string_storage(chunk)
+        elif ext in ['xls', 'xlsx', 'json']:
+            # Excel and JSON don't support native chunking, so we read and split
+            df = pd.read_excel(file_path, usecols=usecols) if ext != 'json' else pd.read_json(file_path)
+            if usecols is not None and ext == 'json':
+                df = df[usecols]
+            df = to_string_storage(df)
             for i in range(0, len(df), self.chunk_size):
                 yield df.iloc[i:i + self.chunk_size]
         else:
             raise ValueError(f"Type de fichier non supporté: {ext}")
     
-    def create_key_index(self, file_path: str, key_columns: list) -> dict:
-        """Create an index of keys for efficient comparison"""
-        key_index = {}
-        
-        for chunk_idx, chunk in enumerate(self.read_file_chunks(file_path)):
-            # Create composite key
-            chunk['_key'] = chunk[key_columns].astype(str).agg('|'.join, axis=1)
-            
-            # Store key -> (chunk_index, row_index) mapping
-            for row_idx, key in enumerate(chunk['_key']):
-                if key in key_index:
-                    # Handle duplicates
-                    if not isinstance(key_index[key], list):
-                        key_index[key] = [key_index[key]]
-                    key_index[key].append((chunk_idx, row_idx))
-                else:
-                    key_index[key] = (chunk_idx, row_idx)
-        
-        return key_index
+    def _read_filtered_chunks(self, file_path: str, encoding: Optional[str], predicats: List[dict],
+                              usecols: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+        """Rows matching the predicates: zones skipped with the zone maps when the file has random access"""
+        ext = get_file_extension(file_path)
+        if usecols is not None:
+            # Predicate columns are parsed even when the caller does not need them
+            usecols = required_columns(usecols, predicats, [])
+        if ext == 'csv' and not get_compression(file_path):
+            if encoding is None:
+                encoding = detect_file_encoding(file_path)['encoding']
+            try:
+                index = IndexLignes.load_or_build(file_path, encoding)
+            except ValueError:
+                index = None
+            if index is not None:
+                yield from lire_zones_filtrees(file_path, predicats, index, self.chunk_size, encoding,
+                                               self._detect_csv_delimiter(file_path, encoding),
+                                               dtype=get_string_dtype(), usecols=usecols)
+                return
+
+        # No random access: every row is read, only the matching ones are kept
+        formats = {}
+        offset = 0
+        for chunk in self.read_file_chunks(file_path, encoding, usecols=usecols):
+            for predicat in predicats:
+                if 'valeurs' not in predicat and predicat['colonne'] not in formats and predicat['colonne'] in chunk:
+                    formats[predicat['colonne']] = deviner_format_date(chunk[predicat['colonne']])
+            chunk = chunk.set_axis(pd.RangeIndex(offset, offset + len(chunk)))
+            offset += len(chunk)
+            chunk = chunk[masque(chunk, predicats, formats)]
+            if len(chunk):
+                yield chunk
+    
+    def _use_parallel_backend(self, file_path: str, encoding: str) -> bool:
+        """Parallel parsing only pays off for files spanning several byte ranges"""
+        if self.backend != 'parallel' or not LecteurCSVParallele.supports_encoding(encoding):
+            return False
+        if get_compression(file_path):
+            return False
+        return os.path.getsize(file_path) >= 2 * Config.CSV_PARALLEL_RANGE_MB * 1024 * 1024
     
-    def get_file_sample(self, file_path: str, sample_size: int = 1000) -> pd.DataFrame:
-        """Get a representative sample of the file for quick preview"""
-        ext = file_path.split('.')[-1].lower()
+    def create_key_index(self, file_path: str, key_columns: list, predicats: Optional[List[dict]] = None,
+                         fingerprint_columns: Optional[List[str]] = None,
+                         fingerprint_rules: Optional[List[Optional[dict]]] = None) -> IndexCles:
+        """
+        Load the persisted key index of the file (sorted uint64 key hashes + row numbers), building it once.
+        With predicates, the index only holds the matching rows (under their row numbers in the file).
+        With fingerprint columns, each entry also holds the fingerprint of its row over these columns
+        (under their comparison rules, aligned with the columns).
+        Only the key, predicate and fingerprint columns are parsed to build it.
+        """
+        options = key_index_options(predicats, fingerprint_columns, fingerprint_rules)
+        index = IndexCles.load(file_path, key_columns, options)
+        if index is None:
+            chunks = self.read_file_chunks(file_path, predicats=predicats,
+                                           usecols=required_columns(key_columns, predicats, fingerprint_columns or []))
+            index = IndexCles.build(file_path, key_columns, chunks, options, rows_from_index=bool(predicats),
+                                    fingerprint_columns=fingerprint_columns, fingerprint_rules=fingerprint_rules)
+        return index
+    
+    def read_key_sketches(self, file_path: str) -> EsquissesCles:
+        """
+        Load the HyperLogLog sketches of the file's key candidates (computed while the upload is received,
+        see ProfileurFlux; other files are read once here, then the sidecar is reused)
+        """
+        esquisses = EsquissesCles.load(file_path)
+        if esquisses is None:
+            esquisses = EsquissesCles.build(file_path, self.read_file_chunks(file_path))
+        return esquisses
+    
+    def get_file_sample(self, file_path: str, sample_size: int = 1000, start: int = 0,
+                        dtype=None) -> pd.DataFrame:
+        """Get a representative sample of the file for quick preview (rows start..start+sample_size)"""
+        ext = get_file_extension(file_path)
         
         if ext == 'csv':
-            # Get file info including encoding
-            file_info = self.read_file_info(file_path)
-            encoding = file_info.get('encoding', 'utf-8')
-            total_rows = file_info['total_rows']
+            encoding = detect_file_encoding(file_path)['encoding']
+            delimiter = self._detect_csv_delimiter(file_path, encoding)
             
-            if total_rows <= sample_size:
-                return pd.read_csv(file_path, encoding=encoding,
-                                 on_bad_lines='skip', engine='python')
+            # Random access through the line offset index: only the requested rows are read
+            index = None
+            if not get_compression(file_path):
+                try:
+                    index = IndexLignes.load_or_build(file_path, encoding)
+                except ValueError:
+                    index = None
+            if index is not None:
+                return index.read_rows(start, sample_size, encoding, delimiter, dtype=dtype)
             
-            # Use nrows to limit the number of rows read
-            return pd.read_csv(file_path, nrows=sample_size, encoding=encoding,
-                             on_bad_lines='skip', engine='python')
+            # Use skiprows/nrows to limit the number of rows read
+            return pd.read_csv(file_path, skiprows=range(1, start + 1), nrows=sample_size,
+                             encoding=encoding, delimiter=delimiter,
+                             on_bad_lines='skip', engine='python', dtype=dtype)
         
         elif ext in ['xls', 'xlsx']:
-            return pd.read_excel(file_path, nrows=sample_size)
+            return pd.read_excel(file_path, skiprows=range(1, start + 1), nrows=sample_size, dtype=dtype)
+        
+        elif ext == 'json':
+            return pd.read_json(file_path).iloc[start:start + sample_size]
         
         else:
             raise ValueError(f"Type de fichier non supporté: {ext}")
 
+def is_large_file(file_info: dict) -> bool:
+    """Files above these sizes are compared from disk, smaller ones in memory"""
+    return file_info['total_rows'] > SMALL_FILE_MAX_ROWS or file_info['total_columns'] > SMALL_FILE_MAX_COLUMNS
+
 def read_uploaded_file_optimized(file_storage, max_preview_rows: int = 1000):
     """Optimized version of file reading that handles large files efficiently"""
     # Save file temporarily
@@ -192,7 +343,7 @@ def read_uploaded_file_optimized(file_storage, max_preview_rows: int = 1000):
         file_info = lecteur.read_file_info(temp_path)
         
         # If file is small enough, read normally
-        if file_info['total_rows'] <= 10000 and file_info['total_columns'] <= 50:
+        if not is_large_file(file_info):
             ext = file_info['file_extension']
             if ext == 'csv':
                 encoding = file_info.get('encoding', 'utf-8')
@@ -201,6 +352,8 @@ def read_uploaded_file_optimized(file_storage, max_preview_rows: int = 1000):
                                on_bad_lines='skip', engine='python')
             elif ext in ['xls', 'xlsx']:
                 df = pd.read_excel(temp_path)
+            elif ext == 'json':
+                df = pd.read_json(temp_path)
             
             return {
                 'data': df,
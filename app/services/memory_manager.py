@@ -60,10 +60,13 @@ class MemoryManager:
     
     @staticmethod
     def estimate_comparison_memory(file1_rows: int, file2_rows: int, 
-                                  num_columns: int, safety_factor: float = 3.0) -> float:
+                                  num_columns: int, safety_factor: float = 3.0,
+                                  bytes_per_row: Optional[float] = None) -> float:
         """Estimate memory required for comparison operation"""
-        # Rough estimation: each cell takes ~8 bytes on average
-        bytes_per_row = num_columns * 8
+        # Measured bytes per row (raw size / rows from the file profile) when known,
+        # otherwise a rough estimation: each cell takes ~8 bytes on average
+        if bytes_per_row is None:
+            bytes_per_row = num_columns * 8
         
         # Memory for both files + merge operations
         estimated_mb = (file1_rows + file2_rows) * bytes_per_row * safety_factor / 1024 / 1024
@@ -0,0 +1,257 @@
+"""
+Cost-based planner for the comparison strategy: predicts time and memory of each engine from the
+file profiles, the key estimates and the machine, picks the cheapest feasible one and records
+predicted vs actual figures to calibrate itself
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from app.config import Config
+from app.services.memory_manager import MemoryManager
+
+# Engines: name used by the comparator -> description
+ENGINES = {
+    'memory': "fusion pandas en mémoire",
+    'partitioned': "partitions par hachage de clé, fusion en mémoire partition par partition",
+    'key_index': "fusion triée des index de clés persistants",
+    'stats_only': "comptages seuls sur les index de clés (sans lignes d'exemple)",
+    'sqlite_temp': "base SQLite temporaire"
+}
+
+# Default unit costs (seconds per MB or per row), corrected by calibration
+PARSE_MB_S = 1 / 25.0           # CSV parsing, one core
+HASH_ROW_S = 1.5e-6             # composite key build + 64-bit hash
+MERGE_ROW_S = 1.0e-6            # pandas outer merge, per output row
+SQLITE_ROW_S = 2.5e-5           # row serialization + insert + join
+ROW_FETCH_S = 2.0e-5            # random access to one row through the line index
+INDEX_ENTRY_BYTES = 16          # (hash, row) pair
+# In-memory size of parsed text data relative to its raw size (object strings)
+EXPANSION = 4.0
+# Share of available memory a plan may use
+MEMORY_BUDGET = 0.5
+# Calibration records used per engine
+CALIBRATION_WINDOW = 50
+# Interval of the RSS sampling thread measuring the peak memory of a run (seconds)
+PEAK_SAMPLING_S = 0.02
+
+
+def _file_costs(info: dict) -> dict:
+    """Raw size and measured bytes per row of a profiled file"""
+    raw_bytes = info.get('raw_bytes') or info.get('compressed_bytes') or 0
+    rows = max(info.get('total_rows') or 0, 1)
+    return {
+        'raw_mb': raw_bytes / 1024 / 1024,
+        'rows': rows,
+        'bytes_per_row': raw_bytes / rows if raw_bytes else info.get('total_columns', 1) * 8,
+        'parallel': (info.get('file_extension') == 'csv' and not info.get('compression')
+                     and Config.CSV_READER_BACKEND == 'parallel')
+    }
+
+
+class PlanificateurComparaison:
+    """Choose the comparison engine with the lowest predicted time that fits in memory"""
+
+    def __init__(self, available_mb: Optional[float] = None, cores: Optional[int] = None,
+                 disk_mb_s: Optional[float] = None):
+        self.available_mb = available_mb if available_mb is not None else MemoryManager.get_memory_usage()['available_mb']
+        self.cores = cores or os.cpu_count() or 1
+        self.disk_mb_s = disk_mb_s or Config.DISK_THROUGHPUT_MB_S
+        self.calibration = load_calibration()
+
+    def _read_s(self, f: dict) -> float:
+        """Reading one file: disk and parsing overlap, the slowest bounds the time"""
+        cores = self.cores if f['parallel'] else 1
+        return max(f['raw_mb'] / self.disk_mb_s, f['raw_mb'] * PARSE_MB_S / cores) + f['rows'] * HASH_ROW_S
+
+    def estimate(self, info1: dict, info2: dict, estimation_cles: Optional[dict] = None,
+                 indexes_reused: tuple = (False, False), sample_size: int = 1000,
+                 random_access: tuple = (True, True)) -> Dict[str, dict]:
+        """
+        Predicted time (s) and peak memory (MB) of each engine.
+
+        Args:
+            info1, info2: Profiles from read_file_info (raw_bytes, total_rows, format)
+            estimation_cles: Key estimates from the sketches (distinct, common, merged_rows), if any
+            indexes_reused: Whether each file already has a valid key index
+            sample_size: Rows per bucket returned with the results
+            random_access: Whether sample rows of each file can be read through the line index
+        """
+        f1, f2 = _file_costs(info1), _file_costs(info2)
+        rows = f1['rows'] + f2['rows']
+        raw_mb = f1['raw_mb'] + f2['raw_mb']
+        avg_row_mb = (f1['bytes_per_row'] + f2['bytes_per_row']) / 2 / 1024 / 1024
+        read_s = self._read_s(f1) + self._read_s(f2)
+
+        if estimation_cles:
+            merged_rows = estimation_cles['merged_rows']
+            distinct = estimation_cles['distinct1'] + estimation_cles['distinct2']
+        else:
+            # Without sketches, keys are assumed unique
+            merged_rows = max(f1['rows'], f2['rows'])
+            distinct = rows
+
+        plans = {}
+        # Both files and the merge result in memory
+        memory_mb = MemoryManager.estimate_comparison_memory(
+            f1['rows'], f2['rows'], 0, safety_factor=EXPANSION,
+            bytes_per_row=(f1['bytes_per_row'] + f2['bytes_per_row']) / 2
+        ) + merged_rows * avg_row_mb * EXPANSION
+        plans['memory'] = {'time_s': read_s + merged_rows * MERGE_ROW_S, 'memory_mb': memory_mb}
+
+        # Partitions sized to a quarter of the memory budget: one spill write and read of the data
+        budget_mb = self.available_mb * MEMORY_BUDGET
+        partitions = max(2, int(memory_mb / (budget_mb * 0.25)) + 1) if budget_mb > 0 else 64
+        plans['partitioned'] = {
+            'time_s': read_s + 2 * raw_mb / self.disk_mb_s + merged_rows * MERGE_ROW_S,
+            'memory_mb': memory_mb / partitions,
+            'partitions': partitions
+        }
+
+        # Key indexes: only files without a valid index are read; samples by row number
+        index_s = sum(self._read_s(f) for f, reused in ((f1, indexes_reused[0]), (f2, indexes_reused[1])) if not reused)
+        index_s += distinct * HASH_ROW_S
+        index_mb = rows * INDEX_ENTRY_BYTES * 2 / 1024 / 1024
+        fetch_s = 0.0
+        for f, direct in ((f1, random_access[0]), (f2, random_access[1])):
+            # Samples: through the line index, or one more pass over the file
+            fetch_s += min(sample_size * 2, f['rows']) * ROW_FETCH_S if direct else self._read_s(f)
+        plans['key_index'] = {'time_s': index_s + fetch_s,
+                              'memory_mb': index_mb + 3 * sample_size * avg_row_mb * EXPANSION}
+        plans['stats_only'] = {'time_s': index_s, 'memory_mb': index_mb}
+
+        # Every row serialized into SQLite, memory bounded by the chunk size
+        plans['sqlite_temp'] = {'time_s': read_s + rows * SQLITE_ROW_S, 'memory_mb': 64.0}
+
+        for engine, plan in plans.items():
+            factors = self.calibration.get(engine, {})
+            plan['time_s'] = round(plan['time_s'] * factors.get('time', 1.0), 3)
+            plan['memory_mb'] = round(plan['memory_mb'] * factors.get('memory', 1.0), 1)
+        return plans
+
+    def choose(self, plans: Dict[str, dict], sample_size: int = 1000,
+               allowed: Optional[List[str]] = None) -> str:
+        """Fastest plan within the memory budget (stats_only only when no sample rows are requested)"""
+        budget_mb = self.available_mb * MEMORY_BUDGET
+        candidates = [engine for engine in (allowed or plans) if engine in plans]
+        if sample_size > 0 and 'stats_only' in candidates:
+            candidates.remove('stats_only')
+        feasible = [engine for engine in candidates if plans[engine]['memory_mb'] <= budget_mb]
+        if not feasible:
+            # Nothing fits: the engine with the smallest memory footprint
+            return min(candidates, key=lambda engine: plans[engine]['memory_mb'])
+        return min(feasible, key=lambda engine: plans[engine]['time_s'])
+
+
+def _calibration_path() -> str:
+    return Config.PLANNER_CALIBRATION_FILE
+
+
+def load_calibration() -> Dict[str, dict]:
+    """
+    Median actual/predicted ratios per engine over the latest runs (needs 3 runs per engine).
+
+    Memory is only calibrated from runs measured at their peak ('actual_mb' of older records is an end
+    minus start RSS difference that misses the memory freed during the run), and a memory factor never
+    brings a prediction below the uncalibrated estimate.
+    """
+    path = _calibration_path()
+    if not os.path.exists(path):
+        return {}
+    ratios: Dict[str, dict] = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('raw_predicted_s') and record.get('actual_s') is not None:
+                    engine_ratios = ratios.setdefault(record['strategy'], {'time': [], 'memory': []})
+                    engine_ratios['time'].append(record['actual_s'] / record['raw_predicted_s'])
+                    if (record.get('raw_predicted_mb') and record.get('actual_mb') is not None
+                            and record.get('memory_measure') == 'peak'):
+                        engine_ratios['memory'].append(max(record['actual_mb'], 1.0) / record['raw_predicted_mb'])
+    except OSError:
+        return {}
+
+    calibration = {}
+    for engine, values in ratios.items():
+        factors = {}
+        for measure, series in values.items():
+            series = sorted(series[-CALIBRATION_WINDOW:])
+            if len(series) >= 3:
+                floor = 1.0 if measure == 'memory' else 0.1
+                factors[measure] = min(max(series[len(series) // 2], floor), 10.0)
+        calibration[engine] = factors
+    return calibration
+
+
+def record_plan_execution(strategy: str, plans: Dict[str, dict], actual_s: float, actual_mb: float,
+                          inputs: dict, calibration: Dict[str, dict]) -> dict:
+    """
+    Append predicted vs actual figures of a run to the calibration file.
+
+    The uncalibrated prediction is stored too, so that ratios are not compounded across runs.
+    """
+    plan = plans.get(strategy, {})
+    factors = calibration.get(strategy, {})
+    record = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'strategy': strategy,
+        'predicted_s': plan.get('time_s'),
+        'predicted_mb': plan.get('memory_mb'),
+        'raw_predicted_s': round(plan.get('time_s', 0) / factors.get('time', 1.0), 3),
+        'raw_predicted_mb': round(plan.get('memory_mb', 0) / factors.get('memory', 1.0), 1),
+        'actual_s': round(actual_s, 3),
+        'actual_mb': round(actual_mb, 1),
+        'memory_measure': 'peak',
+        'inputs': inputs
+    }
+    path = _calibration_path()
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    except OSError as e:
+        print(f"⚠️ Impossible d'enregistrer la calibration du planificateur: {e}")
+    return record
+
+
+def format_plans(plans: Dict[str, dict], chosen: str) -> str:
+    """One line per engine for the logs"""
+    lines = []
+    for engine, plan in sorted(plans.items(), key=lambda item: item[1]['time_s']):
+        marker = '➡️' if engine == chosen else '  '
+        lines.append(f"{marker} {engine}: ~{plan['time_s']:.2f}s, ~{plan['memory_mb']:.0f} MB")
+    return '\n'.join(lines)
+
+
+def measure(func, *args, **kwargs):
+    """
+    Run func and return (result, elapsed seconds, peak RSS increase in MB).
+
+    The RSS is sampled by a background thread during the run: memory allocated then freed by the
+    engine (merge buffers, partitions) counts, unlike a difference between the end and the start.
+    """
+    start_mb = MemoryManager.get_memory_usage()['rss_mb']
+    peak = {'mb': start_mb}
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(PEAK_SAMPLING_S):
+            peak['mb'] = max(peak['mb'], MemoryManager.get_memory_usage()['rss_mb'])
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.time()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        done.set()
+        sampler.join()
+    peak['mb'] = max(peak['mb'], MemoryManager.get_memory_usage()['rss_mb'])
+    return result, elapsed, peak['mb'] - start_mb
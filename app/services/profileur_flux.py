@@ -0,0 +1,267 @@
+"""
+Streaming profiler: hashes and profiles a file while its bytes arrive (chunked uploads)
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+from typing import Dict, Optional
+import pandas as pd
+from app.utils.cache_utils import get_sidecar_path, save_json_sidecar
+from app.utils.compression import get_compression, get_file_extension, DecompresseurFlux
+from app.utils.encoding_utils import DetecteurEncodage
+from app.utils.string_storage import get_string_dtype
+from app.services.esquisses import ConstructeurEsquisses
+from app.services.index_lignes import ConstructeurIndexLignes, IndexLignes
+from app.services.lecteur_csv_parallele import LecteurCSVParallele
+from app.services.lecteur_fichier_optimise import LecteurFichierOptimise, PROFILE_SUFFIX
+
+# Decompressed bytes kept to detect the delimiter and parse the header/sample rows
+HEAD_BYTES = 64 * 1024
+# Decompressed bytes parsed at once to feed the key sketches
+SKETCH_BATCH_BYTES = 8 * 1024 * 1024
+# Profilers idle for longer than this are dropped (upload abandoned, or finished by another worker)
+PROFILEUR_TTL_S = 6 * 3600
+
+
+class ProfileurFlux:
+    """
+    Profile a file from consecutive blocks: sha256, byte counts, encoding, delimiter, line index
+    and key sketches
+    """
+
+    def __init__(self, final_path: str, part_path: Optional[str] = None):
+        self.final_path = final_path
+        self.part_path = part_path
+        self.last_used = time.time()
+        self.ext = get_file_extension(final_path) if get_compression(final_path) != 'zip' else None
+        self.compression = get_compression(final_path)
+        self.sha256 = hashlib.sha256()
+        self.compressed_bytes = 0
+        self.head = bytearray()
+        self.detecteur = DetecteurEncodage()
+
+        # Zip archives cannot be decompressed incrementally (central directory at the end)
+        self.streamable = self.ext == 'csv' and self.compression != 'zip'
+        self.decompresseur = DecompresseurFlux(self.compression) if self.streamable and self.compression else None
+
+        # Only uncompressed files get a line offset index (random access needs raw offsets);
+        # one temporary index per process, as each worker may rebuild its own profiler of the upload
+        self._index_tmp = None
+        index_output = None
+        if self.streamable and self.compression is None:
+            self._index_tmp = f"{get_sidecar_path(final_path, IndexLignes.SUFFIX)}.{os.getpid()}.upload"
+            index_output = IndexLignes.open_output(self._index_tmp)
+        self.builder = ConstructeurIndexLignes(index_output) if self.streamable else None
+
+        # Key sketches fed with the complete records received, parsed once the encoding is settled
+        self.esquisses = ConstructeurEsquisses() if self.streamable else None
+        self._pending = bytearray()
+        self._columns = None
+        self._encoding = None
+        self._delimiter = None
+
+    def feed(self, block: bytes):
+        """Process the next block of the uploaded file"""
+        self.sha256.update(block)
+        self.compressed_bytes += len(block)
+        if not self.streamable:
+            return
+
+        raw = self.decompresseur.decompress(block) if self.decompresseur else block
+        self.builder.feed(raw)
+        self.detecteur.feed(raw)
+        if len(self.head) < HEAD_BYTES:
+            self.head += raw[:HEAD_BYTES - len(self.head)]
+        if self.esquisses is not None:
+            self._pending += raw
+            if len(self._pending) >= SKETCH_BATCH_BYTES and self.detecteur.done:
+                self._feed_sketches_safely(final=False)
+
+    def _feed_sketches_safely(self, final: bool):
+        """The sketches never fail the upload: on a parse error they are read from the complete file"""
+        try:
+            self._feed_sketches(final)
+        except Exception as e:
+            print(f"⚠️ Esquisses de clés non calculées pendant l'upload: {e}")
+            self.esquisses = None
+            self._pending = bytearray()
+
+    def _feed_sketches(self, final: bool):
+        """Parse the complete records pending (all of them at the end of the file) into the key sketches"""
+        if self._encoding is None:
+            self._encoding = self.detecteur.result(reached_eof=final)['encoding']
+            if not LecteurCSVParallele.supports_encoding(self._encoding):
+                # Profiled once complete (UTF-16...)
+                self.esquisses = None
+                self._pending = bytearray()
+                return
+            head_text = bytes(self.head).decode(self._encoding, errors='ignore')
+            self._delimiter = LecteurFichierOptimise.detect_delimiter_from_sample(head_text[:1024])
+
+        data = bytes(self._pending)
+        if not final:
+            # A newline ends a record when the quotes before it are balanced
+            cut = data.rfind(b'\n')
+            quotes = data.count(b'"', 0, cut)
+            while cut >= 0 and quotes % 2:
+                previous = data.rfind(b'\n', 0, cut)
+                quotes -= data.count(b'"', max(previous, 0), cut)
+                cut = previous
+            if cut < 0:
+                return
+            data = data[:cut + 1]
+        self._pending = bytearray(self._pending[len(data):])
+        if not data.strip():
+            return
+
+        first = self._columns is None
+        chunk = pd.read_csv(io.BytesIO(data), header=0 if first else None, names=None if first else self._columns,
+                            sep=self._delimiter, encoding=self._encoding, dtype=get_string_dtype(),
+                            on_bad_lines='skip', index_col=False)
+        if first:
+            self._columns = chunk.columns.tolist()
+        self.esquisses.feed(chunk)
+
+    def close(self):
+        """Release the temporary index file"""
+        if self.builder is not None and self.builder.output is not None and not self.builder.output.closed:
+            self.builder.output.close()
+
+    def discard(self):
+        """Close and remove temporary files (aborted upload)"""
+        self.close()
+        if self._index_tmp and os.path.exists(self._index_tmp):
+            os.remove(self._index_tmp)
+
+    @classmethod
+    def from_partial_file(cls, final_path: str, part_path: str, block_size: int = 8 * 1024 * 1024) -> 'ProfileurFlux':
+        """Rebuild the profiler state from the bytes already received (resume after a restart)"""
+        profileur = cls(final_path, part_path)
+        if os.path.exists(part_path):
+            with open(part_path, 'rb') as f:
+                while True:
+                    block = f.read(block_size)
+                    if not block:
+                        break
+                    profileur.feed(block)
+        return profileur
+
+    def finish(self) -> Dict:
+        """
+        Finalize the profile once the complete file is at final_path.
+
+        Writes the line index and the profile sidecars, so that read_file_info,
+        previews and comparisons do not read the file again.
+        """
+        sha256 = self.sha256.hexdigest()
+        detection = self.detecteur.result(reached_eof=True)
+        encoding = detection['encoding']
+
+        if not self.streamable or not LecteurCSVParallele.supports_encoding(encoding):
+            # Formats without incremental profiling (Excel, JSON, zip, UTF-16) are profiled once complete
+            self.discard()
+            lecteur = LecteurFichierOptimise()
+            file_info = lecteur.read_file_info(self.final_path)
+            file_info['sha256'] = sha256
+            save_json_sidecar(self.final_path, PROFILE_SUFFIX, file_info)
+            try:
+                lecteur.read_key_sketches(self.final_path)
+            except Exception as e:
+                print(f"⚠️ Impossible de calculer les esquisses de clés: {e}")
+            return file_info
+
+        n_offsets = self.builder.finish()
+        self.close()
+        if self._index_tmp:
+            IndexLignes.install(self._index_tmp, self.final_path)
+
+        head_text = bytes(self.head).decode(encoding, errors='ignore')
+        delimiter = LecteurFichierOptimise.detect_delimiter_from_sample(head_text[:1024])
+
+        # Header and sample rows come from the first bytes (incomplete last line ignored)
+        head = bytes(self.head)
+        if len(self.head) >= HEAD_BYTES and b'\n' in head:
+            head = head[:head.rfind(b'\n') + 1]
+        sample_df = pd.read_csv(io.BytesIO(head), nrows=5, encoding=encoding, delimiter=delimiter,
+                                on_bad_lines='skip', engine='python')
+
+        file_info = {
+            'columns': sample_df.columns.tolist(),
+            'total_rows': max(n_offsets - 2, 0),
+            'total_columns': len(sample_df.columns),
+            'sample_data': sample_df.to_dict(orient='records'),
+            'file_extension': self.ext,
+            'encoding': encoding,
+            'encoding_confidence': detection['confidence'],
+            'delimiter': delimiter,
+            'compression': self.compression,
+            'compressed_bytes': self.compressed_bytes,
+            'raw_bytes': self.builder.position,
+            'sha256': sha256
+        }
+        save_json_sidecar(self.final_path, PROFILE_SUFFIX, file_info)
+
+        if self.esquisses is not None:
+            self._feed_sketches_safely(final=True)
+        try:
+            if self.esquisses is not None and self._encoding == encoding:
+                self.esquisses.finish(self.final_path)
+            else:
+                # Parse error, or encoding settled on a prefix that the rest of the file contradicts
+                LecteurFichierOptimise().read_key_sketches(self.final_path)
+        except Exception as e:
+            print(f"⚠️ Impossible de calculer les esquisses de clés: {e}")
+        return file_info
+
+
+# Profilers of the uploads in progress in this process
+_profileurs_actifs: Dict[str, ProfileurFlux] = {}
+_profileurs_lock = threading.Lock()
+
+
+def _evict_stale(keep: Optional[str] = None):
+    """
+    Drop the profilers of uploads finished or aborted elsewhere (part file gone) or idle for too long
+    (called with the lock held)
+    """
+    now = time.time()
+    for upload_id, profileur in list(_profileurs_actifs.items()):
+        if upload_id == keep:
+            continue
+        gone = profileur.part_path is not None and not os.path.exists(profileur.part_path)
+        if gone or now - profileur.last_used > PROFILEUR_TTL_S:
+            _profileurs_actifs.pop(upload_id).discard()
+
+
+def get_profileur(upload_id: str, final_path: str, part_path: str) -> ProfileurFlux:
+    """
+    Return the profiler of an upload, in sync with the bytes already written to part_path.
+
+    When the in-process state is missing or out of sync (restart, another worker),
+    it is rebuilt by streaming the partial file.
+    """
+    received = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    with _profileurs_lock:
+        _evict_stale(keep=upload_id)
+        profileur = _profileurs_actifs.get(upload_id)
+        if profileur is None or profileur.compressed_bytes != received:
+            if profileur is not None:
+                profileur.discard()
+            print(f"🔄 Reconstruction du profil de l'upload {upload_id} ({received} octets reçus)")
+            profileur = ProfileurFlux.from_partial_file(final_path, part_path)
+            _profileurs_actifs[upload_id] = profileur
+        profileur.last_used = time.time()
+        return profileur
+
+
+def release_profileur(upload_id: str) -> Optional[ProfileurFlux]:
+    """
+    Take the profiler of an upload being completed out of the registry (no eviction can touch it any more,
+    the caller discards it) and drop the stale profilers of this process
+    """
+    with _profileurs_lock:
+        profileur = _profileurs_actifs.pop(upload_id, None)
+        _evict_stale()
+        return profileur
@@ -0,0 +1,255 @@
+"""
+Aggregate reconciliation: each file is reduced in one streaming pass to sums and counts per group
+(vectorized groupby per chunk, partial aggregates merged as they come), then the two small aggregate
+tables are compared with tolerance thresholds - no row-level join
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Union
+import numpy as np
+import pandas as pd
+from app.config import Config
+from app.utils.normalisation_cles import normaliser_colonne
+
+# Rows per chunk of the streaming pass (aggregation only keeps one row per group)
+TAILLE_BLOC = 100000
+# Partial aggregates kept before they are merged (bounds memory when groups are many)
+PARTIELS_MAX = 16
+# Column holding the row count of each group
+COLONNE_LIGNES = 'nb_lignes'
+
+
+def _texte_mesure(series: pd.Series) -> pd.Series:
+    """Text of a measure column without blanks and digit group apostrophes (missing values -> '')"""
+    text = series.astype(object).where(series.notna(), '').astype(str)
+    return text.str.replace(r"[\s  ']", '', regex=True)
+
+
+def valeurs_numeriques(series: pd.Series) -> pd.Series:
+    """
+    Measure column as float64. Text values are read with blanks removed and thousands separators
+    dropped: the last of ',' and '.' is the decimal separator when both appear ('1,234.50', '1.234,50'),
+    a separator repeated on its own groups thousands ('1,234,567', '1.234.567') and a single comma
+    is a decimal comma ('1 234,50'). Other values become NaN (see valeurs_invalides)
+    """
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return series.astype(np.float64)
+    text = _texte_mesure(series)
+    last_comma = text.str.rfind(',')
+    last_point = text.str.rfind('.')
+    decimal_comma = (last_comma > last_point) & (text.str.count(',') == 1)
+    # Decimal comma: points group thousands; otherwise commas group thousands
+    text = text.where(~decimal_comma, text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    text = text.where(decimal_comma, text.str.replace(',', '', regex=False))
+    text = text.where(text.str.count(r'\.') <= 1, text.str.replace('.', '', regex=False))
+    return pd.to_numeric(text, errors='coerce').astype(np.float64)
+
+
+def valeurs_invalides(series: pd.Series, values: pd.Series) -> pd.Series:
+    """Non-empty values of a measure column that do not parse as numbers (values: valeurs_numeriques)"""
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return pd.Series(False, index=series.index)
+    return values.isna() & (_texte_mesure(series) != '')
+
+
+def _agreger_bloc(chunk: pd.DataFrame, group_columns: List[str], measure_columns: List[str]) -> pd.DataFrame:
+    """
+    Sums, parsed and unparsed value counts and row count of one chunk per group. Rows are grouped on their raw
+    values first, so that group values are normalized (like key columns) once per distinct group, not per row
+    """
+    frame = pd.DataFrame({col: chunk[col] for col in group_columns})
+    frame[COLONNE_LIGNES] = 1
+    for col in measure_columns:
+        values = valeurs_numeriques(chunk[col])
+        frame[f"{col}__somme"] = values.fillna(0.0).to_numpy()
+        frame[f"{col}__nb"] = values.notna().to_numpy().astype(np.int64)
+        # Non-empty values that are not numbers: left out of the sums, reported instead of being taken as empty
+        frame[f"{col}__invalides"] = valeurs_invalides(chunk[col], values).to_numpy().astype(np.int64)
+    raw = frame.groupby(group_columns, sort=False, dropna=False).sum().reset_index()
+    groups = {col: normaliser_colonne(raw[col], col) for col in group_columns}
+    # Raw values that only differ before normalization ('A ' and 'A') merge here
+    return raw.drop(columns=group_columns).assign(**groups).groupby(group_columns, sort=False).sum()
+
+
+def _fusionner(partials: List[pd.DataFrame]) -> pd.DataFrame:
+    """Sums and counts are additive: partial aggregates merge with one more groupby"""
+    if len(partials) == 1:
+        return partials[0]
+    merged = pd.concat(partials)
+    return merged.groupby(level=list(range(merged.index.nlevels)), sort=False).sum()
+
+
+def agreger(chunks: Iterable[pd.DataFrame], group_columns: List[str], measure_columns: List[str]) -> pd.DataFrame:
+    """
+    Aggregate table of a file read as a stream of chunks.
+
+    Returns:
+        pd.DataFrame: one row per group (group columns as index), with the row count and,
+        per measure, the sum, the number of parsed values and the number of unparsed non-empty values
+    """
+    partials: List[pd.DataFrame] = []
+    for chunk in chunks:
+        missing = [col for col in group_columns + measure_columns if col not in chunk.columns]
+        if missing:
+            raise ValueError(f"Colonnes introuvables: {', '.join(missing)}")
+        partials.append(_agreger_bloc(chunk, group_columns, measure_columns))
+        if len(partials) >= PARTIELS_MAX:
+            partials = [_fusionner(partials)]
+    if not partials:
+        columns = [COLONNE_LIGNES] + [f"{col}__{part}" for col in measure_columns
+                                   for part in ('somme', 'nb', 'invalides')]
+        return pd.DataFrame(columns=columns, index=pd.MultiIndex.from_arrays([[]] * len(group_columns),
+                                                                              names=group_columns))
+    return _fusionner(partials)
+
+
+def comparer_tables(agg1: pd.DataFrame, agg2: pd.DataFrame, group_columns: List[str], measures1: List[str],
+                    measures2: List[str], tolerance_abs: float, tolerance_rel: float) -> pd.DataFrame:
+    """
+    Compare two aggregate tables group by group.
+
+    A measure matches when |total 1 - total 2| <= max(tolerance_abs, tolerance_rel * max(|total 1|, |total 2|)).
+    File 2 groups and measures are matched by position with those of file 1.
+
+    Returns:
+        pd.DataFrame: group columns, row counts, per measure both totals and their difference,
+        and the status of the group ('identique', 'écart', 'seulement_fichier1', 'seulement_fichier2')
+    """
+    agg2 = agg2.copy()
+    agg2.index = agg2.index.set_names(group_columns)
+    left = pd.DataFrame({COLONNE_LIGNES: agg1[COLONNE_LIGNES]})
+    right = pd.DataFrame({COLONNE_LIGNES: agg2[COLONNE_LIGNES]})
+    for measure1, measure2 in zip(measures1, measures2):
+        left[measure1] = agg1[f"{measure1}__somme"].where(agg1[f"{measure1}__nb"] > 0)
+        right[measure1] = agg2[f"{measure2}__somme"].where(agg2[f"{measure2}__nb"] > 0)
+    merged = left.join(right, how='outer', lsuffix='_fichier1', rsuffix='_fichier2')
+    in1 = merged[f"{COLONNE_LIGNES}_fichier1"].notna().to_numpy()
+    in2 = merged[f"{COLONNE_LIGNES}_fichier2"].notna().to_numpy()
+
+    result = pd.DataFrame(index=merged.index)
+    for side in ('fichier1', 'fichier2'):
+        result[f"{COLONNE_LIGNES}_{side}"] = merged[f"{COLONNE_LIGNES}_{side}"].fillna(0).astype(np.int64)
+    mismatch = np.zeros(len(merged), dtype=bool)
+    for measure in measures1:
+        total1 = merged[f"{measure}_fichier1"].to_numpy(dtype=np.float64)
+        total2 = merged[f"{measure}_fichier2"].to_numpy(dtype=np.float64)
+        difference = np.nan_to_num(total1) - np.nan_to_num(total2)
+        allowed = np.maximum(tolerance_abs, tolerance_rel * np.maximum(np.abs(np.nan_to_num(total1)),
+                                                                      np.abs(np.nan_to_num(total2))))
+        # Empty on one side only is a difference, empty on both sides is not
+        differs = (np.abs(difference) > allowed + 1e-9) | (np.isnan(total1) != np.isnan(total2))
+        mismatch |= differs
+        result[f"{measure}_fichier1"] = total1
+        result[f"{measure}_fichier2"] = total2
+        result[f"{measure}_ecart"] = np.round(difference, 6)
+    result['statut'] = np.select([~in2, ~in1, mismatch], ['seulement_fichier1', 'seulement_fichier2', 'écart'],
+                                 default='identique')
+    return result.reset_index()
+
+
+class RapprochementAgregats:
+    """
+    Aggregate comparison of two files.
+
+    Args:
+        file1, file2: Files to reconcile (paths, streamed in chunks, or frames already in memory)
+        groups1, groups2: Group-by columns of each file (matched by position)
+        measures1, measures2: Measure columns of each file (matched by position)
+        tolerance_abs: Absolute difference accepted on a total
+        tolerance_rel: Relative difference accepted on a total (0.001 = 0.1 %)
+    """
+
+    def __init__(self, file1: Union[str, pd.DataFrame], file2: Union[str, pd.DataFrame], groups1: List[str], groups2: List[str],
+                 measures1: List[str], measures2: List[str], tolerance_abs: Optional[float] = None,
+                 tolerance_rel: Optional[float] = None):
+        if not groups1 or len(groups1) != len(groups2):
+            raise ValueError("Les deux fichiers doivent avoir le même nombre de colonnes de regroupement")
+        if len(measures1) != len(measures2):
+            raise ValueError("Les deux fichiers doivent avoir le même nombre de colonnes de mesure")
+        self.file1 = file1
+        self.file2 = file2
+        self.groups1, self.groups2 = groups1, groups2
+        self.measures1, self.measures2 = measures1, measures2
+        self.tolerance_abs = Config.AGGREGATE_TOLERANCE_ABS if tolerance_abs is None else tolerance_abs
+        self.tolerance_rel = Config.AGGREGATE_TOLERANCE_REL if tolerance_rel is None else tolerance_rel
+
+    def _agreger_fichier(self, source: Union[str, pd.DataFrame], groups: List[str],
+                         measures: List[str]) -> pd.DataFrame:
+        from .lecteur_fichier_optimise import LecteurFichierOptimise
+        start = time.time()
+        if isinstance(source, pd.DataFrame):
+            chunks = [source]
+        else:
+            # Aggregation does not depend on the chunk order, and only needs the group and measure columns
+            chunks = LecteurFichierOptimise(chunk_size=TAILLE_BLOC).read_file_chunks(
+                source, ordered=False, usecols=list(dict.fromkeys(groups + measures)))
+        table = agreger(chunks, groups, measures)
+        name = source if isinstance(source, str) else 'DataFrame'
+        print(f"🧾 Agrégats de {name}: {len(table)} groupes, {int(table[COLONNE_LIGNES].sum())} lignes "
+              f"en {time.time() - start:.2f}s")
+        return table
+
+    def comparer(self, agg1: Optional[pd.DataFrame] = None, agg2: Optional[pd.DataFrame] = None) -> Dict:
+        """
+        Aggregate both files (in parallel) unless their tables are given, then compare the tables.
+
+        Returns:
+            Dict: 'agregats' (one row per group), group counts per status, grand totals per measure
+            and the non-empty values left out of them because they are not numbers
+        """
+        start = time.time()
+        if agg1 is None or agg2 is None:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                future1 = executor.submit(self._agreger_fichier, self.file1, self.groups1, self.measures1)
+                future2 = executor.submit(self._agreger_fichier, self.file2, self.groups2, self.measures2)
+                agg1, agg2 = future1.result(), future2.result()
+
+        table = comparer_tables(agg1, agg2, self.groups1, self.measures1, self.measures2,
+                                self.tolerance_abs, self.tolerance_rel)
+        counts = table['statut'].value_counts()
+        totaux = [{
+            'mesure': measure1 if measure1 == measure2 else f"{measure1} / {measure2}",
+            'total_fichier1': float(np.nansum(table[f"{measure1}_fichier1"])),
+            'total_fichier2': float(np.nansum(table[f"{measure1}_fichier2"])),
+            'ecart': float(np.nansum(table[f"{measure1}_fichier1"]) - np.nansum(table[f"{measure1}_fichier2"])),
+            # Non-empty values that are not numbers, left out of the totals
+            'invalides_fichier1': int(agg1[f"{measure1}__invalides"].sum()),
+            'invalides_fichier2': int(agg2[f"{measure2}__invalides"].sum())
+        } for measure1, measure2 in zip(self.measures1, self.measures2)]
+        n_invalides = sum(total['invalides_fichier1'] + total['invalides_fichier2'] for total in totaux)
+        if n_invalides:
+            print(f"⚠️ {n_invalides} valeurs non numériques exclues des totaux")
+        duration = time.time() - start
+        print(f"🧾 Rapprochement par agrégats: {len(table)} groupes, {int(counts.get('écart', 0))} écarts "
+              f"en {duration:.2f}s")
+        return {
+            'agregats': table,
+            'n_groupes': len(table),
+            'n_identiques': int(counts.get('identique', 0)),
+            'n_ecarts': int(counts.get('écart', 0)),
+            'n1': int(counts.get('seulement_fichier1', 0)),
+            'n2': int(counts.get('seulement_fichier2', 0)),
+            'nb_lignes1': int(agg1[COLONNE_LIGNES].sum()),
+            'nb_lignes2': int(agg2[COLONNE_LIGNES].sum()),
+            'totaux': totaux,
+            'n_invalides': n_invalides,
+            'tolerance_abs': self.tolerance_abs,
+            'tolerance_rel': self.tolerance_rel,
+            'duree_s': round(duration, 2)
+        }
+
+
+def rapprocher_agregats(file1: Union[str, pd.DataFrame], file2: Union[str, pd.DataFrame], groups1: List[str],
+                        groups2: List[str], measures1: List[str], measures2: List[str],
+                        tolerance_abs: Optional[float] = None, tolerance_rel: Optional[float] = None) -> Dict:
+    """
+    High-level function: reconcile two files on their totals per group
+
+    Args:
+        file1, file2: Paths of the files (read in chunks) or frames already in memory
+        groups1, groups2: Group-by columns of each file
+        measures1, measures2: Measure columns of each file
+        tolerance_abs, tolerance_rel: Accepted differences (defaults from the configuration)
+    """
+    return RapprochementAgregats(file1, file2, groups1, groups2, measures1, measures2,
+                                 tolerance_abs, tolerance_rel).comparer()
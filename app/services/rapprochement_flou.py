@@ -0,0 +1,219 @@
+"""
+Fuzzy matching of near-miss keys between the unmatched buckets of a comparison: blocking
+(normalized key, sorted neighbourhood, MinHash LSH on bigrams) generates candidate pairs,
+which are then scored with a vectorized bigram Dice similarity
+"""
+import time
+from typing import Dict, Tuple
+import numpy as np
+import pandas as pd
+
+# Minimum bigram Dice similarity of a reported match (one typo in a 9-character key scores 0.8)
+SEUIL_SCORE = 0.8
+# Sorted neighbourhood: keys of the other file within this many positions
+FENETRE_VOISINAGE = 5
+# MinHash LSH: BANDES bands of LIGNES_PAR_BANDE hashes (Jaccard 0.67, i.e. Dice 0.8, collides in one band with ~99 % chance)
+BANDES = 12
+LIGNES_PAR_BANDE = 3
+# LSH buckets larger than this are too generic to be informative (ex: very short keys)
+TAILLE_MAX_SEAU = 50
+
+
+def normaliser_cles(keys: pd.Series) -> pd.Series:
+    """
+    Canonical form used for blocking and scoring: accents removed, case folded, blanks collapsed,
+    leading zeros of numeric key parts removed (composite key separators are kept)
+    """
+    normalized = keys.astype(str).str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+    normalized = normalized.str.casefold().str.replace(r'\s+', ' ', regex=True).str.strip()
+    normalized = normalized.str.replace(r'\s*\|\s*', '|', regex=True)
+    return normalized.str.replace(r'(?:^|(?<=\|))0+(?=\d+(?:\||$))', '', regex=True)
+
+
+def _bigrammes(normalized: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Bigram hashes of each key as flat arrays (key position, sorted bigram hash).
+
+    Keys are padded with spaces so that one-character keys and word boundaries get bigrams too.
+    Repeated bigrams are kept as a multiset (each occurrence hashed with its rank), so that codes
+    full of zeros are not reduced to a handful of bigrams.
+    """
+    owners = []
+    grams = []
+    for position, key in enumerate(normalized):
+        padded = f" {key} "
+        owners.extend([position] * (len(padded) - 1))
+        grams.extend(padded[i:i + 2] for i in range(len(padded) - 1))
+    if not grams:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+    owners = np.asarray(owners, dtype=np.int64)
+    hashes = pd.util.hash_array(np.asarray(grams, dtype=object))
+    order = np.lexsort((hashes, owners))
+    owners, hashes = owners[order], hashes[order]
+    # Rank of each occurrence of a bigram inside its key
+    new_run = np.r_[True, (owners[1:] != owners[:-1]) | (hashes[1:] != hashes[:-1])]
+    run_start = np.maximum.accumulate(np.where(new_run, np.arange(len(hashes)), 0))
+    occurrence = (np.arange(len(hashes)) - run_start).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        hashes = hashes + occurrence * np.uint64(0x9E3779B97F4A7C15)
+    order = np.lexsort((hashes, owners))
+    return owners[order], hashes[order]
+
+
+def _signatures_minhash(owners: np.ndarray, grams: np.ndarray, n_keys: int, n_hashes: int,
+                        seed: int = 0) -> np.ndarray:
+    """MinHash signature (n_keys x n_hashes) from the flat bigram arrays"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 63, size=n_hashes, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=n_hashes, dtype=np.uint64)
+    signatures = np.full((n_keys, n_hashes), np.iinfo(np.uint64).max, dtype=np.uint64)
+    if len(grams) == 0:
+        return signatures
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    with np.errstate(over='ignore'):
+        for j in range(n_hashes):
+            permuted = grams * a[j] + b[j]
+            signatures[owners[starts], j] = np.minimum.reduceat(permuted, starts)
+    return signatures
+
+
+def _paires_lsh(signatures: np.ndarray, side: np.ndarray) -> np.ndarray:
+    """Candidate (left, right) positions sharing at least one LSH band (cross products built vectorized)"""
+    pairs = []
+    for band in range(BANDES):
+        columns = signatures[:, band * LIGNES_PAR_BANDE:(band + 1) * LIGNES_PAR_BANDE]
+        band_hash = pd.util.hash_pandas_object(pd.DataFrame(columns), index=False).to_numpy()
+        # Grouped by band hash, left keys before right keys inside a group
+        order = np.lexsort((side, band_hash))
+        sorted_hash, sorted_side = band_hash[order], side[order]
+        new_group = np.r_[True, sorted_hash[1:] != sorted_hash[:-1]]
+        group = np.cumsum(new_group) - 1
+        sizes = np.bincount(group)
+        rights = np.bincount(group, weights=sorted_side).astype(np.int64)
+        valid = (sizes <= TAILLE_MAX_SEAU) & (rights > 0) & (rights < sizes)
+        # First right key of each group
+        right_start = np.flatnonzero(new_group) + (sizes - rights)
+
+        left_mask = (sorted_side == 0) & valid[group]
+        left, left_group = order[left_mask], group[left_mask]
+        repeats = rights[left_group]
+        within = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        right = order[np.repeat(right_start[left_group], repeats) + within]
+        pairs.append(np.stack([np.repeat(left, repeats), right], axis=1))
+    return np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+
+
+def _paires_voisinage(normalized: np.ndarray, side: np.ndarray) -> np.ndarray:
+    """Candidate pairs of the sorted neighbourhood, on the keys and on the reversed keys (typos at the start)"""
+    pairs = []
+    for sort_keys in (normalized, np.asarray([key[::-1] for key in normalized], dtype=object)):
+        order = np.argsort(sort_keys, kind='stable')
+        for offset in range(1, FENETRE_VOISINAGE + 1):
+            first, second = order[:-offset], order[offset:]
+            cross = side[first] != side[second]
+            left = np.where(side[first] == 0, first, second)[cross]
+            right = np.where(side[first] == 0, second, first)[cross]
+            pairs.append(np.stack([left, right], axis=1))
+    return np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+
+
+def _dice_bigrammes(pairs: np.ndarray, owners: np.ndarray, grams: np.ndarray, n_keys: int) -> np.ndarray:
+    """
+    Exact bigram Dice similarity (2 |A ∩ B| / (|A| + |B|)) of each pair, vectorized: the grams of both
+    keys of every pair are laid out side by side and the shared ones counted after one sort
+    """
+    if len(pairs) == 0:
+        return np.empty(0, dtype=np.float64)
+    starts = np.searchsorted(owners, np.arange(n_keys), side='left')
+    counts = np.bincount(owners, minlength=n_keys)
+
+    def _expand(positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        lengths = counts[positions]
+        pair_ids = np.repeat(np.arange(len(positions)), lengths)
+        first = np.repeat(starts[positions], lengths)
+        within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return pair_ids, grams[first + within]
+
+    ids_left, grams_left = _expand(pairs[:, 0])
+    ids_right, grams_right = _expand(pairs[:, 1])
+    pair_ids = np.concatenate([ids_left, ids_right])
+    all_grams = np.concatenate([grams_left, grams_right])
+    order = np.lexsort((all_grams, pair_ids))
+    pair_ids, all_grams = pair_ids[order], all_grams[order]
+    shared = (pair_ids[1:] == pair_ids[:-1]) & (all_grams[1:] == all_grams[:-1])
+    intersection = np.bincount(pair_ids[1:][shared], minlength=len(pairs))
+    sizes = counts[pairs[:, 0]] + counts[pairs[:, 1]]
+    return np.where(sizes > 0, 2 * intersection / np.maximum(sizes, 1), 0.0)
+
+
+def rapprocher_cles(keys1: pd.Series, keys2: pd.Series, seuil: float = SEUIL_SCORE) -> pd.DataFrame:
+    """
+    Likely matches between keys found only in file 1 and keys found only in file 2.
+
+    Args:
+        keys1: Distinct unmatched composite keys of file 1
+        keys2: Distinct unmatched composite keys of file 2
+        seuil: Minimum similarity (0-1) of a reported match
+
+    Returns:
+        pd.DataFrame: cle_fichier1, cle_fichier2, score, methode - at most one match per key
+        (pairs taken greedily by decreasing score), best scores first
+    """
+    columns = ['cle_fichier1', 'cle_fichier2', 'score', 'methode']
+    keys1 = pd.Series(pd.unique(keys1.astype(str)), dtype=object)
+    keys2 = pd.Series(pd.unique(keys2.astype(str)), dtype=object)
+    if len(keys1) == 0 or len(keys2) == 0:
+        return pd.DataFrame(columns=columns)
+
+    start = time.time()
+    originals = np.concatenate([keys1.to_numpy(), keys2.to_numpy()])
+    normalized = normaliser_cles(pd.Series(originals, dtype=object)).to_numpy(dtype=object)
+    side = np.r_[np.zeros(len(keys1), dtype=np.int8), np.ones(len(keys2), dtype=np.int8)]
+    n_keys = len(originals)
+
+    owners, grams = _bigrammes(normalized)
+    signatures = _signatures_minhash(owners, grams, n_keys, BANDES * LIGNES_PAR_BANDE)
+    candidates = {
+        'voisinage': _paires_voisinage(normalized, side),
+        'minhash': _paires_lsh(signatures, side)
+    }
+    frames = [pd.DataFrame({'left': pairs[:, 0], 'right': pairs[:, 1], 'methode': name})
+              for name, pairs in candidates.items() if len(pairs)]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    pairs = pd.concat(frames, ignore_index=True).drop_duplicates(['left', 'right'])
+
+    positions = pairs[['left', 'right']].to_numpy(dtype=np.int64)
+    scores = _dice_bigrammes(positions, owners, grams, n_keys)
+    same_normalized = normalized[positions[:, 0]] == normalized[positions[:, 1]]
+    pairs['score'] = np.where(same_normalized, 1.0, scores)
+    pairs.loc[same_normalized, 'methode'] = 'normalisation'
+    pairs = pairs[pairs['score'] >= seuil]
+
+    # One match per key: pairs taken by decreasing score, skipping keys already matched
+    pairs = pairs.sort_values(['score', 'left', 'right'], ascending=[False, True, True])
+    used_left, used_right, kept = set(), set(), []
+    for position, (left, right) in enumerate(zip(pairs['left'].to_numpy(), pairs['right'].to_numpy())):
+        if left not in used_left and right not in used_right:
+            used_left.add(left)
+            used_right.add(right)
+            kept.append(position)
+    pairs = pairs.iloc[kept]
+
+    matches = pd.DataFrame({
+        'cle_fichier1': originals[pairs['left'].to_numpy()],
+        'cle_fichier2': originals[pairs['right'].to_numpy()],
+        'score': pairs['score'].round(3).to_numpy(),
+        'methode': pairs['methode'].to_numpy()
+    }, columns=columns)
+    print(f"🔗 Rapprochement flou: {len(positions)} paires candidates, {len(matches)} rapprochements "
+          f"({len(keys1)} x {len(keys2)} clés non appariées) en {time.time() - start:.2f}s")
+    return matches
+
+
+def resume_rapprochements(matches: pd.DataFrame) -> Dict:
+    """Counts per blocking method, for the logs and the result page"""
+    return {
+        'total': len(matches),
+        'par_methode': matches['methode'].value_counts().to_dict() if len(matches) else {}
+    }
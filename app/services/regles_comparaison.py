@@ -0,0 +1,234 @@
+"""
+Per-column comparison rules of the value diff (numeric tolerance, date granularity, case and
+whitespace insensitive text, ignored column), stored per project.
+
+Each rule is compiled once into a vectorized predicate (two Series -> boolean array of the values
+that differ) and a canonical form used by the row fingerprints: values equal under a rule get the
+same fingerprint whenever the rule allows it (texts, dates), so they are not diffed at all.
+Values are only trimmed and NFC-normalized before their rule applies: the key normalization rules
+(KEY_NORMALIZATION) never fold values away, and the column name does not change the canonical form.
+"""
+import json
+import warnings
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from app.utils.normalisation_cles import normaliser_valeurs
+from app.services.filtres_lignes import deviner_format_date
+from app.services.rapprochement_agregats import valeurs_numeriques
+
+TYPES_REGLE = ('numerique', 'date', 'texte', 'ignorer')
+# Date granularities in nanoseconds (dates are compared once truncated to this unit)
+GRANULARITES = {'jour': 86_400 * 10 ** 9, 'heure': 3_600 * 10 ** 9, 'minute': 60 * 10 ** 9, 'seconde': 10 ** 9}
+# Float noise allowed on top of a numeric tolerance (100.004 - 100.0 > 0.004 in float64)
+_EPSILON = 1e-9
+_NAT = np.iinfo(np.int64).min
+
+
+def normaliser_regle(regle: Optional[Dict]) -> Optional[Dict]:
+    """
+    Canonical form of a rule (only the fields of its type), None for no rule or an unknown type.
+
+    Raises:
+        ValueError: Negative tolerance or unknown date granularity
+    """
+    if not regle or regle.get('type') not in TYPES_REGLE:
+        return None
+    genre = regle['type']
+    if genre == 'numerique':
+        tolerances = {name: float(regle.get(name) or 0) for name in ('tolerance_abs', 'tolerance_rel')}
+        if min(tolerances.values()) < 0:
+            raise ValueError("Les tolérances doivent être positives.")
+        return {'type': genre, **tolerances}
+    if genre == 'date':
+        granularite = regle.get('granularite') or 'seconde'
+        if granularite not in GRANULARITES:
+            raise ValueError(f"Granularité de date inconnue : {granularite}")
+        return {'type': genre, 'granularite': granularite}
+    if genre == 'texte':
+        return {'type': genre, 'ignorer_casse': bool(regle.get('ignorer_casse')),
+                'ignorer_espaces': bool(regle.get('ignorer_espaces'))}
+    return {'type': genre}
+
+
+def decrire_regle(regle: Optional[Dict]) -> str:
+    """Readable form of a rule, for the result pages"""
+    if not regle:
+        return ''
+    genre = regle['type']
+    if genre == 'numerique':
+        parts = []
+        if regle['tolerance_abs']:
+            parts.append(f"± {regle['tolerance_abs']:g}")
+        if regle['tolerance_rel']:
+            parts.append(f"± {regle['tolerance_rel'] * 100:g} %")
+        return f"numérique {' ou '.join(parts)}".strip()
+    if genre == 'date':
+        return f"date à la {regle['granularite']}" if regle['granularite'] != 'jour' else "date au jour"
+    if genre == 'texte':
+        options = [label for key, label in (('ignorer_casse', 'sans casse'),
+                                            ('ignorer_espaces', 'sans espaces superflus')) if regle[key]]
+        return f"texte {', '.join(options)}".strip()
+    return 'ignorée'
+
+
+def regles_projet(projet_id: Optional[int]) -> Dict[str, Dict]:
+    """Saved rules of a project, by file 1 column"""
+    if not projet_id:
+        return {}
+    from app.models import RegleComparaison
+    return {regle.colonne: normaliser_regle({'type': regle.type, 'tolerance_abs': regle.tolerance_abs,
+                                             'tolerance_rel': regle.tolerance_rel,
+                                             'granularite': regle.granularite,
+                                             'ignorer_casse': regle.ignorer_casse,
+                                             'ignorer_espaces': regle.ignorer_espaces})
+            for regle in RegleComparaison.query.filter_by(projet_id=projet_id).all()}
+
+
+def enregistrer_regles(projet_id: int, regles: Dict[str, Dict]) -> None:
+    """Replace the saved rules of a project (added to the session, committed by the caller)"""
+    from app import db
+    from app.models import RegleComparaison
+    RegleComparaison.query.filter_by(projet_id=projet_id).delete()
+    db.session.add_all([RegleComparaison(projet_id=projet_id, colonne=colonne, **regle)
+                        for colonne, regle in regles.items()])
+
+
+def _texte(series: pd.Series, colonne: str, regle: Dict) -> pd.Series:
+    """Normalized text of a column, with whitespace runs collapsed and case folded if the rule says so"""
+    text = normaliser_valeurs(series)
+    if regle.get('ignorer_espaces'):
+        text = text.str.replace(r'\s+', ' ', regex=True).str.strip()
+    if regle.get('ignorer_casse'):
+        text = text.str.casefold()
+    return text
+
+
+def _dates(series: pd.Series, granularite: str) -> np.ndarray:
+    """Dates of a column as int64 counts of the granularity unit (unparsed values -> _NAT)"""
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        parsed = series
+    else:
+        date_format = deviner_format_date(series)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            parsed = pd.to_datetime(series.astype(object), errors='coerce', format=date_format,
+                                    dayfirst=date_format is None)
+    values = parsed.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    return np.where(values == _NAT, _NAT, values // GRANULARITES[granularite])
+
+
+def _differe_texte(x: pd.Series, y: pd.Series, colonne: str) -> np.ndarray:
+    return normaliser_valeurs(x).to_numpy() != normaliser_valeurs(y).to_numpy()
+
+
+def compiler_predicat(regle: Optional[Dict]) -> Callable[[pd.Series, pd.Series, str], np.ndarray]:
+    """
+    Compile a rule into a vectorized predicate (values of file 1, values of file 2, column) -> boolean
+    array of the values that differ. Without a rule, values differ when their normalized texts differ.
+    Values that do not parse under a numeric or date rule are compared as normalized texts.
+    """
+    if regle is None:
+        return _differe_texte
+    genre = regle['type']
+
+    if genre == 'ignorer':
+        return lambda x, y, colonne: np.zeros(len(x), dtype=bool)
+
+    if genre == 'texte':
+        return lambda x, y, colonne: _texte(x, colonne, regle).to_numpy() != _texte(y, colonne, regle).to_numpy()
+
+    if genre == 'numerique':
+        tolerance_abs, tolerance_rel = regle['tolerance_abs'], regle['tolerance_rel']
+
+        def differe_nombres(x: pd.Series, y: pd.Series, colonne: str) -> np.ndarray:
+            a = valeurs_numeriques(x).to_numpy()
+            b = valeurs_numeriques(y).to_numpy()
+            with np.errstate(invalid='ignore'):
+                scale = np.maximum(np.abs(a), np.abs(b))
+                # NaN on either side compares False: a value against a non-number differs
+                differs = ~(np.abs(a - b) <= np.maximum(tolerance_abs, tolerance_rel * scale) + _EPSILON * scale)
+            texts = np.isnan(a) & np.isnan(b)
+            if texts.any():
+                differs[texts] = _differe_texte(x[texts], y[texts], colonne)
+            return differs
+
+        return differe_nombres
+
+    granularite = regle['granularite']
+
+    def differe_dates(x: pd.Series, y: pd.Series, colonne: str) -> np.ndarray:
+        a = _dates(x, granularite)
+        b = _dates(y, granularite)
+        differs = a != b
+        texts = (a == _NAT) & (b == _NAT)
+        if texts.any():
+            differs[texts] = _differe_texte(x[texts], y[texts], colonne)
+        return differs
+
+    return differe_dates
+
+
+def compiler_canonique(regle: Optional[Dict]) -> Optional[Callable[[pd.Series, str], np.ndarray]]:
+    """
+    Compile a rule into the canonical values hashed by the row fingerprints (None: column left out).
+    Numeric tolerances cannot be made canonical: such columns keep their normalized text and the
+    rows whose fingerprints differ are settled by the predicate.
+    """
+    if regle is None or regle['type'] == 'numerique':
+        return lambda series, colonne: normaliser_valeurs(series).to_numpy(dtype=object)
+    genre = regle['type']
+    if genre == 'ignorer':
+        return None
+    if genre == 'texte':
+        return lambda series, colonne: _texte(series, colonne, regle).to_numpy(dtype=object)
+
+    def canonique_dates(series: pd.Series, colonne: str) -> np.ndarray:
+        values = _dates(series, regle['granularite'])
+        result = values.astype(str).astype(object)
+        unparsed = values == _NAT
+        result[unparsed] = normaliser_valeurs(series[unparsed]).to_numpy(dtype=object)
+        return result
+
+    return canonique_dates
+
+
+@lru_cache(maxsize=256)
+def _compiler_json(regle_json: str):
+    regle = json.loads(regle_json)
+    return compiler_predicat(regle), compiler_canonique(regle)
+
+
+def compiler(regle: Optional[Dict]):
+    """(predicate, canonical form) of a rule, compiled once per distinct rule"""
+    return _compiler_json(json.dumps(regle, sort_keys=True))
+
+
+class MoteurRegles:
+    """
+    Rules of the compared columns, compiled once and applied chunk by chunk.
+
+    Args:
+        colonnes: Compared columns, under their file 1 names (_x / _y suffixed in the merged rows)
+        regles: Rules by file 1 column (columns without a rule compare their normalized texts)
+    """
+
+    def __init__(self, colonnes: List[str], regles: Optional[Dict[str, Dict]] = None):
+        self.colonnes = list(colonnes)
+        self.regles = regles_colonnes(self.colonnes, regles)
+        self._predicats = [compiler(regle)[0] for regle in self.regles]
+
+    def differences(self, rows: pd.DataFrame) -> np.ndarray:
+        """Boolean matrix (rows x compared columns): values that differ under the rule of their column"""
+        matrix = np.zeros((len(rows), len(self.colonnes)), dtype=bool)
+        for position, (col, predicat) in enumerate(zip(self.colonnes, self._predicats)):
+            matrix[:, position] = predicat(rows[f"{col}_x"].reset_index(drop=True),
+                                           rows[f"{col}_y"].reset_index(drop=True), col)
+        return matrix
+
+
+def regles_colonnes(colonnes: List[str], regles: Optional[Dict[str, Dict]] = None) -> List[Optional[Dict]]:
+    """Canonical rule of each column, in the order of the columns (None = no rule)"""
+    regles = regles or {}
+    return [normaliser_regle(regles.get(col)) for col in colonnes]
@@ -0,0 +1,172 @@
+"""
+Content-addressable storage: each uploaded source file is stored once under its SHA-256
+and projects reference it through links
+"""
+import glob
+import hashlib
+import os
+import shutil
+from typing import List, Optional
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models.blobs import BlobSource, ReferenceBlob
+from app.utils.compression import split_file_name
+
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of a file, read by blocks"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def save_upload_with_hash(file_storage, dest_path: str, profileur=None) -> str:
+    """
+    Save an uploaded file (werkzeug FileStorage) while hashing it, returns the SHA-256.
+    With a ProfileurFlux of dest_path, each block is also profiled (line index, key sketches).
+    """
+    sha256 = hashlib.sha256()
+    with open(dest_path, 'wb') as f:
+        while True:
+            block = file_storage.stream.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            sha256.update(block)
+            f.write(block)
+            if profileur is not None:
+                profileur.feed(block)
+    return sha256.hexdigest()
+
+
+def get_blob_path(sha256: str, original_name: str) -> str:
+    """uploads/blobs/<sha[:2]>/<sha>/data<ext> (the extension keeps the format detectable)"""
+    _, ext = split_file_name(original_name)
+    folder = current_app.config.get('BLOB_FOLDER', 'uploads/blobs')
+    return os.path.join(folder, sha256[:2], sha256, f"data{ext.lower()}")
+
+
+def _move_sidecars(temp_path: str, blob_path: Optional[str]):
+    """
+    Move the sidecars already built for temp_path (profile, line index of a chunked upload) next to the blob,
+    or drop them when the content was deduplicated (blob_path None: the stored blob has its own)
+    """
+    prefix = os.path.realpath(temp_path)
+    for sidecar in glob.glob(f"{glob.escape(prefix)}.*"):
+        if blob_path is None:
+            os.remove(sidecar)
+        else:
+            os.replace(sidecar, f"{blob_path}{sidecar[len(prefix):]}")
+
+
+def store_file(temp_path: str, original_name: str, sha256: Optional[str] = None) -> BlobSource:
+    """
+    Move a file into the blob store, or drop it if the same content is already stored.
+
+    Args:
+        temp_path: Complete file to store (moved or removed, with its sidecars)
+        original_name: Uploaded file name (used for the extension)
+        sha256: Content hash if already computed while receiving the file
+
+    Returns:
+        BlobSource: The blob holding this content
+    """
+    sha256 = sha256 or hash_file(temp_path)
+    blob = BlobSource.query.filter_by(sha256=sha256).first()
+
+    if blob is not None and os.path.exists(blob.chemin):
+        _move_sidecars(temp_path, None)
+        os.remove(temp_path)
+        print(f"♻️ Contenu déjà stocké ({sha256[:12]}), fichier dédupliqué")
+        return blob
+
+    blob_path = get_blob_path(sha256, original_name)
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    # Sidecars stay valid: the move keeps the size and modification time of the file
+    _move_sidecars(temp_path, blob_path)
+    os.replace(temp_path, blob_path)
+
+    if blob is None:
+        blob = BlobSource(sha256=sha256, taille=os.path.getsize(blob_path),
+                          chemin=blob_path, nom_origine=original_name)
+        db.session.add(blob)
+    else:
+        # Blob row left without its file: restore it
+        blob.chemin = blob_path
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The same content was stored by a concurrent upload between the lookup and the insert: keep its blob
+        db.session.rollback()
+        blob = BlobSource.query.filter_by(sha256=sha256).one()
+        if os.path.realpath(blob.chemin) != os.path.realpath(blob_path):
+            _move_sidecars(blob_path, None)
+            os.remove(blob_path)
+        print(f"♻️ Contenu stocké en parallèle ({sha256[:12]}), fichier dédupliqué")
+    return blob
+
+
+def _create_link(blob_path: str, link_path: str) -> str:
+    """Link link_path to the blob: symlink, else hard link, else copy"""
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    try:
+        # Symlinks keep a single real path, so sidecar caches (profile, indexes) are shared
+        os.symlink(os.path.abspath(blob_path), link_path)
+        return 'symlink'
+    except (OSError, NotImplementedError):
+        pass
+    try:
+        os.link(blob_path, link_path)
+        return 'hardlink'
+    except OSError:
+        shutil.copyfile(blob_path, link_path)
+        return 'copy'
+
+
+def link_to_project(blob: BlobSource, projet, link_path: str) -> ReferenceBlob:
+    """Expose the blob at link_path in the project folder and record the reference"""
+    link_type = _create_link(blob.chemin, link_path)
+    reference = ReferenceBlob(blob_id=blob.id, projet_id=projet.id, chemin_lien=link_path)
+    db.session.add(reference)
+    db.session.commit()
+    print(f"🔗 {link_path} -> blob {blob.sha256[:12]} ({link_type})")
+    return reference
+
+
+def release_project_blobs(projet) -> List[str]:
+    """
+    Remove the project's links and the blobs no longer referenced by any project.
+
+    Returns:
+        List[str]: Paths removed from disk
+    """
+    deleted = []
+    for reference in list(projet.blob_references):
+        blob = reference.blob
+        if os.path.lexists(reference.chemin_lien):
+            os.remove(reference.chemin_lien)
+            deleted.append(reference.chemin_lien)
+        db.session.delete(reference)
+        db.session.flush()
+
+        remaining = ReferenceBlob.query.filter_by(blob_id=blob.id).count()
+        if remaining == 0:
+            blob_folder = os.path.dirname(blob.chemin)
+            if os.path.isdir(blob_folder):
+                # The blob folder also holds its shared sidecars
+                shutil.rmtree(blob_folder)
+                deleted.append(blob_folder)
+            db.session.delete(blob)
+        else:
+            print(f"♻️ Blob {blob.sha256[:12]} conservé ({remaining} référence(s))")
+
+    db.session.commit()
+    return deleted
@@ -0,0 +1,180 @@
+"""
+Breakdown of the discrepancies by dimension columns (category, entity, region...), computed while the
+rows are classified: rows only in file 1, only in file 2 and modified matched rows are counted per
+dimension value, chunk by chunk, with the mismatch rate of each compared column.
+
+Memory is bounded by a space-saving summary per dimension: only the `k` values with the most
+discrepancies are kept. A value entering the summary after others were evicted inherits the largest
+evicted count as its error bound (its discrepancies before it entered are not counted), and the rows
+of the evicted values stay in the 'autres' remainder, so the totals are exact.
+"""
+import json
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from app.config import Config
+from app.utils.normalisation_cles import normaliser_colonne
+
+# Counted rows per dimension value
+MESURES_ECARTS = ('uniquement_fichier1', 'uniquement_fichier2', 'modifiees')
+MESURES = MESURES_ECARTS + ('communs',)
+# Merge buckets counted by each measure
+BUCKETS = {'uniquement_fichier1': 'left_only', 'uniquement_fichier2': 'right_only', 'communs': 'both'}
+# Compared columns listed with their mismatch rate for each dimension value
+COLONNES_PAR_VALEUR = 5
+
+
+def colonnes_dimensions(dimensions: Optional[List[str]], column_mapping: Optional[Dict[str, str]] = None):
+    """
+    Dimension columns of each file: dimensions are chosen among the file 1 columns, their file 2
+    counterpart is the column aligned on them ({colonne2: colonne1}) or the column of the same name
+    """
+    dimensions = list(dimensions or [])
+    aligned = {col1: col2 for col2, col1 in (column_mapping or {}).items()}
+    return dimensions, [aligned.get(dimension, dimension) for dimension in dimensions]
+
+
+def valeurs_dimension(merged: pd.DataFrame, dimension: str) -> pd.Series:
+    """Normalized dimension value of each merged row (file 2 value for the rows only in file 2)"""
+    if f"{dimension}_x" in merged.columns:
+        # object dtype: both sides may be categoricals with different categories
+        values = merged[f"{dimension}_x"].astype(object).where(merged['_merge'].to_numpy() != 'right_only',
+                                                               merged[f"{dimension}_y"].astype(object))
+    elif dimension in merged.columns:
+        values = merged[dimension]
+    else:
+        values = pd.Series('', index=merged.index, dtype=object)
+    return normaliser_colonne(values, dimension)
+
+
+class TopEcarts:
+    """
+    Space-saving summary of one dimension: counts of the `k` values with the most discrepancies.
+
+    Args:
+        dimension: Dimension column (file 1 name)
+        mesures: Counted measures (MESURES, then the compared columns)
+        k: Values kept
+    """
+
+    def __init__(self, dimension: str, mesures: List[str], k: int):
+        self.dimension = dimension
+        self.mesures = list(mesures)
+        self.k = k
+        self.table = pd.DataFrame(columns=self.mesures + ['erreur'], dtype=np.int64)
+        self.totaux = pd.Series(0, index=self.mesures, dtype=np.int64)
+        # Largest discrepancy count of an evicted value: bound of what a value outside the table missed
+        self.seuil = 0
+
+    def _ecarts(self, frame: pd.DataFrame) -> pd.Series:
+        return frame[[mesure for mesure in MESURES_ECARTS if mesure in frame.columns]].sum(axis=1)
+
+    def ajouter(self, groupes: pd.DataFrame):
+        """Counts of one chunk per dimension value (index), merged into the summary"""
+        groupes = groupes.reindex(columns=self.mesures, fill_value=0).astype(np.int64)
+        self.totaux += groupes.sum()
+        known = groupes.index.isin(self.table.index)
+        table = self.table.add(groupes[known], fill_value=0)
+        table = pd.concat([table, groupes[~known].assign(erreur=self.seuil)]).astype(np.int64)
+        if len(table) > self.k:
+            # Existing values first: on equal scores, newcomers are evicted
+            score = (self._ecarts(table) + table['erreur']).to_numpy()
+            order = np.argsort(-score, kind='stable')
+            self.seuil = max(self.seuil, int(score[order[self.k:]].max()))
+            table = table.iloc[order[:self.k]]
+        self.table = table
+
+    def resultat(self) -> Dict:
+        """Tracked values sorted by discrepancies, the remainder and the error bound (JSON serializable)"""
+        table = self.table.copy()
+        table['total_ecarts'] = self._ecarts(table)
+        table = table[table['total_ecarts'] > 0].sort_values('total_ecarts', ascending=False, kind='stable')
+        colonnes = [mesure for mesure in self.mesures if mesure not in MESURES]
+        valeurs = []
+        for valeur, row in table.iterrows():
+            lignes = int(row['uniquement_fichier1'] + row['uniquement_fichier2'] + row['communs'])
+            item = {'valeur': valeur, 'total_ecarts': int(row['total_ecarts']), 'erreur': int(row['erreur']),
+                    'pct_ecarts': round(row['total_ecarts'] / lignes * 100, 2) if lignes else 0,
+                    **{mesure: int(row[mesure]) for mesure in MESURES if mesure in row.index}}
+            if colonnes:
+                # Mismatch rate of the compared columns among the matched rows of this value
+                par_colonne = sorted(((col, int(row[col])) for col in colonnes if row[col]), key=lambda c: -c[1])
+                item['par_colonne'] = [{'colonne': col, 'n_ecarts': count,
+                                        'pct': round(count / row['communs'] * 100, 2) if row['communs'] else 0}
+                                       for col, count in par_colonne[:COLONNES_PAR_VALEUR]]
+            valeurs.append(item)
+        autres = self.totaux - self.table[self.mesures].sum()
+        return {'dimension': self.dimension, 'k': self.k, 'seuil': self.seuil, 'valeurs': valeurs,
+                'autres': {mesure: int(autres[mesure]) for mesure in MESURES if mesure in autres.index}}
+
+
+class VentilationEcarts:
+    """
+    Discrepancy breakdown of a comparison by dimension columns, fed chunk by chunk.
+
+    Args:
+        dimensions: Dimension columns (file 1 names; file 2 columns renamed after them)
+        colonnes: Compared columns of the value diff (None when values are not compared: no modified rows)
+        k: Values kept per dimension (Config.BREAKDOWN_TOP_K by default)
+    """
+
+    def __init__(self, dimensions: List[str], colonnes: Optional[List[str]] = None, k: Optional[int] = None):
+        self.colonnes = list(colonnes) if colonnes is not None else None
+        if self.colonnes is None:
+            mesures = [mesure for mesure in MESURES if mesure != 'modifiees']
+        else:
+            mesures = list(MESURES) + self.colonnes
+        k = k or Config.BREAKDOWN_TOP_K
+        self.dimensions = {dimension: TopEcarts(dimension, mesures, k) for dimension in dimensions}
+
+    def ajouter(self, merged: pd.DataFrame, differences: Optional[np.ndarray] = None, compter_lignes: bool = True):
+        """
+        Rows of an outer merge with indicator.
+
+        Args:
+            differences: Value diff of the matched rows (matched rows x compared columns, see DiffValeurs.ajouter)
+            compter_lignes: Count the rows per bucket (False when only the modified rows are given, the bucket
+                            counts coming from elsewhere)
+        """
+        if not self.dimensions or merged.empty or (not compter_lignes and self.colonnes is None):
+            return
+        etat = merged['_merge'].astype(str).to_numpy()
+        mesures = pd.DataFrame(index=merged.index)
+        if compter_lignes:
+            for mesure, bucket in BUCKETS.items():
+                mesures[mesure] = etat == bucket
+        if self.colonnes is not None:
+            matrix = np.zeros((len(merged), len(self.colonnes)), dtype=bool)
+            if differences is not None:
+                matrix[etat == 'both'] = differences
+            mesures['modifiees'] = matrix.any(axis=1)
+            for position, col in enumerate(self.colonnes):
+                mesures[col] = matrix[:, position]
+        for dimension, top in self.dimensions.items():
+            top.ajouter(mesures.groupby(valeurs_dimension(merged, dimension).to_numpy(), sort=False).sum())
+
+    def ajouter_groupes(self, dimension: str, mesure: str, valeurs: List, comptes: List[int]):
+        """Row counts of one measure already grouped by raw dimension value (SQL GROUP BY)"""
+        values = normaliser_colonne(pd.Series(valeurs, dtype=object), dimension)
+        groupes = pd.Series(comptes, dtype=np.int64).groupby(values.to_numpy(), sort=False).sum()
+        self.dimensions[dimension].ajouter(groupes.to_frame(mesure))
+
+    def resultat(self, fraction: Optional[float] = None) -> Dict:
+        """
+        Breakdown of every dimension (JSON serializable).
+
+        Args:
+            fraction: Share of the keys compared (approximate mode): counts are those of the sample
+        """
+        return {'dimensions': [top.resultat() for top in self.dimensions.values()],
+                'valeurs_comparees': self.colonnes is not None, 'fraction': fraction}
+
+
+def charger_ventilation(stat) -> Optional[Dict]:
+    """Breakdown saved with a comparison run, or None"""
+    if not getattr(stat, 'ventilation', None):
+        return None
+    try:
+        return json.loads(stat.ventilation)
+    except ValueError:
+        return None
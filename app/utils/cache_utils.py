@@ -0,0 +1,54 @@
+"""
+Utilitaires pour les fichiers annexes (index, profils, caches) associés aux fichiers sources
+"""
+import json
+import os
+from typing import Optional
+
+
+def get_sidecar_path(file_path: str, suffix: str) -> str:
+    """
+    Retourne le chemin du fichier annexe d'un fichier source
+
+    Le chemin réel est utilisé (liens symboliques résolus) afin que plusieurs
+    chemins pointant vers le même contenu partagent les mêmes fichiers annexes.
+
+    Args:
+        file_path: Chemin du fichier source
+        suffix: Suffixe du fichier annexe (ex: 'lines.idx')
+
+    Returns:
+        str: Chemin '<fichier source réel>.<suffix>'
+    """
+    return f"{os.path.realpath(file_path)}.{suffix}"
+
+
+def get_file_signature(file_path: str) -> tuple:
+    """Retourne (taille, mtime en ns) du fichier pour valider un fichier annexe"""
+    stat = os.stat(os.path.realpath(file_path))
+    return stat.st_size, stat.st_mtime_ns
+
+
+def save_json_sidecar(file_path: str, suffix: str, data: dict):
+    """Enregistre un fichier annexe JSON, associé à la signature du fichier source"""
+    size, mtime_ns = get_file_signature(file_path)
+    sidecar_path = get_sidecar_path(file_path, suffix)
+    tmp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'size': size, 'mtime_ns': mtime_ns, 'data': data}, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, sidecar_path)
+
+
+def load_json_sidecar(file_path: str, suffix: str) -> Optional[dict]:
+    """Charge un fichier annexe JSON, ou None s'il est absent ou ne correspond plus au fichier source"""
+    sidecar_path = get_sidecar_path(file_path, suffix)
+    if not os.path.exists(sidecar_path):
+        return None
+    try:
+        with open(sidecar_path, 'r', encoding='utf-8') as f:
+            content = json.load(f)
+        if (content.get('size'), content.get('mtime_ns')) != get_file_signature(file_path):
+            return None
+        return content.get('data')
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,123 @@
+"""
+Utilitaires pour la lecture transparente des fichiers compressés (.gz, .bz2, .xz, .zip)
+"""
+import bz2
+import gzip
+import io
+import lzma
+import os
+import zipfile
+import zlib
+from typing import Optional, Tuple
+
+# Extension de compression -> valeur du paramètre `compression` de pandas
+COMPRESSION_EXTENSIONS = {
+    'gz': 'gzip',
+    'bz2': 'bz2',
+    'xz': 'xz',
+    'zip': 'zip',
+}
+
+# Formats acceptés à l'intérieur d'un fichier compressé (Excel est déjà compressé)
+COMPRESSIBLE_FORMATS = ('csv', 'json')
+
+
+def split_file_name(filename: str) -> Tuple[str, str]:
+    """
+    Sépare le nom de fichier et son extension complète, compression incluse
+
+    Exemple : 'extrait.csv.gz' -> ('extrait', '.csv.gz')
+    """
+    root, ext = os.path.splitext(filename)
+    if ext.lower().lstrip('.') in COMPRESSION_EXTENSIONS:
+        inner_root, inner_ext = os.path.splitext(root)
+        if inner_ext:
+            return inner_root, inner_ext + ext
+    return root, ext
+
+
+def get_compression(file_path: str) -> Optional[str]:
+    """Retourne le type de compression ('gzip', 'bz2', 'xz', 'zip') ou None"""
+    return COMPRESSION_EXTENSIONS.get(file_path.rsplit('.', 1)[-1].lower())
+
+
+def _get_zip_member(file_path: str) -> zipfile.ZipInfo:
+    """Retourne l'unique fichier d'une archive zip"""
+    with zipfile.ZipFile(file_path) as archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+    if len(members) != 1:
+        raise ValueError(f"L'archive zip doit contenir un seul fichier ({len(members)} trouvés)")
+    return members[0]
+
+
+def get_file_extension(file_path: str) -> str:
+    """
+    Retourne l'extension du format des données, en ignorant la compression
+
+    Exemples : 'a.csv' -> 'csv', 'a.csv.gz' -> 'csv', 'a.zip' -> extension du fichier de l'archive
+    """
+    compression = get_compression(file_path)
+    if compression is None:
+        return file_path.rsplit('.', 1)[-1].lower()
+
+    if compression == 'zip' and os.path.exists(file_path):
+        inner_name = _get_zip_member(file_path).filename
+    else:
+        inner_name = file_path[:file_path.rfind('.')]
+    ext = inner_name.rsplit('.', 1)[-1].lower() if '.' in os.path.basename(inner_name) else ''
+
+    if ext not in COMPRESSIBLE_FORMATS:
+        raise ValueError(f"Type de fichier compressé non supporté: {os.path.basename(file_path)}")
+    return ext
+
+
+def open_binary(file_path: str):
+    """Ouvre le fichier en lecture binaire, avec décompression à la volée si nécessaire"""
+    compression = get_compression(file_path)
+    if compression == 'gzip':
+        return gzip.open(file_path, 'rb')
+    if compression == 'bz2':
+        return bz2.open(file_path, 'rb')
+    if compression == 'xz':
+        return lzma.open(file_path, 'rb')
+    if compression == 'zip':
+        # Le fichier sous-jacent reste ouvert tant que le membre n'est pas fermé
+        with zipfile.ZipFile(file_path) as archive:
+            return archive.open(_get_zip_member(file_path))
+    return open(file_path, 'rb')
+
+
+def open_text(file_path: str, encoding: str = 'utf-8', errors: str = 'strict'):
+    """Ouvre le fichier en lecture texte, avec décompression à la volée si nécessaire"""
+    if get_compression(file_path) is None:
+        return open(file_path, 'r', encoding=encoding, errors=errors)
+    return io.TextIOWrapper(open_binary(file_path), encoding=encoding, errors=errors)
+
+
+class DecompresseurFlux:
+    """Décompression incrémentale d'un flux reçu par morceaux (gzip, bz2, xz ; flux multiples inclus)"""
+    
+    def __init__(self, compression: str):
+        if compression not in ('gzip', 'bz2', 'xz'):
+            raise ValueError(f"Décompression incrémentale non supportée: {compression}")
+        self.compression = compression
+        self._decompressor = self._new_decompressor()
+    
+    def _new_decompressor(self):
+        if self.compression == 'gzip':
+            return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        if self.compression == 'bz2':
+            return bz2.BZ2Decompressor()
+        return lzma.LZMADecompressor()
+    
+    def decompress(self, block: bytes) -> bytes:
+        """Décompresse un morceau et retourne les octets disponibles"""
+        output = []
+        while block:
+            output.append(self._decompressor.decompress(block))
+            if not self._decompressor.eof:
+                break
+            # Fin d'un flux : les octets restants appartiennent au flux suivant
+            block = self._decompressor.unused_data
+            self._decompressor = self._new_decompressor()
+        return b''.join(output)
@@ -1,38 +1,164 @@
 """
 Utilitaires pour la gestion des encodages de fichiers
 """
+import codecs
 import pandas as pd
+from chardet.universaldetector import UniversalDetector
+from app.utils.string_storage import get_string_dtype, to_string_storage
+from app.utils.compression import get_file_extension, open_binary, open_text
+
+# Nombre maximal d'octets lus pour détecter l'encodage
+DETECTION_MAX_BYTES = 1024 * 1024
+DETECTION_BLOCK_SIZE = 64 * 1024
+
+# Les BOM UTF-32 doivent être testés avant UTF-16 (même préfixe)
+_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+
+class DetecteurEncodage:
+    """
+    Détecteur d'encodage incrémental, alimenté bloc par bloc (fichier lu ou upload en cours)
+    
+    Ordre de détection : BOM, puis validité UTF-8 (décodeur incrémental),
+    puis détecteur chardet incrémental sur les blocs qui ne sont pas de l'UTF-8.
+    Au-delà de max_bytes octets, les blocs sont ignorés.
+    """
+    
+    def __init__(self, max_bytes: int = DETECTION_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.bom_encoding = None
+        self._head = b''
+        self._utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._detector = UniversalDetector()
+        self._utf8_valid = True
+        self._non_ascii = False
+        self._fed_blocks = []
+    
+    @property
+    def done(self) -> bool:
+        """True quand les blocs suivants ne changeront plus le résultat"""
+        return (self.bom_encoding is not None or self.bytes_read >= self.max_bytes
+                or (not self._utf8_valid and self._detector.done))
+    
+    def feed(self, block: bytes):
+        """Analyse un bloc d'octets"""
+        if self.done or not block:
+            return
+        block = block[:self.max_bytes - self.bytes_read]
+        
+        # Le BOM se lit sur les 4 premiers octets
+        if len(self._head) < 4 and self.bytes_read == len(self._head):
+            self._head += block[:4 - len(self._head)]
+            for bom, encoding in _BOMS:
+                if self._head.startswith(bom):
+                    self.bom_encoding = encoding
+                    self.bytes_read += len(block)
+                    return
+        
+        self.bytes_read += len(block)
+        self._non_ascii = self._non_ascii or not block.isascii()
+        
+        if self._utf8_valid:
+            try:
+                self._utf8_decoder.decode(block)
+            except UnicodeDecodeError:
+                self._utf8_valid = False
+        
+        # chardet n'est alimenté qu'une fois le contenu identifié comme non UTF-8
+        if not self._utf8_valid:
+            self._detector.feed(block)
+            self._fed_blocks.append(block)
+    
+    def result(self, reached_eof: bool = False) -> dict:
+        """
+        Retourne le résultat de la détection
+        
+        Args:
+            reached_eof: True si tout le contenu a été analysé
+            
+        Returns:
+            dict: {'encoding': str, 'confidence': float, 'bytes_read': int}
+        """
+        if self.bom_encoding is not None:
+            return {'encoding': self.bom_encoding, 'confidence': 1.0, 'bytes_read': self.bytes_read}
+        
+        utf8_valid = self._utf8_valid
+        if utf8_valid:
+            if reached_eof and self.bytes_read < self.max_bytes:
+                try:
+                    self._utf8_decoder.decode(b'', final=True)
+                    return {'encoding': 'utf-8', 'confidence': 1.0, 'bytes_read': self.bytes_read}
+                except UnicodeDecodeError:
+                    utf8_valid = False
+            else:
+                # Seul l'échantillon a été validé : moins sûr s'il ne contenait que de l'ASCII
+                return {'encoding': 'utf-8', 'confidence': 0.99 if self._non_ascii else 0.8,
+                        'bytes_read': self.bytes_read}
+        
+        self._detector.close()
+        encoding = (self._detector.result.get('encoding') or '').lower()
+        confidence = self._detector.result.get('confidence') or 0.0
+        
+        if encoding in ('', 'ascii', 'utf-8'):
+            encoding = None
+        else:
+            # Vérifier que l'encodage proposé décode bien les octets analysés
+            try:
+                b''.join(self._fed_blocks).decode(encoding)
+            except (UnicodeDecodeError, LookupError):
+                encoding = None
+        
+        if encoding is None:
+            # latin-1 décode n'importe quel octet
+            return {'encoding': 'latin-1', 'confidence': 0.0, 'bytes_read': self.bytes_read}
+        return {'encoding': encoding, 'confidence': confidence, 'bytes_read': self.bytes_read}
+
+
+def detect_file_encoding(file_path: str, max_bytes: int = DETECTION_MAX_BYTES) -> dict:
+    """
+    Détecte l'encodage d'un fichier en lisant au plus max_bytes octets, par blocs
+    (voir DetecteurEncodage)
+    
+    Args:
+        file_path: Chemin vers le fichier
+        max_bytes: Nombre maximal d'octets à lire
+        
+    Returns:
+        dict: {'encoding': str, 'confidence': float, 'bytes_read': int}
+    """
+    detecteur = DetecteurEncodage(max_bytes)
+    reached_eof = False
+    
+    # Les fichiers compressés sont analysés sur leur contenu décompressé
+    with open_binary(file_path) as f:
+        while not detecteur.done:
+            block = f.read(min(DETECTION_BLOCK_SIZE, max_bytes - detecteur.bytes_read))
+            if not block:
+                reached_eof = True
+                break
+            detecteur.feed(block)
+    
+    return detecteur.result(reached_eof)
 
 
 def detect_csv_encoding(file_path: str) -> str:
     """
-    Détecte l'encodage d'un fichier CSV en testant plusieurs encodages courants
+    Détecte l'encodage d'un fichier CSV (voir detect_file_encoding)
     
     Args:
         file_path: Chemin vers le fichier CSV
         
     Returns:
         str: L'encodage détecté
-        
-    Raises:
-        ValueError: Si aucun encodage ne fonctionne
     """
-    encodings_to_try = ['utf-8', 'latin-1', 'windows-1252', 'iso-8859-1', 'cp1252']
-    
-    for encoding in encodings_to_try:
-        try:
-            # Test en lisant quelques lignes avec paramètres robustes
-            pd.read_csv(file_path, nrows=5, encoding=encoding, 
-                       on_bad_lines='skip', engine='python')
-            return encoding
-        except UnicodeDecodeError:
-            continue
-        except Exception as e:
-            # Si ce n'est pas une erreur d'encodage, on continue d'essayer
-            if "codec can't decode" not in str(e) and "tokenizing data" not in str(e):
-                continue
-    
-    raise ValueError(f"Impossible de détecter l'encodage du fichier {file_path}")
+    return detect_file_encoding(file_path)['encoding']
 
 
 def safe_read_csv(file_path: str, **kwargs) -> pd.DataFrame:
@@ -59,7 +185,7 @@ def safe_read_csv(file_path: str, **kwargs) -> pd.DataFrame:
         'engine': 'python',     # Utiliser le parser Python (plus flexible)
         'quoting': 1,           # QUOTE_ALL - traiter les guillemets
         'skipinitialspace': True,  # Ignorer les espaces après les délimiteurs
-        'dtype': str,           # Lire toutes les colonnes comme string pour éviter les erreurs de type
+        'dtype': get_string_dtype(),  # Lire toutes les colonnes comme string (object ou string[pyarrow] selon STRING_STORAGE)
     }
     
     # Fusionner avec les paramètres fournis
@@ -92,7 +218,7 @@ def safe_read_csv(file_path: str, **kwargs) -> pd.DataFrame:
                 'engine': 'python',
                 'sep': None,  # Laisser pandas deviner le séparateur
                 'header': 'infer',
-                'dtype': str,
+                'dtype': final_params['dtype'],
                 'error_bad_lines': False,  # Pour compatibilité
                 'warn_bad_lines': False
             }
@@ -120,7 +246,7 @@ def _read_csv_line_by_line(file_path: str, encoding: str) -> pd.DataFrame:
     headers = None
     expected_cols = None
     
-    with open(file_path, 'r', encoding=encoding) as f:
+    with open_text(file_path, encoding=encoding) as f:
         # Détecter le dialecte CSV
         sample = f.read(1024)
         f.seek(0)
@@ -154,15 +280,16 @@ def _read_csv_line_by_line(file_path: str, encoding: str) -> pd.DataFrame:
     if not rows:
         raise ValueError("Fichier CSV vide ou illisible")
     
-    df = pd.DataFrame(rows[1:], columns=rows[0])
+    df = to_string_storage(pd.DataFrame(rows[1:], columns=rows[0]))
     print(f"Lecture ligne par ligne réussie: {len(df)} lignes, {len(df.columns)} colonnes")
     return df
 
 
 def safe_read_file(file_path: str, **kwargs) -> pd.DataFrame:
     """
-    Lecture sécurisée d'un fichier (CSV ou Excel) avec gestion automatique des encodages
-    et des erreurs de parsing
+    Lecture sécurisée d'un fichier (CSV, Excel ou JSON) avec gestion automatique des encodages
+    et des erreurs de parsing. Les CSV/JSON compressés (.gz, .bz2, .xz, .zip) sont
+    décompressés à la volée par pandas.
     
     Args:
         file_path: Chemin vers le fichier
@@ -171,24 +298,24 @@ def safe_read_file(file_path: str, **kwargs) -> pd.DataFrame:
     Returns:
         pd.DataFrame: Le DataFrame lu
     """
-    ext = file_path.split('.')[-1].lower()
+    ext = get_file_extension(file_path)
     
     if ext == 'csv':
         return safe_read_csv(file_path, **kwargs)
     elif ext in ['xls', 'xlsx']:
         try:
-            return pd.read_excel(file_path, **kwargs)
+            return to_string_storage(pd.read_excel(file_path, **kwargs))
         except Exception as e:
             print(f"Erreur lors de la lecture Excel: {e}")
             # Essayer avec différents engines
             engines = ['openpyxl', 'xlrd']
             for engine in engines:
                 try:
-                    return pd.read_excel(file_path, engine=engine, **kwargs)
+                    return to_string_storage(pd.read_excel(file_path, engine=engine, **kwargs))
                 except Exception:
                     continue
             raise e
     elif ext == 'json':
-        return pd.read_json(file_path, **kwargs)
+        return to_string_storage(pd.read_json(file_path, **kwargs))
     else:
         raise ValueError(f"Type de fichier non supporté: {ext}")
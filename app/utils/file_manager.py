@@ -28,6 +28,10 @@ def delete_project_files(projet, fichier_genere=None):
             failed_deletions.extend(failed)
         else:
             # Full project deletion
+            # Release the project's links to shared source blobs (blobs are removed at refcount zero)
+            from app.services.stockage_contenu import release_project_blobs
+            deleted_files.extend(release_project_blobs(projet))
+            
             # Delete all treatment files first
             for treatment in projet.fichiers:
                 files_to_delete = _get_treatment_files(treatment)
@@ -43,6 +47,12 @@ def delete_project_files(projet, fichier_genere=None):
             deleted_files.extend(deleted)
             failed_deletions.extend(failed)
             
+            # Delete the key hash snapshots of the project's comparison runs
+            snapshot_folder = os.path.join(current_app.config.get('SNAPSHOT_FOLDER', 'uploads/snapshots'), str(projet.id))
+            if os.path.isdir(snapshot_folder):
+                shutil.rmtree(snapshot_folder)
+                deleted_files.append(snapshot_folder)
+            
             # Delete project archive directory if it exists and is empty
             if projet.emplacement_archive:
                 _cleanup_empty_directories(projet.emplacement_archive)
@@ -0,0 +1,165 @@
+"""
+Normalisation déclarative des colonnes de clé, appliquée colonne par colonne avant la construction
+de la clé composite et son hachage.
+
+Les fichiers sont lus en texte brut quelle que soit la stratégie (safe_read_csv, lecteur parallèle,
+aller-retour JSON du petit chemin relu sans inférence de types) ; la forme canonique absorbe les écarts
+d'écriture restants (espaces, accents composés, casse, zéros initiaux) selon les règles de chaque colonne.
+
+Règles disponibles par colonne :
+    trim      supprime les espaces en début et fin de valeur
+    nfc       normalisation Unicode NFC (accents composés / décomposés)
+    casefold  ignore la casse
+    zeros     supprime les zéros initiaux des valeurs alphanumériques ('000A12' -> 'A12')
+    numeric   écriture canonique des nombres ('1', '1.0', ' 001 ' -> '1' ; '1.50' -> '1.5'), désactivée par
+              défaut : les identifiants texte à zéros initiaux (codes postaux, SIREN, comptes) restent distincts
+    date      format strptime des dates texte (ex: '%d/%m/%Y'), réécrites en 'AAAA-MM-JJ'
+    null      valeur des cellules vides ou manquantes dans la clé
+"""
+import hashlib
+import json
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from app.config import Config
+
+# Règle appliquée à toute colonne de clé sans règle explicite ('numeric' s'active colonne par colonne)
+REGLE_PAR_DEFAUT = {'trim': True, 'nfc': True, 'casefold': False, 'zeros': False,
+                    'numeric': False, 'date': None, 'null': ''}
+# Entiers exactement représentables en float64 ; au-delà (identifiants longs) la valeur reste du texte
+_ENTIER_EXACT = 2 ** 53
+# Version de la forme canonique (fait partie de l'identité des index de clés)
+VERSION_NORMALISATION = 2
+
+
+def _format_nombres(values: np.ndarray) -> np.ndarray:
+    """Écriture canonique de nombres float64 : entiers sans décimale, sinon représentation la plus courte"""
+    result = values.astype(str).astype(object)
+    integral = np.isfinite(values) & (values == np.floor(values)) & (np.abs(values) < _ENTIER_EXACT)
+    result[integral] = values[integral].astype(np.int64).astype(str)
+    return result
+
+
+def _format_dates(values: pd.Series) -> pd.Series:
+    """Dates sans heure en 'AAAA-MM-JJ', sinon 'AAAA-MM-JJ HH:MM:SS'"""
+    values = pd.to_datetime(values)
+    if getattr(values.dt, 'tz', None) is not None:
+        values = values.dt.tz_localize(None)
+    with_time = values.dt.normalize() != values
+    return values.dt.strftime('%Y-%m-%d').where(~with_time, values.dt.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def compiler_regle(regle: Dict) -> Callable[[pd.Series], pd.Series]:
+    """
+    Compile une règle en une fonction vectorisée (Series -> Series de chaînes).
+
+    La règle est résolue une seule fois ; la fonction ne fait ensuite que des opérations
+    pandas/numpy sur la colonne entière, sans boucle Python par ligne.
+    """
+    regle = {**REGLE_PAR_DEFAUT, **(regle or {})}
+    null = regle['null']
+
+    def normaliser(series: pd.Series) -> pd.Series:
+        missing = series.isna().to_numpy()
+        if pd.api.types.is_bool_dtype(series.dtype):
+            text = series.astype(object).where(~missing, None).astype(str)
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            # Entiers exacts (pas de passage par float64)
+            text = series.astype(str)
+        elif pd.api.types.is_numeric_dtype(series.dtype):
+            # Floats inférés par le lecteur ('1' lu comme 1.0) : toujours écrits sous forme canonique
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            text = pd.Series(_format_nombres(values), index=series.index, dtype=object)
+        elif pd.api.types.is_datetime64_any_dtype(series.dtype):
+            text = _format_dates(series)
+        else:
+            text = series.astype(object).where(~missing, '').astype(str)
+            if regle['trim']:
+                text = text.str.strip()
+            # Texte ASCII (cas courant) : NFC sans effet, vérifié en une passe sur la colonne
+            if regle['nfc'] and not ''.join(text.to_numpy()).isascii():
+                text = text.str.normalize('NFC')
+            if regle['date']:
+                parsed = pd.to_datetime(text, format=regle['date'], errors='coerce')
+                text = text.where(parsed.isna(), _format_dates(parsed))
+            if regle['numeric']:
+                # Analyse numérique en C (valeurs non numériques -> NaN), puis réécriture canonique
+                values = pd.to_numeric(text, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                with np.errstate(invalid='ignore'):
+                    numeric = np.isfinite(values) & ~((values == np.floor(values)) & (np.abs(values) >= _ENTIER_EXACT))
+                if numeric.any():
+                    text = text.copy()
+                    text[numeric] = _format_nombres(values[numeric])
+            if regle['zeros']:
+                text = text.str.replace(r'^0+(?=.)', '', regex=True)
+            missing = missing | (text == '').to_numpy()
+        if regle['casefold']:
+            text = text.str.casefold()
+        text = text.astype(object)
+        text[missing] = null
+        return text
+
+    return normaliser
+
+
+@lru_cache(maxsize=256)
+def _compiler_regle_json(regle_json: str) -> Callable[[pd.Series], pd.Series]:
+    return compiler_regle(json.loads(regle_json))
+
+
+@lru_cache(maxsize=8)
+def _regles_configurees(config_json: str) -> Dict[str, Dict]:
+    """Règles de Config.KEY_NORMALIZATION : {"*": {...}, "colonne": {...}}"""
+    if not config_json:
+        return {}
+    try:
+        regles = json.loads(config_json)
+        if not isinstance(regles, dict):
+            raise ValueError("objet JSON attendu")
+        return regles
+    except ValueError as e:
+        print(f"⚠️ KEY_NORMALIZATION invalide ({e}), normalisation par défaut utilisée")
+        return {}
+
+
+def regle_colonne(colonne: str, regles: Optional[Dict[str, Dict]] = None) -> Dict:
+    """Règle effective d'une colonne : défaut, puis règle '*', puis règle de la colonne"""
+    if regles is None:
+        regles = _regles_configurees(Config.KEY_NORMALIZATION)
+    return {**REGLE_PAR_DEFAUT, **regles.get('*', {}), **regles.get(colonne, {})}
+
+
+def normaliser_colonne(series: pd.Series, colonne: str, regles: Optional[Dict[str, Dict]] = None) -> pd.Series:
+    """Forme canonique d'une colonne de clé (règle compilée une fois puis réutilisée à chaque bloc)"""
+    regle = regle_colonne(colonne, regles)
+    return _compiler_regle_json(json.dumps(regle, sort_keys=True))(series)
+
+
+def normaliser_valeurs(series: pd.Series) -> pd.Series:
+    """
+    Forme canonique d'une colonne comparée valeur par valeur : règle par défaut seule, quel que soit le nom
+    de la colonne (les règles de KEY_NORMALIZATION ne s'appliquent qu'aux clés, les valeurs suivent les règles
+    de comparaison du projet)
+    """
+    return _compiler_regle_json(json.dumps(REGLE_PAR_DEFAUT, sort_keys=True))(series)
+
+
+def options_valeurs() -> Dict:
+    """Normalisation des valeurs comparées, pour l'identité des empreintes de lignes"""
+    return {'version': VERSION_NORMALISATION, 'valeurs': REGLE_PAR_DEFAUT}
+
+
+def options_normalisation(key_columns: List[str], regles: Optional[Dict[str, Dict]] = None) -> Dict:
+    """Règles effectives des colonnes d'une clé, pour l'identité des index et esquisses de clés"""
+    return {'version': VERSION_NORMALISATION,
+            'colonnes': {col: regle_colonne(col, regles) for col in key_columns}}
+
+
+def empreinte_regles(regles: Optional[Dict[str, Dict]] = None) -> str:
+    """Empreinte de l'ensemble des règles configurées (données valables pour toutes les colonnes)"""
+    if regles is None:
+        regles = _regles_configurees(Config.KEY_NORMALIZATION)
+    spec = json.dumps({'version': VERSION_NORMALISATION, 'defaut': REGLE_PAR_DEFAUT, 'regles': regles},
+                      sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(spec.encode('utf-8')).hexdigest()[:16]
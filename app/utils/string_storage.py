@@ -0,0 +1,77 @@
+"""
+Utilitaires pour le stockage des colonnes texte des DataFrames de comparaison
+"""
+from typing import Dict, List, Optional
+import pandas as pd
+from app.config import Config
+
+
+def pyarrow_available() -> bool:
+    """Vérifie si pyarrow est installé (dépendance optionnelle)"""
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_string_storage(storage: str = None) -> str:
+    """
+    Retourne le mode de stockage effectif des colonnes texte
+
+    Args:
+        storage: 'object' ou 'pyarrow'. Si None, utilise Config.STRING_STORAGE
+
+    Returns:
+        str: 'pyarrow' si demandé et disponible, sinon 'object'
+    """
+    storage = (storage or Config.STRING_STORAGE or 'object').lower()
+    if storage == 'pyarrow' and not pyarrow_available():
+        print("⚠️ STRING_STORAGE=pyarrow mais pyarrow n'est pas installé, utilisation du stockage object")
+        return 'object'
+    return 'pyarrow' if storage == 'pyarrow' else 'object'
+
+
+def get_string_dtype(storage: str = None):
+    """Retourne le dtype pandas à utiliser pour lire les colonnes texte"""
+    if get_string_storage(storage) == 'pyarrow':
+        return pd.StringDtype('pyarrow')
+    return str
+
+
+def to_string_storage(df: pd.DataFrame, storage: str = None) -> pd.DataFrame:
+    """
+    Convertit les colonnes texte (object) d'un DataFrame vers le stockage configuré.
+    Les colonnes numériques ou dates ne sont pas modifiées.
+    """
+    if get_string_storage(storage) != 'pyarrow' or df.empty:
+        return df
+
+    dtype = pd.StringDtype('pyarrow')
+    for col in df.select_dtypes(include=['object']).columns:
+        df[col] = df[col].astype(dtype)
+    return df
+
+
+def build_composite_key(df: pd.DataFrame, key_columns: List[str], regles: Optional[Dict[str, Dict]] = None) -> pd.Series:
+    """
+    Construit la clé composite 'val1|val2|...' de façon vectorisée.
+
+    Chaque colonne passe d'abord par sa normalisation (voir app.utils.normalisation_cles) :
+    un même fichier donne les mêmes clés quel que soit le lecteur et donc la stratégie
+    (types inférés ou texte brut, stockage object ou string[pyarrow]).
+
+    Args:
+        df: DataFrame (ou bloc) contenant les colonnes de clé
+        key_columns: Colonnes de la clé
+        regles: Règles de normalisation par colonne ; si None, Config.KEY_NORMALIZATION
+    """
+    from app.utils.normalisation_cles import normaliser_colonne
+
+    parts = [normaliser_colonne(df[col], col, regles) for col in key_columns]
+    key = parts[0]
+    if len(parts) > 1:
+        key = key.str.cat(parts[1:], sep='|')
+    if get_string_storage() == 'pyarrow':
+        key = key.astype(pd.StringDtype('pyarrow'))
+    return key.rename(None)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark du stockage des colonnes texte : object (str Python) vs string[pyarrow]
+
+Génère deux fichiers CSV synthétiques, puis mesure pour chaque mode la lecture
+(safe_read_csv), la construction des clés, la jointure et l'export Excel :
+temps écoulé et mémoire occupée par les DataFrames.
+
+Usage :
+    python benchmark_string_storage.py --rows 50000 --cols 200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# Ajouter le répertoire parent au path pour importer l'app
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+
+from app.config import Config
+from app.utils.encoding_utils import safe_read_csv
+from app.utils.string_storage import pyarrow_available
+from app.services.comparateur import ComparateurFichiers
+from app.services.generateur_excel import GenerateurExcel
+
+
+def generer_csv(path: str, rows: int, cols: int, seed: int):
+    """Génère un fichier CSV de test avec une clé 'id' et des colonnes texte"""
+    rng = np.random.default_rng(seed)
+    data = {'id': np.arange(rows) + seed * (rows // 10)}
+    for i in range(cols - 1):
+        data[f'col_{i}'] = rng.choice(['ALPHA', 'BETA', 'GAMMA', 'DELTA-42', 'EPSILON_001'], size=rows)
+    pd.DataFrame(data).to_csv(path, index=False)
+
+
+def mesurer(mode: str, file1: str, file2: str, export_path: str) -> dict:
+    """Exécute la chaîne lecture → clés → jointure → export pour un mode de stockage"""
+    Config.STRING_STORAGE = mode
+    timings = {}
+
+    start = time.perf_counter()
+    df1 = safe_read_csv(file1)
+    df2 = safe_read_csv(file2)
+    timings['lecture_s'] = time.perf_counter() - start
+    memoire_mb = (df1.memory_usage(deep=True).sum() + df2.memory_usage(deep=True).sum()) / 1024 / 1024
+
+    start = time.perf_counter()
+    results = ComparateurFichiers(df1, df2, ['id'], ['id']).comparer()
+    timings['cles_jointure_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    GenerateurExcel(results['ecarts_fichier1'], results['ecarts_fichier2'],
+                    results['communs'].head(1000)).generer_rapport_fichier(export_path)
+    timings['export_s'] = time.perf_counter() - start
+
+    return {'mode': mode, 'memoire_mb': memoire_mb, **timings,
+            'total_s': sum(timings.values()), 'n_common': results['n_common']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark object vs string[pyarrow]")
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--cols', type=int, default=200)
+    args = parser.parse_args()
+
+    # GenerateurExcel utilise des chemins relatifs à la racine du projet
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    if not pyarrow_available():
+        print("❌ pyarrow n'est pas installé : pip install pyarrow")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file1 = os.path.join(tmp, 'fichier1.csv')
+        file2 = os.path.join(tmp, 'fichier2.csv')
+        print(f"📝 Génération de 2 fichiers de {args.rows} lignes x {args.cols} colonnes...")
+        generer_csv(file1, args.rows, args.cols, seed=0)
+        generer_csv(file2, args.rows, args.cols, seed=1)
+
+        resultats = [mesurer(mode, file1, file2, os.path.join(tmp, f'rapport_{mode}.xlsx'))
+                     for mode in ('object', 'pyarrow')]
+
+    print("\n" + "=" * 78)
+    print(f"{'mode':<10}{'mémoire (MB)':>14}{'lecture (s)':>13}{'clés+jointure (s)':>19}"
+          f"{'export (s)':>12}{'total (s)':>10}")
+    for r in resultats:
+        print(f"{r['mode']:<10}{r['memoire_mb']:>14.1f}{r['lecture_s']:>13.2f}"
+              f"{r['cles_jointure_s']:>19.2f}{r['export_s']:>12.2f}{r['total_s']:>10.2f}")
+    print("=" * 78)
+
+    obj, arrow = resultats
+    if obj['n_common'] != arrow['n_common']:
+        print(f"⚠️ Résultats différents entre les modes: {obj['n_common']} vs {arrow['n_common']} communs")
+    print(f"💾 Gain mémoire: {obj['memoire_mb'] / arrow['memoire_mb']:.1f}x "
+          f"({obj['memoire_mb'] - arrow['memoire_mb']:.1f} MB économisés)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Add content addressable storage for source files
+
+Revision ID: c4e8a1d2f9b3
+Revises: b58d22c473b1
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1d2f9b3'
+down_revision = 'b58d22c473b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('blobs_sources',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('taille', sa.BigInteger(), nullable=False),
+    sa.Column('chemin', sa.String(length=512), nullable=False),
+    sa.Column('nom_origine', sa.String(length=255), nullable=True),
+    sa.Column('date_creation', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('blobs_sources', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_blobs_sources_sha256'), ['sha256'], unique=True)
+
+    op.create_table('references_blobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('blob_id', sa.Integer(), nullable=False),
+    sa.Column('projet_id', sa.Integer(), nullable=False),
+    sa.Column('chemin_lien', sa.String(length=512), nullable=False),
+    sa.Column('date_creation', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['blob_id'], ['blobs_sources.id'], ),
+    sa.ForeignKeyConstraint(['projet_id'], ['projets.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('references_blobs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_references_blobs_blob_id'), ['blob_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_references_blobs_projet_id'), ['projet_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('references_blobs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_references_blobs_projet_id'))
+        batch_op.drop_index(batch_op.f('ix_references_blobs_blob_id'))
+
+    op.drop_table('references_blobs')
+    with op.batch_alter_table('blobs_sources', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_blobs_sources_sha256'))
+
+    op.drop_table('blobs_sources')
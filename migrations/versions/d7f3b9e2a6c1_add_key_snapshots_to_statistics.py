@@ -0,0 +1,26 @@
+"""Add key hash snapshot path to comparison statistics
+
+Revision ID: d7f3b9e2a6c1
+Revises: c4e8a1d2f9b3
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7f3b9e2a6c1'
+down_revision = 'c4e8a1d2f9b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('statistiques_ecarts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('chemin_empreintes', sa.String(length=512), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('statistiques_ecarts', schema=None) as batch_op:
+        batch_op.drop_column('chemin_empreintes')
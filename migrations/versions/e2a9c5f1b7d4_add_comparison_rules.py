@@ -0,0 +1,41 @@
+"""Add per-column value comparison rules
+
+Revision ID: e2a9c5f1b7d4
+Revises: d7f3b9e2a6c1
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a9c5f1b7d4'
+down_revision = 'd7f3b9e2a6c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('regles_comparaison',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('projet_id', sa.Integer(), nullable=False),
+    sa.Column('colonne', sa.String(length=255), nullable=False),
+    sa.Column('type', sa.Enum('numerique', 'date', 'texte', 'ignorer'), nullable=False),
+    sa.Column('tolerance_abs', sa.Float(), nullable=True),
+    sa.Column('tolerance_rel', sa.Float(), nullable=True),
+    sa.Column('granularite', sa.String(length=20), nullable=True),
+    sa.Column('ignorer_casse', sa.Boolean(), nullable=True),
+    sa.Column('ignorer_espaces', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['projet_id'], ['projets.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('regles_comparaison', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_regles_comparaison_projet_id'), ['projet_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('regles_comparaison', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_regles_comparaison_projet_id'))
+
+    op.drop_table('regles_comparaison')
@@ -0,0 +1,26 @@
+"""Add discrepancy breakdown by dimension to comparison statistics
+
+Revision ID: f5b1d8e3c2a7
+Revises: e2a9c5f1b7d4
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5b1d8e3c2a7'
+down_revision = 'e2a9c5f1b7d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('statistiques_ecarts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ventilation', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('statistiques_ecarts', schema=None) as batch_op:
+        batch_op.drop_column('ventilation')